@@ -0,0 +1,303 @@
+"""Throughput and latency of publish, bulk_publish and consume, written as json to compare the releases.
+
+Run against the in memory transport (default) or a moto server:
+
+  python3 -m benchmarks.bench --output benchmark.json
+  python3 -m benchmarks.bench --transport aws --endpoint http://192.168.56.1:9010
+
+Each result has the messages per second, the p50/p99 latency in milliseconds and the aws api
+calls per message (counted on the clients, so the retries are counted too).
+"""
+import argparse
+import json
+import math
+import platform
+import sys
+import threading
+import time
+from collections import Counter
+
+from paper_cup.client import SNSClient, SQSClient, registry
+from paper_cup.metrics import PUBLISHED_AT_FIELD
+from paper_cup.paper_cup import ConsumePC, PublishPC
+
+PUBLISH_TOPIC = 'bench_publish' # without subscription, only the publishing is measured
+CONSUME_TOPIC = 'bench_consume'
+CONSUME_QUEUE = 'bench_consume'
+BULK_SIZE = 100 # messages by bulk_publish call
+
+
+class ApiCalls(object):
+  """Count the aws api calls of the shared clients, by operation."""
+
+  def __init__(self):
+    self.counts = Counter()
+    self._installed = set()
+    self._lock = threading.Lock()
+
+  def add(self, operation):
+    with self._lock:
+      self.counts[operation] += 1
+
+  def snapshot(self):
+    with self._lock:
+      return Counter(self.counts)
+
+  def install(self, transport_object):
+    """Count the calls of a boto3 client or resource, or of a memory one."""
+    if id(transport_object) in self._installed:
+      return
+    self._installed.add(id(transport_object))
+
+    meta = getattr(transport_object, 'meta', None)
+    if meta is not None and hasattr(meta, 'events'):
+      meta.events.register('before-call', lambda model, **kwargs: self.add(model.name))
+    elif meta is not None and hasattr(meta, 'client'):
+      # boto3 resource, it calls go through it client
+      self.install(meta.client)
+    elif hasattr(transport_object, '_client'):
+      # memory resource
+      self.install(transport_object._client)
+    else:
+      for name in dir(transport_object):
+        method = getattr(transport_object, name)
+        if not name.startswith('_') and callable(method):
+          setattr(transport_object, name, self._counted(name, method))
+
+  def _counted(self, name, method):
+    operation = ''.join(part.capitalize() for part in name.split('_'))
+
+    def counted(*args, **kwargs):
+      self.add(operation)
+      return method(*args, **kwargs)
+    return counted
+
+
+def percentile(values, percent):
+  """Nearest rank percentile of the values, None without values."""
+  if not values:
+    return None
+  values = sorted(values)
+  return values[min(len(values) - 1, max(0, int(math.ceil(percent / 100.0 * len(values))) - 1))]
+
+
+def result(name, params, messages, seconds, latencies, calls):
+  """Json result of one benchmark."""
+  return {
+      'name': name,
+      'params': params,
+      'messages': messages,
+      'seconds': round(seconds, 4),
+      'messages_per_second': round(messages / seconds, 1) if seconds else None,
+      'latency_ms': {
+          'p50': percentile(latencies, 50) and round(percentile(latencies, 50) * 1000, 3),
+          'p99': percentile(latencies, 99) and round(percentile(latencies, 99) * 1000, 3),
+          'max': latencies and round(max(latencies) * 1000, 3),
+      },
+      'api_calls': dict(calls),
+      'api_calls_per_message': round(float(sum(calls.values())) / messages, 4) if messages else None,
+  }
+
+
+# ################ Publisher and consumer of the benchmarks
+
+class PublishBenchPC(PublishPC):
+  """Publisher of the benchmark messages."""
+  PC_SNS_TOPIC = PUBLISH_TOPIC
+
+
+class BenchRootPC(ConsumePC):
+  """Root consumer of the benchmark queue."""
+  PC_SQS_QUEUE = CONSUME_QUEUE
+
+
+class ConsumeBenchPC(BenchRootPC):
+  """Consumer of the benchmark messages, it action cost the `cost` seconds of the message."""
+
+  latencies = []
+  _lock = threading.Lock()
+
+  def bench(self, message):
+    if message['cost']:
+      time.sleep(message['cost'])
+    # stamped by the publisher
+    latency = time.time() - message[PUBLISHED_AT_FIELD]
+    with self._lock:
+      self.latencies.append(latency)
+
+
+def message(size, cost=0):
+  """Benchmark message with about `size` bytes of data."""
+  return {'data': 'x' * size, 'cost': cost}
+
+
+class Benchmark(object):
+  """Create the topics and queue on the transport and run the benchmarks."""
+
+  def __init__(self, transport='memory', endpoint=None, messages=1000):
+    for cls in (PublishBenchPC, BenchRootPC):
+      cls.PC_TRANSPORT = transport
+      if endpoint:
+        cls.PC_AWS_LOCAL_ENDPOINT = endpoint
+    self.transport = transport
+    self.messages = messages
+    self.calls = ApiCalls()
+
+    settings = dict(region=BenchRootPC.PC_AWS_REGION, aws_access_key_id=BenchRootPC.PC_AWS_ACCESS_KEY_ID, aws_secret_access_key=BenchRootPC.PC_AWS_SECRET_ACCESS_KEY_ID, transport=transport)
+    self.sns = SNSClient(BenchRootPC.PC_AWS_LOCAL_ENDPOINT, **settings)
+    self.sqs = SQSClient(BenchRootPC.PC_AWS_LOCAL_ENDPOINT, **settings)
+
+  def setup(self):
+    """Create the topics and the subscribed queue."""
+    self.sns.create_topic(PUBLISH_TOPIC)
+    self.sns.create_topic(CONSUME_TOPIC)
+    self.sqs.create_queue(CONSUME_QUEUE)
+    self.sns.add_sqs_subscription(CONSUME_TOPIC, self.sqs.get_queue_arn(CONSUME_QUEUE), raw=True)
+
+  def teardown(self):
+    """Delete the topics and the queue."""
+    self.sns.delete_topic(PUBLISH_TOPIC)
+    self.sns.delete_topic(CONSUME_TOPIC)
+    self.sqs.delete_queue(CONSUME_QUEUE)
+
+  def run(self, scenarios):
+    """Run the scenarios, return the json report."""
+    self.setup()
+    try:
+      results = []
+      for scenario in scenarios:
+        results.extend(getattr(self, scenario)())
+    finally:
+      self.teardown()
+      # drop the clients counting the calls
+      registry.clear()
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'transport': self.transport,
+            'messages': self.messages,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'results': results,
+    }
+
+  def _publisher(self, topic_name=PUBLISH_TOPIC):
+    publisher = PublishBenchPC()
+    publisher.PC_SNS_TOPIC = topic_name
+    self.calls.install(publisher.sns_client._sns_client)
+    return publisher
+
+  def _measure(self, name, params, messages, run):
+    """Run the benchmark and count it api calls, run return the latencies."""
+    before = self.calls.snapshot()
+    started_at = time.time()
+    latencies = run()
+    seconds = time.time() - started_at
+    calls = self.calls.snapshot()
+    calls.subtract(before)
+    # only the operations called, the unary + of Counter is python 3 only
+    return result(name, params, messages, seconds, latencies, Counter(dict((key, value) for key, value in calls.items() if value > 0)))
+
+  def publish(self):
+    """One sns publish by message."""
+    publisher = self._publisher()
+    publisher.sns_client.get_topic_arn(PUBLISH_TOPIC)
+
+    def run():
+      latencies = []
+      for _ in range(self.messages):
+        started_at = time.time()
+        publisher.publish(message(100), 'bench')
+        latencies.append(time.time() - started_at)
+      return latencies
+    return [self._measure('publish', {'size': 100}, self.messages, run)]
+
+  def bulk_publish(self):
+    """bulk_publish of BULK_SIZE messages of several sizes, the latency is the one of a call."""
+    publisher = self._publisher()
+    results = []
+    for mode in ('array', 'batch'):
+      for size in (100, 1000, 10000):
+
+        def run():
+          latencies = []
+          for start in range(0, self.messages, BULK_SIZE):
+            count = min(BULK_SIZE, self.messages - start)
+            started_at = time.time()
+            publisher.bulk_publish([message(size) for _ in range(count)], ['bench'] * count, mode=mode)
+            latencies.append(time.time() - started_at)
+          return latencies
+        results.append(self._measure('bulk_publish', {'mode': mode, 'size': size, 'bulk_size': BULK_SIZE}, self.messages, run))
+    return results
+
+  def consume(self):
+    """Consume of the messages published before, one by sqs message, with several action costs and workers.
+
+      The latency is from the publishing to the end of the action, the messages being all published
+      before the consume it is mostly the time they wait in the queue.
+    """
+    publisher = self._publisher(CONSUME_TOPIC)
+    consumer = BenchRootPC()
+    self.calls.install(consumer.sqs_client._sqs_client)
+    self.calls.install(consumer.sqs_client._sqs_resource)
+
+    results = []
+    for cost in (0, 0.001, 0.01):
+      for workers in (None, 4, 16):
+        # the slow actions with less messages to keep it short
+        count = self.messages if not cost else min(self.messages, 200)
+        for start in range(0, count, BULK_SIZE):
+          size = min(BULK_SIZE, count - start)
+          publisher.bulk_publish([message(100, cost) for _ in range(size)], ['bench'] * size, mode='batch')
+        ConsumeBenchPC.latencies = []
+
+        def run():
+          report = consumer.consume(workers=workers)
+          assert report.succeeded == count, 'consumed %d of %d messages' % (report.succeeded, count)
+          return ConsumeBenchPC.latencies
+        results.append(self._measure('consume', {'cost': cost, 'workers': workers}, count, run))
+    return results
+
+  def get_topic_arn(self):
+    """Topic arn lookups, from the cache and without it."""
+    results = []
+    for cached in (True, False):
+
+      def run():
+        latencies = []
+        for _ in range(self.messages):
+          if not cached:
+            self.sns.invalidate_topic_arn(PUBLISH_TOPIC)
+          started_at = time.time()
+          self.sns.get_topic_arn(PUBLISH_TOPIC)
+          latencies.append(time.time() - started_at)
+        return latencies
+      self.calls.install(self.sns._sns_client)
+      results.append(self._measure('get_topic_arn', {'cached': cached}, self.messages, run))
+    return results
+
+
+SCENARIOS = ['publish', 'bulk_publish', 'consume', 'get_topic_arn']
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--transport', default='memory', help="'memory' (default) or 'aws' for a moto server")
+  parser.add_argument('--endpoint', help='endpoint of the moto server (default: PC_AWS_LOCAL_ENDPOINT)')
+  parser.add_argument('--messages', type=int, default=1000, help='messages by benchmark')
+  parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='benchmark to run, all by default')
+  parser.add_argument('--output', help='json file of the results (default: stdout)')
+  args = parser.parse_args(argv)
+
+  report = Benchmark(args.transport, args.endpoint, args.messages).run(args.scenario or SCENARIOS)
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+  else:
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+  main()
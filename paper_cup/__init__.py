@@ -1,3 +1,9 @@
+import sys
+
 from .paper_cup import PaperCup, ConsumePC, PublishPC
 from .client import SNSClient, SQSClient
 from .decorators import retry
+from .multi_queue import MultiQueueConsumePC
+
+if sys.version_info >= (3, 5):
+  from .aio import AsyncConsumePC, AsyncPublishPC, async_retry
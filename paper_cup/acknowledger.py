@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Acknowledger(object):
+  """Delete the consumed sqs messages by batch instead of one call per message.
+
+    Receipt handles are grouped in delete_message_batch calls of up to 10 entries.
+    A batch is sent as soon as it is full, when `flush` is called or, if a
+    `flush_interval` is given, every `flush_interval` seconds from a background thread.
+    Entries that failed on the sqs side are retried alone, the ones that still fail
+    are logged, given to `on_failure` and returned by the next `flush`.
+  """
+
+  MAX_BATCH_SIZE = 10 # sqs limit
+  RETRY_DELAY = 0.1
+
+  def __init__(self, sqs_client, queue_name, batch_size=MAX_BATCH_SIZE, flush_interval=None, retries=2, on_failure=None):
+    """Set the queue to acknowledge on and start the flush timer if needed."""
+    self.sqs_client = sqs_client
+    self.queue_name = queue_name
+    self.batch_size = max(1, min(batch_size, self.MAX_BATCH_SIZE))
+    self.flush_interval = flush_interval
+    self.retries = retries
+    self.on_failure = on_failure
+
+    self._pending = [] # list of (message_id, receipt_handle)
+    self._failures = []
+    self._lock = threading.Lock()
+    self._stopped = threading.Event()
+    self._timer = None
+
+    if flush_interval:
+      self._timer = threading.Thread(target=self._flush_periodically, name='paper-cup-acknowledger')
+      self._timer.daemon = True
+      self._timer.start()
+
+  def ack(self, message):
+    """Queue the deletion of a received sqs message."""
+    batch = None
+    with self._lock:
+      self._pending.append((message.message_id, message.receipt_handle))
+      if len(self._pending) >= self.batch_size:
+        batch = self._pending[:self.batch_size]
+        del self._pending[:self.batch_size]
+
+    if batch:
+      self._delete(batch)
+
+  def flush(self):
+    """Delete all the queued messages and return the failures since the last flush."""
+    with self._lock:
+      pending, self._pending = self._pending, []
+
+    for i in range(0, len(pending), self.batch_size):
+      self._delete(pending[i:i + self.batch_size])
+
+    with self._lock:
+      failures, self._failures = self._failures, []
+    return failures
+
+  def close(self):
+    """Stop the flush timer and delete what is left."""
+    self._stopped.set()
+    if self._timer:
+      self._timer.join()
+    return self.flush()
+
+  def _flush_periodically(self):
+    """Background loop of the flush timer."""
+    while not self._stopped.wait(self.flush_interval):
+      try:
+        self.flush()
+      except Exception:
+        logger.exception('Failed to delete sqs messages by batch.')
+
+  def _delete(self, batch):
+    """Send one delete_message_batch call and retry the entries that failed on sqs side."""
+    failed = []
+    for attempt in range(self.retries + 1):
+      if attempt:
+        time.sleep(self.RETRY_DELAY * attempt)
+
+      # ids only need to be unique in the request, use the position in the batch
+      entries = [{'Id': str(i), 'ReceiptHandle': receipt_handle} for i, (_, receipt_handle) in enumerate(batch)]
+      response = self.sqs_client.delete_message_batch(self.queue_name, entries)
+
+      retryable = []
+      for failure in response.get('Failed', []):
+        message_id, receipt_handle = batch[int(failure['Id'])]
+        # an error from our side (ex: expired receipt handle) will fail again
+        if failure.get('SenderFault') or attempt == self.retries:
+          failed.append({
+              'message_id': message_id,
+              'receipt_handle': receipt_handle,
+              'code': failure.get('Code'),
+              'message': failure.get('Message'),
+              'sender_fault': failure.get('SenderFault', False),
+          })
+        else:
+          retryable.append((message_id, receipt_handle))
+
+      if not retryable:
+        break
+      batch = retryable
+
+    if failed:
+      for failure in failed:
+        logger.warning('Failed to delete sqs message %s: %s %s', failure['message_id'], failure['code'], failure['message'])
+      with self._lock:
+        self._failures.extend(failed)
+      if self.on_failure:
+        self.on_failure(failed)
@@ -0,0 +1,284 @@
+"""Asyncio version of the publisher and consumer (python 3.5+).
+
+boto3 is blocking, the aws calls are run on a small thread pool shared by all the
+instances while the actions and the retries run on the event loop.
+"""
+import asyncio
+import inspect
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from botocore.exceptions import NoCredentialsError
+
+from .claim_check import is_claim_check
+from .client import SNSClient, SQSClient, is_throttling_error
+from .decorators import RetryCall
+from .fifo import message_group
+from .paper_cup import PaperCup, ConsumePC, PublishPC, _ConsumeSession
+
+logger = logging.getLogger(__name__)
+
+_io_executor = None
+
+
+def _get_io_executor():
+  """Thread pool shared by all the instances to run the boto3 calls."""
+  global _io_executor
+  if _io_executor is None:
+    _io_executor = ThreadPoolExecutor(max_workers=PaperCup.PC_ASYNC_IO_WORKERS)
+  return _io_executor
+
+
+async def run_blocking(func, *args):
+  """Run a blocking function on the shared thread pool."""
+  return await asyncio.get_event_loop().run_in_executor(_get_io_executor(), func, *args)
+
+
+def _without_retry(method):
+  """Get the client method without it retry, that block the thread while waiting."""
+  return inspect.unwrap(method.__func__).__get__(method.__self__)
+
+
+def async_retry(ExceptionToCheck, tries=4, delay=3, backoff=2, logger=None, jitter=None, max_delay=None, deadline=None, retry_if=None, guard=None):
+  """Retry calling the decorated coroutine using an exponential backoff.
+
+    Same as `decorators.retry`, with the same options, but wait with asyncio.sleep so the event loop is not blocked.
+  """
+  def deco_retry(f):
+
+    @wraps(f)
+    async def f_retry(*args, **kwargs):
+      call = RetryCall(
+          ExceptionToCheck, tries=tries, delay=delay, backoff=backoff, logger=logger, jitter=jitter,
+          max_delay=max_delay, deadline=deadline, retry_if=retry_if, guard=guard(*args, **kwargs) if guard else None, name=f.__name__,
+      )
+      try:
+        while True:
+          call.before()
+          try:
+            result = await f(*args, **kwargs)
+          except Exception as e:
+            wait = call.failed(e)
+            if wait is None:
+              raise
+            await asyncio.sleep(wait)
+          else:
+            call.succeeded()
+            return result
+      finally:
+        call.done()
+
+    return f_retry  # true decorator
+
+  return deco_retry
+
+
+class AsyncPublishPC(PublishPC):
+  """Publisher to use from asyncio code, the publish methods are coroutines.
+
+    The settings are the ones of PublishPC: with PC_PUBLISH_BUFFERED `publish` only enqueue the
+    message, `bulk_publish` pack the messages with PC_BULK_PUBLISH_MODE or `mode`.
+  """
+
+  _pc_base_class = True
+
+  async def publish(self, message, action, callback=None):
+    """Send message to sns.
+
+      When buffered the message is only enqueued and an asyncio future of it sns message id is returned,
+      `callback` is called with the concurrent Future once the message is sent. The enqueue is done
+      from the shared thread pool as a full buffer block it.
+    """
+    if self.buffer:
+      future = await run_blocking(self.buffer.publish, message, action, callback)
+      return asyncio.wrap_future(future)
+
+    if self.sns_client:
+      message = self._add_more_data(message, action)
+      payload, fifo_ids = self._serialize(message)
+      if self.PC_CLAIM_CHECK_STORE:
+        # a big message is uploaded to the payload store
+        message, attributes = await run_blocking(self._encode, payload, [action])
+      else:
+        message, attributes = self._encode(payload, [action])
+      with self._measured(1):
+        response = await self._sns_publish(message, attributes, *(fifo_ids or ()))
+      self._count_published(1)
+      return response
+
+  async def bulk_publish(self, list_message, list_action, mode=None):
+    """Send message by bulk to sns and return a PublishResult by message, see `PublishPC.bulk_publish`.
+
+      The packing and the sns calls, with their retries, are run on the shared thread pool.
+    """
+    if self.sns_client:
+      return await run_blocking(super(AsyncPublishPC, self).bulk_publish, list_message, list_action, mode)
+    return []
+
+  @async_retry(NoCredentialsError, **dict(SNSClient.CUSTOM_RETRY_RULE, guard=lambda publisher, *args, **kwargs: publisher.sns_client.guard))
+  async def _sns_publish(self, message, attributes=None, group_id=None, deduplication_id=None):
+    """Publish the message to the topic from the shared thread pool, once the rate limiter allow it.
+
+      Each attempt of the retry run this, every throttled one lower the rate.
+    """
+    if not self.rate_limiter:
+      return await run_blocking(self._publish_once, message, attributes, group_id, deduplication_id)
+
+    size = len(message.encode('utf-8'))
+    while not self.rate_limiter.try_acquire(1, size):
+      await asyncio.sleep(self.rate_limiter.wait_time(1, size))
+    try:
+      response = await run_blocking(self._publish_once, message, attributes, group_id, deduplication_id)
+    except Exception as e:
+      if is_throttling_error(e):
+        self.rate_limiter.throttled()
+      raise
+    self.rate_limiter.succeeded()
+    return response
+
+  def _publish_once(self, message, attributes, group_id, deduplication_id):
+    """One sns publish call, the topic arn is resolved first so none of them wait in a retry of the thread."""
+    _without_retry(self.sns_client.get_topic_arn)(self.PC_SNS_TOPIC)
+    return _without_retry(self.sns_client.publish)(message, self.PC_SNS_TOPIC, attributes, group_id, deduplication_id)
+
+
+class AsyncConsumePC(ConsumePC):
+  """Consumer to use from asyncio code.
+
+    The consumer action classes can define their actions as coroutines (`async def`), they run
+    concurrently on the event loop, up to PC_ASYNC_CONCURRENCY at the same time. The blocking
+    actions are run on the shared thread pool.
+  """
+
+  _pc_base_class = True
+
+  async def consume(self, concurrency=None):
+    """Read the message in queue and use the class that will handle the action.
+
+      A message is deleted once all its actions are done, until then a heartbeat extend it visibility
+      timeout. Like `ConsumePC.consume` the failed items are requeued alone and a ConsumeReport is returned,
+      without PC_ACK_FLUSH_INTERVAL the deletions are flushed once all the messages of a batch are done.
+      From a fifo queue the messages of a group are consumed in order.
+    """
+    if self.sqs_client.queue:
+      dispatcher = self._get_dispatcher()
+      session = _ConsumeSession(self)
+      semaphore = asyncio.Semaphore(concurrency or self.PC_ASYNC_CONCURRENCY)
+      tasks = set()
+      groups = {} # group id: task of the last message of the group
+
+      def group_done(group, task):
+        if groups.get(group) is task:
+          del groups[group]
+
+      try:
+        messages = await self._receive_messages(WaitTimeSeconds=20)
+        while messages:
+          session.received(messages)
+          batch = []
+          for message in messages:
+            # wait for a free slot before starting a new message
+            await semaphore.acquire()
+            group = message_group(message) if session.ordered else None
+            task = asyncio.ensure_future(self._consume_message(message, dispatcher, session, groups.get(group)))
+            task.add_done_callback(lambda _: semaphore.release())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            batch.append(task)
+            if group is not None:
+              groups[group] = task
+              task.add_done_callback(partial(group_done, group))
+
+          if not self.PC_ACK_FLUSH_INTERVAL:
+            flush = asyncio.ensure_future(self._flush_batch(batch, session))
+            tasks.add(flush)
+            flush.add_done_callback(tasks.discard)
+          messages = await self._receive_messages()
+      finally:
+        # let the actions in flight finish before deleting their messages
+        if tasks:
+          await asyncio.wait(list(tasks))
+        await run_blocking(session.close)
+
+      return session.report
+
+  async def _flush_batch(self, batch, session):
+    """Delete the messages of the batch once their tasks are done, like `_ConsumeSession.submit`."""
+    await asyncio.wait(batch)
+    try:
+      await run_blocking(session.acknowledger.flush)
+    except Exception:
+      logger.exception('Failed to delete sqs messages by batch.')
+
+  @async_retry(NoCredentialsError, **dict(SQSClient.CUSTOM_RETRY_RULE, guard=lambda consumer, *args, **kwargs: consumer.sqs_client.guard))
+  async def _receive_messages(self, **kwargs):
+    """Receive a batch of messages from the shared thread pool."""
+    return await run_blocking(lambda: self._receive(**kwargs))
+
+  async def _consume_message(self, message, dispatcher, session, previous=None):
+    """Run the actions of one sqs message and acknowledge it once they are done, the failed items are requeued.
+
+      With the task of the `previous` message of the group, it wait for it and it actions are run one
+      after the other. Return True if all the actions succeeded.
+    """
+    consumed = False
+    try:
+      blocked = previous is not None and not await previous
+      if is_claim_check(message):
+        # the payload is downloaded
+        msgs = await run_blocking(session.decode, message)
+      else:
+        msgs = session.decode(message)
+      if msgs is None:
+        return False
+
+      if blocked:
+        failures = session.blocked_failures(msgs, message_group(message))
+      elif session.ordered:
+        failures = await self._consume_ordered_async(msgs, dispatcher, session, message_group(message))
+      else:
+        results = await asyncio.gather(*[self._consume_msg_async(msg, dispatcher) for msg in msgs], return_exceptions=True)
+        failures = [(msg, result) for msg, result in zip(msgs, results) if isinstance(result, Exception)]
+      await run_blocking(session.done, message, failures)
+      consumed = not failures
+    except Exception:
+      logger.exception('Failed to consume message %s.', message.message_id)
+    finally:
+      session.heartbeat.remove(message)
+    return consumed
+
+  async def _consume_ordered_async(self, msgs, dispatcher, session, group):
+    """Run the actions of the msgs of a fifo message one after the other, return the (msg, error) of the failed ones.
+
+      After a failure the next msgs are not run, they fail with a GroupBlockedError.
+    """
+    failures = []
+    for msg in msgs:
+      if failures:
+        failures.extend(session.blocked_failures([msg], group))
+        continue
+      try:
+        await self._consume_msg_async(msg, dispatcher)
+      except Exception as e:
+        failures.append((msg, e))
+    return failures
+
+  async def _consume_msg_async(self, msg, dispatcher):
+    """Common call to consume the queue, await the action or run it on the thread pool if it is blocking."""
+    handler = dispatcher.resolve(msg)
+    if handler is None:
+      return
+
+    if not dispatcher.metrics:
+      await self._run_action(handler, msg)
+      return
+    with dispatcher.measured(msg):
+      await self._run_action(handler, msg)
+
+  async def _run_action(self, handler, msg):
+    """Await the action or run it on the thread pool if it is blocking."""
+    if asyncio.iscoroutinefunction(handler):
+      await handler(msg)
+    else:
+      await run_blocking(handler, msg)
@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+try:
+  from queue import Empty, Full, Queue
+except ImportError: # python 2
+  from Queue import Empty, Full, Queue
+
+logger = logging.getLogger(__name__)
+
+
+class BufferFullError(Exception):
+  """The message is dropped as the buffer of the publisher is full."""
+
+
+class BufferedPublisher(object):
+  """Publish the messages by batch from a background thread.
+
+    `publish` only enqueue the message and return a Future of it sns message id. The background
+    thread send a batch when it has `max_batch_size` messages or `max_batch_bytes` bytes, or
+    `linger_ms` after the first message of the batch, with the bulk publish packing of the publisher.
+    When the queue of `max_queue_size` messages is full `on_full` decide to 'block' the caller
+    until there is room, or to 'drop' the message (the future fail with BufferFullError).
+  """
+
+  ON_FULL_POLICIES = ('block', 'drop')
+
+  def __init__(self, publisher, max_batch_size=100, max_batch_bytes=256000, linger_ms=50, max_queue_size=10000, on_full='block', mode=None):
+    """Start the background thread."""
+    assert(on_full in self.ON_FULL_POLICIES)
+    self.publisher = publisher
+    self.max_batch_size = max_batch_size
+    self.max_batch_bytes = max_batch_bytes
+    self.linger = linger_ms / 1000.0
+    self.on_full = on_full
+    self.mode = mode
+    self.dropped = 0
+
+    self._queue = Queue(maxsize=max_queue_size)
+    self._flush_requested = threading.Event()
+    self._closed = threading.Event()
+    self._lock = threading.Lock()
+
+    self._thread = threading.Thread(target=self._run, name='paper-cup-publisher')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def publish(self, message, action, callback=None):
+    """Enqueue the message and return a Future, `callback` is called with it once the message is sent."""
+    if self._closed.is_set():
+      raise RuntimeError('The publisher is closed.')
+
+    future = Future()
+    if callback:
+      future.add_done_callback(callback)
+
+    item = (self.publisher._add_more_data(message, action), future)
+    try:
+      self._queue.put(item, block=(self.on_full == 'block'))
+    except Full:
+      with self._lock:
+        self.dropped += 1
+      future.set_exception(BufferFullError('The publisher buffer is full, message dropped.'))
+    return future
+
+  def flush(self):
+    """Send the messages enqueued now without waiting for the linger time, and wait until they are sent."""
+    self._flush_requested.set()
+    self._queue.join()
+
+  def close(self):
+    """Send the messages left and stop the background thread."""
+    if not self._closed.is_set():
+      self.flush()
+      self._closed.set()
+      self._thread.join()
+
+  def _run(self):
+    """Background loop sending the batches."""
+    while not (self._closed.is_set() and self._queue.empty()):
+      batch = self._collect()
+      if batch:
+        try:
+          self._send(batch)
+        finally:
+          for _ in batch:
+            self._queue.task_done()
+
+  def _collect(self):
+    """Wait for the next batch of (serialized message, action, future)."""
+    batch = []
+    size = 0
+    deadline = None
+    while len(batch) < self.max_batch_size and size < self.max_batch_bytes:
+      timeout = self._timeout(deadline)
+      if timeout is None:
+        break
+
+      try:
+        message, future = self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait()
+      except Empty:
+        if deadline is None:
+          # nothing to send, check if we are closed
+          if self._closed.is_set() or self._flush_requested.is_set():
+            self._flush_requested.clear()
+            return batch
+          continue
+        break
+
+      if deadline is None:
+        deadline = time.time() + self.linger
+
+      item = self._prepare(message, future)
+      if item is None:
+        self._queue.task_done()
+        continue
+      batch.append(item)
+      size += len(item[0])
+
+    if self._queue.empty():
+      self._flush_requested.clear()
+    return batch
+
+  def _timeout(self, deadline):
+    """Wait for the next message of the batch, None once the linger time is over."""
+    if deadline is None:
+      return 0.1
+    if self._flush_requested.is_set():
+      return 0
+    timeout = deadline - time.time()
+    return timeout if timeout > 0 else None
+
+  def _prepare(self, message, future):
+    """Get the (serialized message, fifo ids, action, future) of an enqueued message, None if it is cancelled or can't be serialized."""
+    if not future.set_running_or_notify_cancel():
+      return None
+    try:
+      payload, fifo_ids = self.publisher._serialize(message)
+    except Exception as e:
+      future.set_exception(e)
+      return None
+    return payload, fifo_ids, message['action'], future
+
+  def _send(self, batch):
+    """Publish the batch and resolve the futures."""
+    try:
+      results = self.publisher._publish_serialized(((i,) + item[:3] for i, item in enumerate(batch)), self.mode or self.publisher.PC_BULK_PUBLISH_MODE)
+    except Exception as e:
+      logger.exception('Failed to publish %d messages.', len(batch))
+      for _, _, _, future in batch:
+        future.set_exception(e)
+      return
+
+    for result in results:
+      future = batch[result.index][3]
+      if result.success:
+        future.set_result(result.message_id)
+      else:
+        future.set_exception(result.error)
@@ -0,0 +1,204 @@
+"""Claim check: the messages too big for sns are stored in a payload store and only their reference is published.
+
+The publisher stores the serialized (and compressed) bytes of the message and publish the reference
+('s3://bucket/key' or 'file:///path') with the CLAIM_CHECK_ATTRIBUTE message attribute. The consumer
+load the payload from the store of the reference, streamed and decompressed chunk by chunk, the small
+payloads are kept in a read-through cache for the redeliveries. A store only open the references in
+it bucket or directory, the consumers don't read whatever a message points to.
+
+The payloads are not deleted once consumed as several queues can be subscribed to the topic, expire
+them with a lifecycle rule of the bucket or by cleaning the directory.
+"""
+import io
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from .client import S3Client
+from .codec import CLAIM_CHECK_ATTRIBUTE, decode_stream
+
+logger = logging.getLogger(__name__)
+
+
+class PayloadStore(object):
+  """Where the payloads are stored, a reference starts with the `scheme` of the store."""
+
+  scheme = None
+
+  def put(self, data):
+    """Store the bytes, return the reference of them."""
+    raise NotImplementedError()
+
+  def open(self, reference):
+    """Get a (file like object of the bytes, size) of the reference, to read and close."""
+    raise NotImplementedError()
+
+  def delete(self, reference):
+    """Delete the payload of the reference."""
+    raise NotImplementedError()
+
+  def _new_key(self):
+    """Unique name of a new payload."""
+    return uuid.uuid4().hex
+
+
+class S3PayloadStore(PayloadStore):
+  """Payloads in a s3 bucket, under the `prefix` keys."""
+
+  scheme = 's3'
+
+  def __init__(self, bucket, endpoint_url, region, aws_access_key_id=None, aws_secret_access_key=None, prefix='paper_cup/', transport='aws'):
+    """Use the bucket with the shared boto3 client of the settings, the references to an other bucket are refused."""
+    self.bucket = bucket
+    self.prefix = prefix
+    self.s3_client = S3Client(endpoint_url, region, aws_access_key_id, aws_secret_access_key, transport=transport)
+
+  def put(self, data):
+    assert(self.bucket)
+    key = self.prefix + self._new_key()
+    self.s3_client.put_object(self.bucket, key, data)
+    return 's3://%s/%s' % (self.bucket, key)
+
+  def open(self, reference):
+    response = self.s3_client.get_object(*self._location(reference))
+    return response['Body'], response['ContentLength']
+
+  def delete(self, reference):
+    self.s3_client.delete_object(*self._location(reference))
+
+  def _location(self, reference):
+    """(bucket, key) of the reference, in the bucket of the store."""
+    bucket, _, key = reference[len('s3://'):].partition('/')
+    if not self.bucket or bucket != self.bucket:
+      raise ValueError('The payload %s is not in the bucket %s.' % (reference, self.bucket))
+    return bucket, key
+
+
+class FileSystemPayloadStore(PayloadStore):
+  """Payloads in files of a directory shared by the publishers and the consumers."""
+
+  scheme = 'file'
+
+  def __init__(self, directory=None):
+    """Use the directory, the references to a file out of it are refused."""
+    self.directory = directory
+
+  def put(self, data):
+    assert(self.directory)
+    path = os.path.abspath(os.path.join(self.directory, self._new_key()))
+    # written aside then renamed, the consumers never read a partial file
+    with open(path + '.tmp', 'wb') as f:
+      f.write(data)
+    os.rename(path + '.tmp', path)
+    return 'file://' + path
+
+  def open(self, reference):
+    f = open(self._path(reference), 'rb')
+    return f, os.fstat(f.fileno()).st_size
+
+  def delete(self, reference):
+    os.remove(self._path(reference))
+
+  def _path(self, reference):
+    """Path of the reference, in the directory of the store."""
+    path = os.path.realpath(reference[len('file://'):])
+    if not self.directory or not path.startswith(os.path.join(os.path.realpath(self.directory), '')):
+      raise ValueError('The payload %s is not in the directory %s.' % (reference, self.directory))
+    return path
+
+
+class PayloadCache(object):
+  """Least recently used payloads up to `max_bytes`."""
+
+  def __init__(self, max_bytes):
+    self.max_bytes = max_bytes
+    self.size = 0
+    self.hits = 0
+    self.misses = 0
+    self._payloads = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, reference):
+    """Payload of the reference, None if not cached."""
+    with self._lock:
+      data = self._payloads.get(reference)
+      if data is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      # most recently used last
+      del self._payloads[reference]
+      self._payloads[reference] = data
+      return data
+
+  def set(self, reference, data):
+    """Cache the payload, the least recently used ones are dropped to make room."""
+    if len(data) > self.max_bytes:
+      return
+    with self._lock:
+      if reference in self._payloads:
+        return
+      self._payloads[reference] = data
+      self.size += len(data)
+      while self.size > self.max_bytes:
+        _, dropped = self._payloads.popitem(last=False)
+        self.size -= len(dropped)
+
+
+class ClaimCheck(object):
+  """Offload the payloads to the `store` and load the offloaded messages.
+
+    The references are loaded from the store of their scheme, the `store` or one built by
+    `build_store(scheme)` from the settings of the consumer. The payloads up to
+    `cache_item_bytes` are cached, up to `cache_bytes` in total, the bigger ones are streamed.
+  """
+
+  def __init__(self, store=None, build_store=None, cache_bytes=8 * 1024 * 1024, cache_item_bytes=1024 * 1024):
+    """Without `store` nothing is offloaded."""
+    self.store = store
+    self.build_store = build_store
+    self.cache = PayloadCache(cache_bytes)
+    self.cache_item_bytes = min(cache_item_bytes, cache_bytes)
+    self._stores = {store.scheme: store} if store else {}
+    self._lock = threading.Lock()
+
+  def offload(self, data, codec_name):
+    """Store the bytes of the codec, return the reference to publish and it message attributes."""
+    reference = self.store.put(data)
+    return reference, {CLAIM_CHECK_ATTRIBUTE: {'DataType': 'String', 'StringValue': codec_name}}
+
+  def load(self, reference, codec_name):
+    """Load the message of the reference."""
+    data = self.cache.get(reference)
+    if data is not None:
+      return decode_stream(io.BytesIO(data), codec_name)
+
+    stream, size = self._store(reference).open(reference)
+    try:
+      if size > self.cache_item_bytes:
+        return decode_stream(stream, codec_name)
+      data = stream.read()
+    finally:
+      stream.close()
+    self.cache.set(reference, data)
+    return decode_stream(io.BytesIO(data), codec_name)
+
+  def _store(self, reference):
+    """Store of the reference scheme, built once."""
+    scheme = reference.partition('://')[0]
+    store = self._stores.get(scheme)
+    if store is None:
+      with self._lock:
+        store = self._stores.get(scheme)
+        if store is None and self.build_store:
+          store = self._stores[scheme] = self.build_store(scheme)
+    if store is None:
+      raise ValueError('No payload store for %s.' % reference)
+    return store
+
+
+def is_claim_check(message):
+  """True if the sqs message is a reference to an offloaded message, without decoding it."""
+  return CLAIM_CHECK_ATTRIBUTE in (message.message_attributes or {}) or CLAIM_CHECK_ATTRIBUTE in message.body
@@ -0,0 +1,50 @@
+"""Command line of paper cup.
+
+  paper-cup worker myapp.consumers.RootPC --processes 2 --workers 8
+"""
+import argparse
+import logging
+import sys
+
+from .supervisor import LOG_FORMAT, Supervisor, load_consumer
+
+
+def worker(args):
+  """Run the consumer in supervised worker processes until SIGTERM."""
+  consumer_class = load_consumer(args.consumer)
+  supervisor = Supervisor(
+      consumer_class, processes=args.processes, workers=args.workers, executor=args.executor, drain_timeout=args.drain_timeout,
+      restart_delay=args.restart_delay, max_processes=args.max_processes, messages_per_process=args.messages_per_process,
+      scale_interval=args.scale_interval,
+  )
+  supervisor.run()
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog='paper-cup', description='Microservices communication using publish and subscribe.')
+  parser.add_argument('--log-level', default='INFO', help='logging level (default: INFO)')
+  commands = parser.add_subparsers(dest='command')
+  commands.required = True
+
+  worker_parser = commands.add_parser('worker', help='consume a queue with supervised worker processes')
+  worker_parser.add_argument('consumer', help='dotted path of the root consumer class, module.Class or module:Class')
+  worker_parser.add_argument('--processes', type=int, default=1, help='number of worker processes (default: 1)')
+  worker_parser.add_argument('--workers', type=int, help='actions run concurrently by each process (default: PC_CONSUME_WORKERS)')
+  worker_parser.add_argument('--executor', choices=['thread', 'process'], help='pool running the actions (default: PC_CONSUME_EXECUTOR)')
+  worker_parser.add_argument('--drain-timeout', type=float, default=30, help='seconds to finish the actions in flight on SIGTERM (default: 30)')
+  worker_parser.add_argument('--restart-delay', type=float, default=1, help='seconds before restarting a crashed process (default: 1)')
+  worker_parser.add_argument('--max-processes', type=int, help='scale up to this number of processes with the queue depth')
+  worker_parser.add_argument('--messages-per-process', type=int, default=100, help='queue depth by process when scaling (default: 100)')
+  worker_parser.add_argument('--scale-interval', type=float, default=30, help='seconds between two reads of the queue depth (default: 30)')
+  worker_parser.set_defaults(func=worker)
+
+  args = parser.parse_args(argv)
+  logging.basicConfig(level=args.log_level.upper(), format=LOG_FORMAT)
+  # the consumer module is imported from the current directory, like python -m
+  if '' not in sys.path:
+    sys.path.insert(0, '')
+  args.func(args)
+
+
+if __name__ == '__main__':
+  main()
@@ -1,6 +1,173 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import boto3
-from botocore.exceptions import NoCredentialsError
-from .decorators import retry
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError, NoCredentialsError
+from .decorators import CircuitBreaker, RetryBudget, RetryGuard, retry
+from . import memory
+from .fifo import is_fifo
+
+
+class ClientRegistry(object):
+  """Process wide cache of the boto3 clients and resources.
+
+    Creating a boto3 client is slow and use a lot of memory, all the SNSClient and SQSClient
+    with the same endpoint, region, credentials and pool size share the same boto3 client.
+    Clients are thread safe once created, the creation is done under a lock as boto3 sessions
+    are not. The cache is dropped in a forked process as the connections can't be shared.
+    The transport 'aws' build the boto3 clients, an other transport is a factory registered with
+    `register_transport` building objects with the same interface, like the in process 'memory' one.
+  """
+
+  def __init__(self):
+    """Start with no client."""
+    self._lock = threading.Lock()
+    self._pid = os.getpid()
+    self._sessions = {}
+    self._instances = {}
+    self._guards = {}
+    self._transports = {'memory': memory.build}
+
+  def register_transport(self, name, factory):
+    """Add a transport, factory(kind, service, endpoint_url, region, aws_access_key_id, aws_secret_access_key, config) build it clients and resources."""
+    self._transports[name] = factory
+
+  def client(self, service, endpoint_url, region, aws_access_key_id=None, aws_secret_access_key=None, max_pool_connections=None, transport='aws'):
+    """Get the shared boto3 client of the service, or the one of the transport."""
+    return self._get('client', service, endpoint_url, region, aws_access_key_id, aws_secret_access_key, max_pool_connections, transport)
+
+  def resource(self, service, endpoint_url, region, aws_access_key_id=None, aws_secret_access_key=None, max_pool_connections=None, transport='aws'):
+    """Get the shared boto3 resource of the service, or the one of the transport."""
+    return self._get('resource', service, endpoint_url, region, aws_access_key_id, aws_secret_access_key, max_pool_connections, transport)
+
+  def guard(self, service, endpoint_url, region, transport='aws', failure_threshold=5, reset_timeout=30, retry_ratio=0.1):
+    """Get the circuit breaker and retry budget shared by the clients of the service."""
+    key = (transport, service, endpoint_url, region)
+    with self._lock:
+      guard = self._guards.get(key)
+      if guard is None:
+        guard = RetryGuard(CircuitBreaker(failure_threshold, reset_timeout), RetryBudget(retry_ratio), tags={'service': service}, throttled_if=is_throttling_error)
+        self._guards[key] = guard
+    return guard
+
+  def clear(self):
+    """Drop all the clients, sessions and guards."""
+    with self._lock:
+      self._sessions.clear()
+      self._instances.clear()
+      self._guards.clear()
+
+  def _get(self, kind, service, endpoint_url, region, aws_access_key_id, aws_secret_access_key, max_pool_connections, transport='aws'):
+    """Get or create the client or resource."""
+    assert(transport == 'aws' or transport in self._transports)
+    credentials = (region, aws_access_key_id, aws_secret_access_key)
+    key = (transport, kind, service, endpoint_url, max_pool_connections) + credentials
+
+    if self._pid != os.getpid():
+      self._pid = os.getpid()
+      self.clear()
+
+    instance = self._instances.get(key)
+    if instance is None:
+      with self._lock:
+        instance = self._instances.get(key)
+        if instance is None and transport != 'aws':
+          config = Config(max_pool_connections=max_pool_connections) if max_pool_connections else None
+          instance = self._transports[transport](kind, service, endpoint_url, region, aws_access_key_id, aws_secret_access_key, config)
+          self._instances[key] = instance
+        elif instance is None:
+          session = self._sessions.get(credentials)
+          if session is None:
+            session = boto3.Session(region_name=region, aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key)
+            self._sessions[credentials] = session
+
+          config = Config(max_pool_connections=max_pool_connections) if max_pool_connections else None
+          instance = getattr(session, kind)(service, endpoint_url=endpoint_url, config=config)
+          self._instances[key] = instance
+    return instance
+
+
+registry = ClientRegistry()
+
+
+class ResolutionCache(object):
+  """Cache of resolved aws identifiers (topic arn, queue url) by name.
+
+    Entries expire after `ttl` seconds, or never if ttl is None.
+  """
+
+  def __init__(self, ttl=None):
+    """Start with an empty cache."""
+    self.ttl = ttl
+    self._entries = {}
+
+  def get(self, name):
+    """Return the cached value or None if missing or expired."""
+    entry = self._entries.get(name)
+    if entry is None:
+      return None
+
+    value, expire_at = entry
+    if expire_at is not None and expire_at <= time.time():
+      self._entries.pop(name, None)
+      return None
+    return value
+
+  def set(self, name, value):
+    """Store the value for the given name."""
+    expire_at = time.time() + self.ttl if self.ttl is not None else None
+    self._entries[name] = (value, expire_at)
+
+  def invalidate(self, name=None):
+    """Drop one entry, or all of them when no name is given."""
+    if name is None:
+      self._entries.clear()
+    else:
+      self._entries.pop(name, None)
+
+
+def _is_error_code(exception, error_codes):
+  """Check if the botocore client error has one of the given codes."""
+  return exception.response.get('Error', {}).get('Code') in error_codes
+
+
+# error codes of the aws throttling
+THROTTLING_ERROR_CODES = frozenset([
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled', 'RequestThrottledException',
+    'TooManyRequestsException', 'RequestLimitExceeded', 'SlowDown', 'KMS.ThrottlingException',
+])
+# error codes of the transient aws failures, the 5xx
+TRANSIENT_ERROR_CODES = frozenset([
+    'InternalError', 'InternalFailure', 'ServiceUnavailable', 'RequestTimeout', 'RequestTimeoutException',
+])
+
+
+def _status_code(exception):
+  """Http status of the botocore client error."""
+  return exception.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+
+
+def is_throttling_error(exception):
+  """True if aws refused the call because it is made too often."""
+  return isinstance(exception, ClientError) and (_is_error_code(exception, THROTTLING_ERROR_CODES) or _status_code(exception) == 429)
+
+
+def is_retryable_error(exception):
+  """True for the errors that can go away by retrying: throttling, 5xx and connection errors."""
+  if isinstance(exception, (ConnectionError, HTTPClientError)):
+    return True
+  if not isinstance(exception, ClientError):
+    return False
+  return is_throttling_error(exception) or _is_error_code(exception, TRANSIENT_ERROR_CODES) or _status_code(exception) >= 500
+
+
+def _own_guard(client, *args, **kwargs):
+  """Retry guard of the client, None while it is created."""
+  return getattr(client, 'guard', None)
 
 
 class SNSClient:
@@ -9,27 +176,75 @@ class SNSClient:
   RETRY_TRIES = 3
   RETRY_DELAY = 0.1
   RETRY_BACKOFF = 2
-  CUSTOM_RETRY_RULE = {'tries': RETRY_TRIES, 'delay': RETRY_DELAY, 'backoff': RETRY_BACKOFF}
+  RETRY_MAX_DELAY = 5
+  RETRY_DEADLINE = 30 # seconds after the first try, no retry after it
+  CUSTOM_RETRY_RULE = {
+      'tries': RETRY_TRIES, 'delay': RETRY_DELAY, 'backoff': RETRY_BACKOFF, 'jitter': 'full', 'max_delay': RETRY_MAX_DELAY,
+      'deadline': RETRY_DEADLINE, 'retry_if': is_retryable_error, 'guard': _own_guard,
+  }
+
+  # error codes meaning that the cached topic arn is not valid anymore
+  NOT_FOUND_ERROR_CODES = ('NotFound', 'NotFoundException')
 
   @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
-  def __init__(self, endpoint_url, region, aws_access_key_id=None, aws_secret_access_key=None):
-    """Constructor with already set in options."""
-    session = boto3.Session(region_name=region, aws_access_key_id=aws_secret_access_key, aws_secret_access_key=aws_secret_access_key)
-    self._sns_client = session.client('sns', endpoint_url=endpoint_url)
+  def __init__(self, endpoint_url, region, aws_access_key_id=None, aws_secret_access_key=None, cache_ttl=None, prewarm=None, max_pool_connections=None, transport='aws'):
+    """Constructor with already set in options.
+
+      `cache_ttl` is the lifetime in seconds of the topic arn cache (None: never expire).
+      `prewarm` is a list of topic names to resolve now so publishing don't have to.
+      `max_pool_connections` is the size of the http connection pool (None: botocore default).
+      `transport` is 'aws' for boto3, 'memory' for the topics and queues in the process (see memory.py).
+    """
+    self._sns_client = registry.client('sns', endpoint_url, region, aws_access_key_id, aws_secret_access_key, max_pool_connections, transport)
+    # circuit breaker and retry budget shared by all the SNS clients of the endpoint
+    self.guard = registry.guard('sns', endpoint_url, region, transport)
+    self._topic_arns = ResolutionCache(ttl=cache_ttl)
+
+    if prewarm:
+      self.warm_cache(prewarm)
+
+  def warm_cache(self, topic_names):
+    """Resolve and cache the arn of the given topics."""
+    for topic_name in topic_names:
+      self.get_topic_arn(topic_name)
+
+  def invalidate_topic_arn(self, topic_name=None):
+    """Forget the cached arn of a topic, or of all the topics."""
+    self._topic_arns.invalidate(topic_name)
+
+  @contextmanager
+  def _invalidate_on_not_found(self, topic_name):
+    """Drop the cached topic arn if sns tell us that the topic don't exist anymore."""
+    try:
+      yield
+    except ClientError as e:
+      if _is_error_code(e, self.NOT_FOUND_ERROR_CODES):
+        self.invalidate_topic_arn(topic_name)
+      raise
 
   @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
   def create_topic(self, topic_name):
-    """Create SNS topic by name."""
-    return self._sns_client.create_topic(Name=topic_name)['TopicArn']
+    """Create SNS topic by name, a fifo topic if the name ends with .fifo."""
+    kwargs = {'Attributes': {'FifoTopic': 'true'}} if is_fifo(topic_name) else {}
+    topic_arn = self._sns_client.create_topic(Name=topic_name, **kwargs)['TopicArn']
+    self._topic_arns.set(topic_name, topic_arn)
+    return topic_arn
 
   @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
   def delete_topic(self, topic_name):
     """Delete a given SNS topic from it arn."""
-    return self._sns_client.delete_topic(TopicArn=self.get_topic_arn(topic_name))
+    try:
+      return self._sns_client.delete_topic(TopicArn=self.get_topic_arn(topic_name))
+    finally:
+      self.invalidate_topic_arn(topic_name)
 
   @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
   def get_topic_arn(self, topic_name, token=None):
-    """Get sns topic by name and paginate until is found."""
+    """Get sns topic by name and paginate until is found, the arn is cached once found."""
+    if not token:
+      topic_arn = self._topic_arns.get(topic_name)
+      if topic_arn:
+        return topic_arn
 
     if token:
       list_topics = self._sns_client.list_topics(NextToken=token)
@@ -40,7 +255,9 @@ class SNSClient:
     topic_list = list_topics['Topics']
 
     for topic in topic_list:
-      if topic_name in topic['TopicArn'].split(':')[5]:
+      # exact match, 'orders' must not find 'orders.fifo'
+      if topic_name == topic['TopicArn'].split(':')[5]:
+        self._topic_arns.set(topic_name, topic['TopicArn'])
         return topic['TopicArn']
     else:
       if next_token:
@@ -48,22 +265,93 @@ class SNSClient:
       else:
         raise NotImplementedError('SNS topic not found!')
 
+  @property
+  def supports_fifo(self):
+    """False with a boto3 too old to publish to the fifo topics (python 2 boto3 1.9.170 has no MessageGroupId on publish)."""
+    meta = getattr(self._sns_client, 'meta', None)
+    if meta is None:
+      # the memory transport
+      return True
+    return 'MessageGroupId' in meta.service_model.operation_model('Publish').input_shape.members
+
+  def _check_fifo(self, topic_name):
+    """Fail with a clear error instead of the boto3 parameter validation of the fifo fields."""
+    if not self.supports_fifo:
+      raise NotImplementedError('Publishing to the fifo topic %s needs boto3 >= 1.16 (python 3.6+), got boto3 %s.' % (topic_name, boto3.__version__))
+
   @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
-  def publish(self, message, topic_name):
-    """Send message to all subscriber of this topic."""
-    return self._sns_client.publish(
-        TopicArn=self.get_topic_arn(topic_name),
-        Message=message,
-    )
+  def publish(self, message, topic_name, attributes=None, group_id=None, deduplication_id=None):
+    """Send message to all subscriber of this topic, with the sns message attributes if any.
+
+      A fifo topic require the `group_id` of the message, the messages of a group are delivered in
+      order, and a `deduplication_id` unless the topic use content based deduplication.
+    """
+    kwargs = {'MessageAttributes': attributes} if attributes else {}
+    if group_id:
+      self._check_fifo(topic_name)
+      kwargs['MessageGroupId'] = group_id
+    if deduplication_id:
+      kwargs['MessageDeduplicationId'] = deduplication_id
+    with self._invalidate_on_not_found(topic_name):
+      return self._sns_client.publish(
+          TopicArn=self.get_topic_arn(topic_name),
+          Message=message,
+          **kwargs
+      )
 
   @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
-  def add_sqs_subscription(self, topic_name, queue_arn):
-    """Subscribe the sqs queue to the topic."""
-    return self._sns_client.subscribe(
-        Protocol='sqs',
-        TopicArn=self.get_topic_arn(topic_name),
-        Endpoint=queue_arn,
-    )
+  def publish_batch(self, entries, topic_name):
+    """Send up to 10 messages to the topic in one call, entries are dict with Id, Message and optional MessageAttributes, MessageGroupId and MessageDeduplicationId.
+
+      publish_batch needs boto3 >= 1.20.5 (python 3.6+), with an older boto3 the entries are published
+      one by one and the response has the same Successful and Failed lists.
+    """
+    if any('MessageGroupId' in entry for entry in entries):
+      self._check_fifo(topic_name)
+    with self._invalidate_on_not_found(topic_name):
+      if not hasattr(self._sns_client, 'publish_batch'):
+        return self._publish_one_by_one(entries, self.get_topic_arn(topic_name))
+      return self._sns_client.publish_batch(
+          TopicArn=self.get_topic_arn(topic_name),
+          PublishBatchRequestEntries=entries,
+      )
+
+  def _publish_one_by_one(self, entries, topic_arn):
+    """Publish the batch entries with a publish call each, an entry that fail is in the Failed list and the next ones are still sent."""
+    response = {'Successful': [], 'Failed': []}
+    for entry in entries:
+      kwargs = dict((key, value) for key, value in entry.items() if key != 'Id')
+      try:
+        message_id = self._sns_client.publish(TopicArn=topic_arn, **kwargs)['MessageId']
+      except ClientError as e:
+        error = e.response.get('Error', {})
+        response['Failed'].append({'Id': entry['Id'], 'Code': error.get('Code'), 'Message': error.get('Message'), 'SenderFault': _status_code(e) < 500})
+      else:
+        response['Successful'].append({'Id': entry['Id'], 'MessageId': message_id})
+    return response
+
+  @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
+  def add_sqs_subscription(self, topic_name, queue_arn, raw=False, filter_policy=None):
+    """Subscribe the sqs queue to the topic.
+
+      With `raw` the sqs body is the published message instead of the sns json envelope of it
+      (RawMessageDelivery), the sns message attributes are sent as sqs message attributes.
+      With `filter_policy`, a dict of message attribute names to the list of accepted values, only
+      the matching messages are sent to the queue.
+    """
+    attributes = {}
+    if raw:
+      attributes['RawMessageDelivery'] = 'true'
+    if filter_policy:
+      attributes['FilterPolicy'] = json.dumps(filter_policy)
+    kwargs = {'Attributes': attributes} if attributes else {}
+    with self._invalidate_on_not_found(topic_name):
+      return self._sns_client.subscribe(
+          Protocol='sqs',
+          TopicArn=self.get_topic_arn(topic_name),
+          Endpoint=queue_arn,
+          **kwargs
+      )
 
 
 class SQSClient:
@@ -72,37 +360,153 @@ class SQSClient:
   RETRY_TRIES = 3
   RETRY_DELAY = 0.1
   RETRY_BACKOFF = 2
-  CUSTOM_RETRY_RULE = {'tries': RETRY_TRIES, 'delay': RETRY_DELAY, 'backoff': RETRY_BACKOFF}
+  RETRY_MAX_DELAY = 5
+  RETRY_DEADLINE = 30 # seconds after the first try, no retry after it
+  CUSTOM_RETRY_RULE = {
+      'tries': RETRY_TRIES, 'delay': RETRY_DELAY, 'backoff': RETRY_BACKOFF, 'jitter': 'full', 'max_delay': RETRY_MAX_DELAY,
+      'deadline': RETRY_DEADLINE, 'retry_if': is_retryable_error, 'guard': _own_guard,
+  }
+
+  # error codes meaning that the cached queue url is not valid anymore
+  NOT_FOUND_ERROR_CODES = ('AWS.SimpleQueueService.NonExistentQueue', 'QueueDoesNotExist')
 
   @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
-  def __init__(self, endpoint_url, region, aws_access_key_id=None, aws_secret_access_key=None):
-    """Constructor with already set in options."""
-    session = boto3.Session(region_name=region, aws_access_key_id=aws_secret_access_key, aws_secret_access_key=aws_secret_access_key)
-    self._sqs_client = session.client('sqs', endpoint_url=endpoint_url)
-    self._sqs_resource = session.resource('sqs', endpoint_url=endpoint_url)
+  def __init__(self, endpoint_url, region, aws_access_key_id=None, aws_secret_access_key=None, cache_ttl=None, prewarm=None, max_pool_connections=None, transport='aws'):
+    """Constructor with already set in options.
+
+      `cache_ttl` is the lifetime in seconds of the queue url cache (None: never expire).
+      `prewarm` is a list of queue names to resolve now.
+      `max_pool_connections` is the size of the http connection pool (None: botocore default).
+      `transport` is 'aws' for boto3, 'memory' for the topics and queues in the process (see memory.py).
+    """
+    self._sqs_client = registry.client('sqs', endpoint_url, region, aws_access_key_id, aws_secret_access_key, max_pool_connections, transport)
+    # circuit breaker and retry budget shared by all the SQS clients of the endpoint
+    self.guard = registry.guard('sqs', endpoint_url, region, transport)
+    self._sqs_resource = registry.resource('sqs', endpoint_url, region, aws_access_key_id, aws_secret_access_key, max_pool_connections, transport)
+    self._queue_urls = ResolutionCache(ttl=cache_ttl)
+
+    if prewarm:
+      self.warm_cache(prewarm)
+
+  def warm_cache(self, queue_names):
+    """Resolve and cache the url of the given queues."""
+    for queue_name in queue_names:
+      self.get_queue_url(queue_name)
+
+  def invalidate_queue_url(self, queue_name=None):
+    """Forget the cached url of a queue, or of all the queues."""
+    self._queue_urls.invalidate(queue_name)
+
+  @contextmanager
+  def _invalidate_on_not_found(self, queue_name):
+    """Drop the cached queue url if sqs tell us that the queue don't exist anymore."""
+    try:
+      yield
+    except ClientError as e:
+      if _is_error_code(e, self.NOT_FOUND_ERROR_CODES):
+        self.invalidate_queue_url(queue_name)
+      raise
 
   @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
   def create_queue(self, queue_name):
-    """Create SQS queue by name."""
-    return self._sqs_client.create_queue(QueueName=queue_name)
+    """Create SQS queue by name, a fifo queue if the name ends with .fifo."""
+    kwargs = {'Attributes': {'FifoQueue': 'true'}} if is_fifo(queue_name) else {}
+    response = self._sqs_client.create_queue(QueueName=queue_name, **kwargs)
+    self._queue_urls.set(queue_name, response['QueueUrl'])
+    return response
 
   @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
   def delete_queue(self, queue_name):
     """Delete a given SQS queue from it url."""
-    return self._sqs_client.delete_queue(QueueUrl=self.get_queue_url(queue_name))
+    try:
+      with self._invalidate_on_not_found(queue_name):
+        return self._sqs_client.delete_queue(QueueUrl=self.get_queue_url(queue_name))
+    finally:
+      self.invalidate_queue_url(queue_name)
 
   @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
   def get_queue_by_name(self, queue_name):
-    """Get SQS queue object by name."""
-    return self._sqs_resource.get_queue_by_name(QueueName=queue_name)
+    """Get SQS queue object by name, built from the cached queue url."""
+    return self._sqs_resource.Queue(self.get_queue_url(queue_name))
 
   @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
   def get_queue_url(self, queue_name):
-    """Get SQS queue url by it name."""
-    return self._sqs_client.get_queue_url(QueueName=queue_name)['QueueUrl']
+    """Get SQS queue url by it name, the url is cached once found."""
+    queue_url = self._queue_urls.get(queue_name)
+    if not queue_url:
+      queue_url = self._sqs_client.get_queue_url(QueueName=queue_name)['QueueUrl']
+      self._queue_urls.set(queue_name, queue_url)
+    return queue_url
 
   @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
   def get_queue_arn(self, queue_name):
     """Get SQS queue arn by it name."""
-    sqs_queue_attrs = self._sqs_client.get_queue_attributes(QueueUrl=self.get_queue_url(queue_name), AttributeNames=['All'])['Attributes']
+    with self._invalidate_on_not_found(queue_name):
+      sqs_queue_attrs = self._sqs_client.get_queue_attributes(QueueUrl=self.get_queue_url(queue_name), AttributeNames=['All'])['Attributes']
     return sqs_queue_attrs['QueueArn']
+
+  @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
+  def receive_messages(self, queue, **kwargs):
+    """Receive messages of the queue object (see get_queue_by_name), kwargs are the ones of boto3 receive_messages."""
+    return queue.receive_messages(**kwargs)
+
+  @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
+  def send_message_batch(self, queue_name, entries):
+    """Send up to 10 messages to the queue in one call, entries are dict with Id, MessageBody and optional DelaySeconds and MessageAttributes."""
+    with self._invalidate_on_not_found(queue_name):
+      return self._sqs_client.send_message_batch(QueueUrl=self.get_queue_url(queue_name), Entries=entries)
+
+  @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
+  def delete_message_batch(self, queue_name, entries):
+    """Delete up to 10 messages of the queue in one call, entries are dict with Id and ReceiptHandle."""
+    with self._invalidate_on_not_found(queue_name):
+      return self._sqs_client.delete_message_batch(QueueUrl=self.get_queue_url(queue_name), Entries=entries)
+
+  @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
+  def change_message_visibility_batch(self, queue_name, entries):
+    """Change the visibility of up to 10 messages in one call, entries are dict with Id, ReceiptHandle and VisibilityTimeout."""
+    with self._invalidate_on_not_found(queue_name):
+      return self._sqs_client.change_message_visibility_batch(QueueUrl=self.get_queue_url(queue_name), Entries=entries)
+
+
+class S3Client:
+  """S3 usages of the claim check, see claim_check.py."""
+
+  RETRY_TRIES = 3
+  RETRY_DELAY = 0.1
+  RETRY_BACKOFF = 2
+  RETRY_MAX_DELAY = 5
+  RETRY_DEADLINE = 30 # seconds after the first try, no retry after it
+  CUSTOM_RETRY_RULE = {
+      'tries': RETRY_TRIES, 'delay': RETRY_DELAY, 'backoff': RETRY_BACKOFF, 'jitter': 'full', 'max_delay': RETRY_MAX_DELAY,
+      'deadline': RETRY_DEADLINE, 'retry_if': is_retryable_error, 'guard': _own_guard,
+  }
+
+  @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
+  def __init__(self, endpoint_url, region, aws_access_key_id=None, aws_secret_access_key=None, max_pool_connections=None, transport='aws'):
+    """Constructor with already set in options, see SNSClient."""
+    self.region = region
+    self._s3_client = registry.client('s3', endpoint_url, region, aws_access_key_id, aws_secret_access_key, max_pool_connections, transport)
+    # circuit breaker and retry budget shared by all the S3 clients of the endpoint
+    self.guard = registry.guard('s3', endpoint_url, region, transport)
+
+  @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
+  def create_bucket(self, bucket):
+    """Create the bucket in the region of the client."""
+    kwargs = {} if self.region == 'us-east-1' else {'CreateBucketConfiguration': {'LocationConstraint': self.region}}
+    return self._s3_client.create_bucket(Bucket=bucket, **kwargs)
+
+  @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
+  def put_object(self, bucket, key, data):
+    """Store the bytes in the bucket."""
+    return self._s3_client.put_object(Bucket=bucket, Key=key, Body=data)
+
+  @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
+  def get_object(self, bucket, key):
+    """Get the object, it 'Body' is a stream to read and close and it 'ContentLength' the size of it."""
+    return self._s3_client.get_object(Bucket=bucket, Key=key)
+
+  @retry(NoCredentialsError, **CUSTOM_RETRY_RULE)
+  def delete_object(self, bucket, key):
+    """Delete the object."""
+    return self._s3_client.delete_object(Bucket=bucket, Key=key)
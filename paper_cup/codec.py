@@ -0,0 +1,335 @@
+"""Serialization and compression of the published messages.
+
+A codec name like 'json', 'msgpack+zlib' or 'json+zstd' is the serializer and the optional
+compression used. It is sent in the CODEC_ATTRIBUTE message attribute so the consumer know how
+to decode the message, a message without it is plain json.
+Binary or compressed payloads are base64 encoded as sns messages are text.
+
+The sqs body is the sns json envelope of the message, or the message itself when the queue is
+subscribed with raw message delivery. Then the codec is in the sqs message attributes.
+
+A message offloaded to a payload store (see claim_check.py) is published as the reference of
+the payload, with the codec of the payload in the CLAIM_CHECK_ATTRIBUTE message attribute.
+"""
+import base64
+import json
+import zlib
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+try:
+  import msgpack
+except ImportError:
+  msgpack = None
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+CODEC_ATTRIBUTE = 'pc_codec'
+CLAIM_CHECK_ATTRIBUTE = 'pc_claim_check'
+STREAM_CHUNK_BYTES = 65536 # read size of the streamed payloads
+
+
+class JsonSerializer(object):
+  """Standard library json."""
+
+  name = 'json'
+  binary = False
+  # bytes used by join: around the items and between two items
+  array_overhead = len('[]')
+  array_separator = len(',')
+
+  def dumps(self, obj):
+    """Serialize to bytes."""
+    return json.dumps(obj).encode('utf-8')
+
+  def join(self, items):
+    """Serialize a list from the already serialized items."""
+    return b'[' + b','.join(items) + b']'
+
+  def loads(self, data):
+    """Deserialize from bytes or text."""
+    return json.loads(data.decode('utf-8') if isinstance(data, bytes) else data)
+
+
+class OrjsonSerializer(JsonSerializer):
+  """Faster json with orjson, the output is json so it is sent as 'json' and read by any json consumer.
+
+    The consumers read json with it when it is installed, the json it refuse (NaN, integers over
+    64 bits) is read by the standard json.
+  """
+
+  name = 'json'
+
+  def __init__(self):
+    """Check that orjson is installed."""
+    if orjson is None:
+      raise ImportError('orjson codec need the orjson package.')
+
+  def dumps(self, obj):
+    """Serialize to bytes."""
+    return orjson.dumps(obj)
+
+  def loads(self, data):
+    """Deserialize from bytes or text."""
+    try:
+      return orjson.loads(data)
+    except orjson.JSONDecodeError:
+      return super(OrjsonSerializer, self).loads(data)
+
+
+class MsgpackSerializer(object):
+  """Msgpack, smaller and faster than json but binary."""
+
+  name = 'msgpack'
+  binary = True
+  # the array header is 1 to 5 bytes depending on the number of items, count the max
+  array_overhead = 5
+  array_separator = 0
+
+  def __init__(self):
+    """Check that msgpack is installed."""
+    if msgpack is None:
+      raise ImportError('msgpack codec need the msgpack package.')
+
+  def dumps(self, obj):
+    """Serialize to bytes."""
+    return msgpack.packb(obj, use_bin_type=True)
+
+  def join(self, items):
+    """Serialize a list from the already serialized items."""
+    return msgpack.Packer().pack_array_header(len(items)) + b''.join(items)
+
+  def loads(self, data):
+    """Deserialize from bytes."""
+    return msgpack.unpackb(data, raw=False)
+
+
+class ZlibCompressor(object):
+  """Standard library zlib."""
+
+  name = 'zlib'
+
+  def compress(self, data):
+    """Compress the bytes."""
+    return zlib.compress(data)
+
+  def decompress(self, data):
+    """Decompress the bytes."""
+    return zlib.decompress(data)
+
+  def decompressobj(self):
+    """Decompressor of the bytes given chunk by chunk."""
+    return zlib.decompressobj()
+
+
+class ZstdCompressor(object):
+  """Zstandard, better ratio and faster than zlib."""
+
+  name = 'zstd'
+
+  def __init__(self):
+    """Check that zstandard is installed."""
+    if zstandard is None:
+      raise ImportError('zstd compression need the zstandard package.')
+
+  def compress(self, data):
+    """Compress the bytes."""
+    return zstandard.ZstdCompressor().compress(data)
+
+  def decompress(self, data):
+    """Decompress the bytes, the size is written in the frame by compress."""
+    return zstandard.ZstdDecompressor().decompress(data)
+
+  def decompressobj(self):
+    """Decompressor of the bytes given chunk by chunk."""
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+SERIALIZERS = {'json': JsonSerializer, 'orjson': OrjsonSerializer, 'msgpack': MsgpackSerializer}
+COMPRESSORS = {'zlib': ZlibCompressor, 'zstd': ZstdCompressor}
+
+# the serializers and compressors are stateless, built once when used
+_serializers = {}
+_compressors = {}
+
+
+def get_serializer(name):
+  """Get the serializer by name."""
+  if name not in _serializers:
+    if name not in SERIALIZERS:
+      raise ValueError('Unknown serializer %r.' % name)
+    _serializers[name] = SERIALIZERS[name]()
+  return _serializers[name]
+
+
+def get_reader(name):
+  """Get the serializer decoding the payloads of a codec name, json and 'orjson' (older publishers) are read by orjson if installed."""
+  if name in ('json', 'orjson'):
+    name = 'json' if orjson is None else 'orjson'
+  return get_serializer(name)
+
+
+def get_compressor(name):
+  """Get the compressor by name."""
+  if name not in _compressors:
+    if name not in COMPRESSORS:
+      raise ValueError('Unknown compression %r.' % name)
+    _compressors[name] = COMPRESSORS[name]()
+  return _compressors[name]
+
+
+class MessageCodec(object):
+  """Encode the messages to publish with a serializer and, above `compress_above` bytes, a compression."""
+
+  def __init__(self, serializer='json', compression=None, compress_above=1024, compression_ratio=4):
+    """Set the serializer and compression by name, `compression_ratio` is the expected one used to pack messages."""
+    self.serializer = get_serializer(serializer)
+    self.compressor = get_compressor(compression) if compression else None
+    self.compress_above = compress_above
+    self.compression_ratio = compression_ratio
+
+  def dumps(self, obj):
+    """Serialize one message to bytes."""
+    return self.serializer.dumps(obj)
+
+  def join(self, items):
+    """Serialize a list of messages from the already serialized messages."""
+    return self.serializer.join(items)
+
+  def encode(self, data):
+    """Get the text to publish from the serialized bytes and the codec name to send with it."""
+    return self.text(*self.compress(data))
+
+  def compress(self, data):
+    """Compress the serialized bytes if they are big enough, return the bytes and the codec name of them."""
+    if self.compressor and len(data) > self.compress_above:
+      return self.compressor.compress(data), self.serializer.name + '+' + self.compressor.name
+    return data, self.serializer.name
+
+  def text(self, data, codec_name):
+    """Text of the bytes returned by `compress`, base64 for the binary ones."""
+    if codec_name == self.serializer.name and not self.serializer.binary:
+      return data.decode('utf-8'), codec_name
+    return base64.b64encode(data).decode('ascii'), codec_name
+
+  def max_raw_bytes(self, max_bytes):
+    """Number of serialized bytes expected to fit in a message of max_bytes once encoded.
+
+      Exact without compression, with compression it's an estimation: the caller must check
+      the encoded size.
+    """
+    if self.compressor:
+      return int(max_bytes * 3 / 4 * self.compression_ratio)
+    if self.serializer.binary:
+      return max_bytes * 3 // 4
+    return max_bytes
+
+
+def decode(text, codec_name=None):
+  """Decode a received message from it text and codec name."""
+  serializer_name, _, compression = (codec_name or 'json').partition('+')
+  serializer = get_reader(serializer_name)
+  if not compression and not serializer.binary:
+    return serializer.loads(text)
+
+  data = base64.b64decode(text)
+  if compression:
+    data = get_compressor(compression).decompress(data)
+  return serializer.loads(data)
+
+
+def decode_stream(stream, codec_name=None):
+  """Decode a message from the file like object of it bytes (not base64), decompressed chunk by chunk.
+
+    The compressed bytes are never held whole. A msgpack payload is read from the stream as it is
+    decompressed, the json parsers are not incremental: the decompressed json is read whole (and
+    decoded to text by the standard json, orjson parse the bytes) before being parsed.
+  """
+  serializer_name, _, compression = (codec_name or 'json').partition('+')
+  serializer = get_reader(serializer_name)
+  if compression:
+    stream = _DecompressedStream(stream, get_compressor(compression).decompressobj())
+  if serializer.name == 'msgpack':
+    return next(msgpack.Unpacker(stream, raw=False, read_size=STREAM_CHUNK_BYTES))
+
+  return serializer.loads(stream.read())
+
+
+class _DecompressedStream(object):
+  """Read only file like object of the decompressed bytes of a stream."""
+
+  def __init__(self, stream, decompressor):
+    self.stream = stream
+    self.decompressor = decompressor
+    self._buffer = b''
+
+  def read(self, size=-1):
+    """Up to `size` decompressed bytes, b'' at the end."""
+    if size < 0:
+      # joined once instead of growing the buffer chunk by chunk
+      chunks = [self._buffer]
+      for chunk in iter(lambda: self.stream.read(STREAM_CHUNK_BYTES), b''):
+        chunks.append(self.decompressor.decompress(chunk))
+      self._buffer = b''
+      return b''.join(chunks)
+    while len(self._buffer) < size:
+      chunk = self.stream.read(STREAM_CHUNK_BYTES)
+      if not chunk:
+        break
+      self._buffer += self.decompressor.decompress(chunk)
+    data, self._buffer = self._buffer[:size], self._buffer[size:]
+    return data
+
+
+def is_sns_envelope(body):
+  """True if the parsed sqs body is the sns notification wrapping the message."""
+  return isinstance(body, dict) and body.get('Type') == 'Notification' and 'TopicArn' in body and 'Message' in body
+
+
+def decode_body(body, message_attributes=None):
+  """Decode a sqs body and it sqs message attributes, sns envelope or raw message delivery."""
+  return decode_envelope(body, message_attributes)[0]
+
+
+def decode_envelope(body, message_attributes=None, claim_check=None):
+  """Like `decode_body` but return the message and the sns message id of the envelope (None with raw message delivery).
+
+    The offloaded messages are loaded with the `claim_check` (see claim_check.ClaimCheck).
+  """
+  message_attributes = message_attributes or {}
+  if CLAIM_CHECK_ATTRIBUTE in message_attributes:
+    # raw message delivery of an offloaded message
+    return _load_claim(body, message_attributes[CLAIM_CHECK_ATTRIBUTE].get('StringValue'), claim_check), None
+  codec_name = message_attributes.get(CODEC_ATTRIBUTE, {}).get('StringValue')
+  if codec_name:
+    # raw message delivery of a message that is not plain json
+    return decode(body, codec_name), None
+
+  msg = get_reader('json').loads(body)
+  if is_sns_envelope(msg):
+    attributes = msg.get('MessageAttributes') or {}
+    if CLAIM_CHECK_ATTRIBUTE in attributes:
+      return _load_claim(msg['Message'], attributes[CLAIM_CHECK_ATTRIBUTE].get('Value'), claim_check), msg.get('MessageId')
+    codec_name = attributes.get(CODEC_ATTRIBUTE, {}).get('Value')
+    return decode(msg['Message'], codec_name), msg.get('MessageId')
+  return msg, None
+
+
+def _load_claim(reference, codec_name, claim_check):
+  """Load the offloaded message of the reference."""
+  if claim_check is None:
+    raise ValueError('Message offloaded to %s but there is no claim check to load it.' % reference)
+  return claim_check.load(reference, codec_name)
+
+
+def codec_attributes(codec_name):
+  """Sns message attributes recording the codec, none for plain json to stay readable by any consumer."""
+  if codec_name == 'json':
+    return {}
+  return {CODEC_ATTRIBUTE: {'DataType': 'String', 'StringValue': codec_name}}
@@ -1,8 +1,293 @@
+import logging
+import random
+import threading
 import time
+from collections import deque
+from contextlib import contextmanager
 from functools import wraps
 
+logger = logging.getLogger(__name__)
 
-def retry(ExceptionToCheck, tries=4, delay=3, backoff=2, logger=None):
+JITTERS = (None, 'full', 'decorrelated')
+
+
+class CircuitOpenError(Exception):
+    """The call was not made because the circuit breaker is open."""
+
+
+class CircuitBreaker(object):
+    """Stop calling a service that keep failing.
+
+    After `failure_threshold` failures in a row the circuit is open and the calls fail
+    right away for `reset_timeout` seconds, then one trial call is let through (half open):
+    it close the circuit if the service answer or open it again if it fail.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """Start closed."""
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0 # failures in a row
+        self.opened = 0 # number of times the circuit opened
+        self._state = self.CLOSED
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """closed, open or half_open."""
+        with self._lock:
+            if self._state == self.OPEN and time.time() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """True if a call can be made now, in half open only the first call is allowed."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.time() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                return True
+            return False
+
+    def success(self):
+        """A call succeeded, close the circuit."""
+        with self._lock:
+            self.failures = 0
+            self._state = self.CLOSED
+
+    def failure(self):
+        """A call failed, open the circuit after too many failures or a failed trial."""
+        with self._lock:
+            self.failures += 1
+            if self._state == self.HALF_OPEN or (self._state == self.CLOSED and self.failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = time.time()
+                self.opened += 1
+
+    def release(self):
+        """A call ended without telling if the service is up (interrupted), the trial of a half open circuit goes to the next call."""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._state = self.OPEN
+                self._opened_at = time.time() - self.reset_timeout
+
+
+class RetryBudget(object):
+    """Limit the retries to a part of the calls so they don't multiply the load of a struggling service.
+
+    Over the last `window` seconds the retries can be up to `ratio` of the calls plus `min_retries`.
+    The counters are the metric of the budget: `exhausted` is the number of retries denied.
+    """
+
+    def __init__(self, ratio=0.1, min_retries=10, window=10):
+        """Start with an empty window."""
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self.calls = 0
+        self.retries = 0
+        self.exhausted = 0
+        self._buckets = deque() # [second, calls, retries] of the last seconds
+        self._lock = threading.Lock()
+
+    def call(self):
+        """Count a call, not a retry."""
+        with self._lock:
+            self.calls += 1
+            self._bucket()[1] += 1
+
+    def can_retry(self):
+        """Take a retry from the budget, False if there is none left."""
+        with self._lock:
+            bucket = self._bucket()
+            if self._available() < 1:
+                self.exhausted += 1
+                return False
+            self.retries += 1
+            bucket[2] += 1
+            return True
+
+    @property
+    def available(self):
+        """Number of retries left in the window."""
+        with self._lock:
+            self._bucket()
+            return max(0, int(self._available()))
+
+    def as_dict(self):
+        """Summary of the counters, to log or send."""
+        return {'calls': self.calls, 'retries': self.retries, 'exhausted': self.exhausted, 'available': self.available}
+
+    def _available(self):
+        """Retries left in the window, the lock is held."""
+        calls = sum(bucket[1] for bucket in self._buckets)
+        retries = sum(bucket[2] for bucket in self._buckets)
+        return self.min_retries + self.ratio * calls - retries
+
+    def _bucket(self):
+        """Bucket of the current second, the old ones are dropped, the lock is held."""
+        now = int(time.time())
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+        if not self._buckets or self._buckets[-1][0] != now:
+            self._buckets.append([now, 0, 0])
+        return self._buckets[-1]
+
+
+class RetryGuard(object):
+    """Circuit breaker and retry budget shared by the calls to one service, both optional.
+
+    With `metrics` (see paper_cup.metrics) the retries and the calls refused by the
+    breaker are counted, with the `tags` of the service. The errors for which `throttled_if`
+    is true are not failures of the breaker, the service is up, only the budget limit their retries.
+    Each of these attempts is told to the listener of the thread, see `listen`.
+    """
+
+    def __init__(self, breaker=None, budget=None, metrics=None, tags=None, throttled_if=None):
+        """Use the breaker and the budget."""
+        self.breaker = breaker
+        self.budget = budget
+        self.metrics = metrics
+        self.tags = tags or {}
+        self.throttled_if = throttled_if
+        self._local = threading.local()
+
+    def enter(self):
+        """Start a call in this thread, False if it is nested in an other call of the guard."""
+        if getattr(self._local, 'active', False):
+            return False
+        self._local.active = True
+        return True
+
+    def exit(self):
+        """End the call started by `enter`."""
+        self._local.active = False
+
+    @contextmanager
+    def listen(self, on_throttled):
+        """Call `on_throttled()` for each throttled attempt of the calls made by this thread in the block, the retries included."""
+        previous = getattr(self._local, 'on_throttled', None)
+        self._local.on_throttled = on_throttled
+        try:
+            yield
+        finally:
+            self._local.on_throttled = previous
+
+    def throttled(self):
+        """An attempt was throttled, tell the listener of the thread."""
+        on_throttled = getattr(self._local, 'on_throttled', None)
+        if on_throttled:
+            on_throttled()
+
+    def as_dict(self):
+        """Summary of the breaker and budget, to log or send."""
+        summary = {}
+        if self.breaker:
+            summary.update(circuit_state=self.breaker.state, circuit_opened=self.breaker.opened)
+        if self.budget:
+            summary.update(('retry_budget_%s' % key, value) for key, value in self.budget.as_dict().items())
+        return summary
+
+
+class RetryCall(object):
+    """Retries of one call of a function decorated by `retry` (or `aio.async_retry`)."""
+
+    def __init__(self, exceptions, tries=4, delay=3, backoff=2, logger=None, jitter=None, max_delay=None, deadline=None, retry_if=None, guard=None, name=None):
+        """See `retry`, `name` is the one of the function in the metrics."""
+        assert(jitter in JITTERS)
+        self.exceptions = exceptions
+        self.tries = tries
+        self.delay = delay
+        self.backoff = backoff
+        self.logger = logger or globals()['logger']
+        self.jitter = jitter
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_if = retry_if
+        self.guard = guard
+        self.name = name
+
+        self.started_at = time.time()
+        self.attempts = 0
+        self._previous_wait = delay
+        self._breaker_pending = False # an attempt let through by the breaker and not recorded yet
+
+    def before(self):
+        """Check the circuit breaker before each attempt, raise CircuitOpenError if it is open."""
+        breaker = self.guard and self.guard.breaker
+        if breaker and not breaker.allow():
+            self._count('circuit_open')
+            raise CircuitOpenError('Circuit open after %d failures, retry in %s seconds.' % (breaker.failures, breaker.reset_timeout))
+        self._breaker_pending = bool(breaker)
+        if not self.attempts and self.guard and self.guard.budget:
+            self.guard.budget.call()
+        self.attempts += 1
+
+    def succeeded(self):
+        """The attempt succeeded."""
+        if self._breaker_pending:
+            self._breaker_pending = False
+            self.guard.breaker.success()
+
+    def failed(self, error):
+        """The attempt failed, return the seconds to wait before the next one or None to give up."""
+        retryable = isinstance(error, self.exceptions) or bool(self.retry_if and self.retry_if(error))
+        throttled = bool(self.guard and self.guard.throttled_if and self.guard.throttled_if(error))
+        if throttled:
+            self.guard.throttled()
+        if self._breaker_pending:
+            self._breaker_pending = False
+            if retryable and not throttled:
+                self.guard.breaker.failure()
+            else:
+                # the service answered, a client error or a throttling
+                self.guard.breaker.success()
+        if not retryable or self.attempts >= self.tries:
+            return None
+
+        wait = self._next_wait()
+        if self.deadline is not None and time.time() - self.started_at + wait > self.deadline:
+            self.logger.warning('%s, no retry after %.1f seconds.', error, time.time() - self.started_at)
+            return None
+        if self.guard and self.guard.budget and not self.guard.budget.can_retry():
+            self.logger.warning('%s, no retry left in the retry budget.', error)
+            return None
+
+        self.logger.warning('%s, Retrying in %.2f seconds...', error, wait)
+        self._count('retries')
+        return wait
+
+    def done(self):
+        """The call ended, an attempt interrupted before it outcome was recorded release the breaker."""
+        if self._breaker_pending:
+            self._breaker_pending = False
+            self.guard.breaker.release()
+
+    def _count(self, name):
+        """Count in the metrics of the guard if any."""
+        metrics = self.guard and self.guard.metrics
+        if metrics:
+            metrics.increment(name, tags=dict(self.guard.tags, call=self.name))
+
+    def _next_wait(self):
+        """Exponential backoff with the jitter."""
+        if self.jitter == 'decorrelated':
+            wait = random.uniform(self.delay, self._previous_wait * 3)
+            self._previous_wait = wait
+        else:
+            wait = self.delay * self.backoff ** (self.attempts - 1)
+            if self.jitter == 'full':
+                wait = random.uniform(0, wait)
+        return min(wait, self.max_delay) if self.max_delay is not None else wait
+
+
+def retry(ExceptionToCheck, tries=4, delay=3, backoff=2, logger=None, jitter=None, max_delay=None, deadline=None, retry_if=None, guard=None):
     """Retry calling the decorated function using an exponential backoff.
 
     http://www.saltycrane.com/blog/2009/11/trying-out-retry-decorator-python/
@@ -18,27 +303,53 @@ def retry(ExceptionToCheck, tries=4, delay=3, backoff=2, logger=None):
     :param backoff: backoff multiplier e.g. value of 2 will double the delay
         each retry
     :type backoff: int
-    :param logger: logger to use. If None, print
+    :param logger: logger to use. If None, the logger of this module
     :type logger: logging.Logger instance
+    :param jitter: None for the exact backoff, 'full' to wait a random time up
+        to the backoff, 'decorrelated' to wait between delay and 3 times the
+        previous wait, so the clients failing together don't retry together
+    :type jitter: str
+    :param max_delay: maximum wait between two tries in seconds
+    :type max_delay: float
+    :param deadline: no retry that would end after this number of seconds
+        from the first try
+    :type deadline: float
+    :param retry_if: function telling if an other exception is retryable
+    :type retry_if: function
+    :param guard: function of the call arguments giving the RetryGuard (circuit
+        breaker and retry budget) of the service, or None. A call made by an other
+        call of the same guard in the same thread is tried once, the outer call retries
+    :type guard: function
     """
     def deco_retry(f):
 
         @wraps(f)
         def f_retry(*args, **kwargs):
-            mtries, mdelay = tries, delay
-            while mtries > 1:
-                try:
-                    return f(*args, **kwargs)
-                except ExceptionToCheck as e:
-                    msg = "%s, Retrying in %d seconds..." % (str(e), mdelay)
-                    if logger:
-                        logger.warning(msg)
+            call_guard = guard(*args, **kwargs) if guard else None
+            if call_guard is not None and not call_guard.enter():
+                # nested in an other call of the guard, it retries
+                return f(*args, **kwargs)
+            call = RetryCall(
+                ExceptionToCheck, tries=tries, delay=delay, backoff=backoff, logger=logger, jitter=jitter,
+                max_delay=max_delay, deadline=deadline, retry_if=retry_if, guard=call_guard, name=f.__name__,
+            )
+            try:
+                while True:
+                    call.before()
+                    try:
+                        result = f(*args, **kwargs)
+                    except Exception as e:
+                        wait = call.failed(e)
+                        if wait is None:
+                            raise
+                        time.sleep(wait)
                     else:
-                        print(msg)
-                    time.sleep(mdelay)
-                    mtries -= 1
-                    mdelay *= backoff
-            return f(*args, **kwargs)
+                        call.succeeded()
+                        return result
+            finally:
+                call.done()
+                if call_guard is not None:
+                    call_guard.exit()
 
         return f_retry  # true decorator
 
@@ -0,0 +1,164 @@
+"""Idempotency of the consumer: skip the items already consumed, sqs deliver at least once."""
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class DedupStore(object):
+  """Keys of the consumed items, subclass it to use an other backend."""
+
+  def contains(self, key):
+    """True if the key was added and is not expired."""
+    raise NotImplementedError()
+
+  def add(self, key):
+    """Remember the key until it expire."""
+    raise NotImplementedError()
+
+  def close(self):
+    """Release the resources of the store."""
+
+
+class MemoryDedupStore(DedupStore):
+  """Keys kept in memory `ttl` seconds, the least recently used are dropped above `max_size` keys."""
+
+  def __init__(self, max_size=100000, ttl=3600):
+    """Start empty."""
+    self.max_size = max_size
+    self.ttl = ttl
+    self._keys = OrderedDict() # key: expiration time, least recently used first
+    self._lock = threading.Lock()
+
+  def contains(self, key):
+    """True if the key was added and is not expired."""
+    with self._lock:
+      expires_at = self._keys.pop(key, None)
+      if expires_at is None or expires_at <= time.time():
+        return False
+      # most recently used
+      self._keys[key] = expires_at
+      return True
+
+  def add(self, key):
+    """Remember the key, drop the least recently used above max_size."""
+    with self._lock:
+      self._keys.pop(key, None)
+      self._keys[key] = time.time() + self.ttl
+      while len(self._keys) > self.max_size:
+        self._keys.popitem(last=False)
+
+  def __len__(self):
+    return len(self._keys)
+
+
+class SQLiteDedupStore(DedupStore):
+  """Keys kept `ttl` seconds in a sqlite file, it can be shared by the consumers of the same host."""
+
+  PURGE_EVERY = 1000 # adds between the deletions of the expired keys
+
+  def __init__(self, path, ttl=3600):
+    """Open the file, the table is created if needed."""
+    self.path = path
+    self.ttl = ttl
+    self._adds = 0
+    self._lock = threading.Lock()
+    self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    with self._lock:
+      # several processes can read while one write, without waiting for the disk at each commit
+      self._connection.execute('PRAGMA journal_mode=WAL')
+      self._connection.execute('PRAGMA synchronous=NORMAL')
+      self._connection.execute('CREATE TABLE IF NOT EXISTS pc_dedup (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)')
+      self._connection.commit()
+
+  def contains(self, key):
+    """True if the key was added and is not expired."""
+    with self._lock:
+      row = self._connection.execute('SELECT 1 FROM pc_dedup WHERE key = ? AND expires_at > ?', (key, time.time())).fetchone()
+    return row is not None
+
+  def add(self, key):
+    """Remember the key, the expired keys are deleted every PURGE_EVERY adds."""
+    now = time.time()
+    with self._lock:
+      self._connection.execute('INSERT OR REPLACE INTO pc_dedup (key, expires_at) VALUES (?, ?)', (key, now + self.ttl))
+      self._adds += 1
+      if self._adds % self.PURGE_EVERY == 0:
+        self._connection.execute('DELETE FROM pc_dedup WHERE expires_at <= ?', (now,))
+      self._connection.commit()
+
+  def close(self):
+    """Close the file."""
+    with self._lock:
+      self._connection.close()
+
+
+class Deduplicator(object):
+  """Find the items already consumed and remember the ones consumed, with hit and miss counters.
+
+    The key of an item is it `key_field` value if the publisher set one, else the sns message id
+    (the sqs message id with raw message delivery) and the position of the item in the message.
+    An item is claimed before being consumed so a duplicate received meanwhile is skipped too,
+    then released and remembered if it was consumed.
+  """
+
+  def __init__(self, store, key_field='idempotency_key'):
+    """Use the store of the keys."""
+    self.store = store
+    self.key_field = key_field
+    self.hits = 0 # items already consumed or in progress
+    self.misses = 0
+    self._claimed = set()
+    self._lock = threading.Lock()
+
+  def key(self, msg, index, message_id):
+    """Key of the item at `index` of the message."""
+    if isinstance(msg, dict) and msg.get(self.key_field):
+      return str(msg[self.key_field])
+    return '%s:%d' % (message_id, index)
+
+  def claim(self, key):
+    """Return True if the item has to be consumed, False if it was already consumed or is in progress."""
+    with self._lock:
+      if key in self._claimed:
+        self.hits += 1
+        return False
+      self._claimed.add(key)
+
+    try:
+      hit = self.store.contains(key)
+    except Exception:
+      # consume it again rather than failing
+      logger.exception('Failed to read the dedup store.')
+      hit = False
+
+    with self._lock:
+      if hit:
+        self.hits += 1
+        self._claimed.discard(key)
+      else:
+        self.misses += 1
+    return not hit
+
+  def release(self, key, consumed):
+    """The claimed item is done, remember it if it was consumed."""
+    if consumed:
+      try:
+        self.store.add(key)
+      except Exception:
+        logger.exception('Failed to write the dedup store.')
+    with self._lock:
+      self._claimed.discard(key)
+
+  @property
+  def hit_ratio(self):
+    """Part of the items that were already consumed, 0 to 1."""
+    total = self.hits + self.misses
+    return float(self.hits) / total if total else 0.0
+
+  def as_dict(self):
+    """Summary of the counters, to log or send."""
+    return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hit_ratio}
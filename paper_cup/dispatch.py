@@ -0,0 +1,141 @@
+import itertools
+import logging
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from .metrics import PUBLISHED_AT_FIELD
+
+logger = logging.getLogger(__name__)
+
+# consumer classes registered when they are defined
+_consumer_classes = weakref.WeakSet()
+_registration_order = itertools.count(1)
+_registered = [0] # number of classes registered, a dispatcher built before a new registration is stale
+
+
+class ConsumerType(type):
+  """Metaclass of the consumers, register each consumer class when it is defined."""
+
+  def __init__(cls, name, bases, attrs):
+    """Register the new class."""
+    super(ConsumerType, cls).__init__(name, bases, attrs)
+    cls._pc_registration = next(_registration_order)
+    _consumer_classes.add(cls)
+    _registered[0] = cls._pc_registration
+
+
+def consumer_classes(root):
+  """Get the consumer action classes in all the subclass tree of the root class, in definition order."""
+  classes = [
+      cls for cls in list(_consumer_classes)
+      if cls is not root and issubclass(cls, root) and 'Consume' in cls.__name__ and not cls.__dict__.get('_pc_base_class')
+  ]
+  return sorted(classes, key=lambda cls: cls._pc_registration)
+
+
+def action_names(cls):
+  """Get the public methods defined by the consumer class and it parents, without the ones of the base classes."""
+  names = set()
+  for klass in cls.__mro__:
+    if isinstance(klass, ConsumerType) and not klass.__dict__.get('_pc_base_class'):
+      names.update(name for name in klass.__dict__ if not name.startswith('_'))
+
+  base_names = set(dir(root_base(cls)))
+  return sorted(name for name in names if name not in base_names and callable(getattr(cls, name)))
+
+
+def root_base(cls):
+  """Get the last base class of the consumer (ConsumePC or an other class flagged _pc_base_class)."""
+  for klass in cls.__mro__:
+    if klass.__dict__.get('_pc_base_class'):
+      return klass
+  return object
+
+
+class Dispatcher(object):
+  """Routing table from a message to the bound action of a consumer action class.
+
+    Built once for a consumer from the registered consumer classes, it maps the consumer
+    action class name and the action straight to the bound method. The messages that
+    can't be routed are rejected and counted by reason in `rejected`.
+    With the PC_METRICS of the consumer the actions are timed, see `measured`.
+  """
+
+  REJECT_REASONS = ('sender', 'consumer_action_class', 'action')
+
+  def __init__(self, consumer):
+    """Build the table of the consumer, the action classes share the client of the consumer."""
+    self.registered = _registered[0]
+    self.listen = frozenset(consumer.PC_SERVICE_LISTEN)
+    self.metrics = consumer.PC_METRICS
+    self.consumers = {}
+    self.routes = {}
+
+    for cls in consumer_classes(consumer.__class__):
+      instance = cls(sqs_client=consumer.sqs_client)
+      self.consumers[cls.__name__] = instance
+      self.routes[cls.__name__] = dict((name, getattr(instance, name)) for name in action_names(cls))
+
+    self.rejected = dict.fromkeys(self.REJECT_REASONS, 0)
+    self._lock = threading.Lock()
+
+  @property
+  def stale(self):
+    """True if a consumer class was defined after the table was built."""
+    return self.registered != _registered[0]
+
+  def resolve(self, msg):
+    """Get the bound action that handle the message, None if it is rejected."""
+    if msg.get('sender') not in self.listen:
+      return self._reject('sender', msg)
+
+    actions = self.routes.get(msg.get('consumer_action_class'))
+    if actions is None:
+      return self._reject('consumer_action_class', msg)
+
+    handler = actions.get(msg.get('action'))
+    if handler is None:
+      return self._reject('action', msg)
+    return handler
+
+  def dispatch(self, msg):
+    """Call the action that handle the message, return False if it is rejected."""
+    handler = self.resolve(msg)
+    if handler is None:
+      return False
+    if self.metrics:
+      with self.measured(msg):
+        handler(msg)
+    else:
+      handler(msg)
+    return True
+
+  @contextmanager
+  def measured(self, msg):
+    """Time the action of the message and count it failure, with the lag since the message was published."""
+    tags = {'consumer': msg.get('consumer_action_class'), 'action': msg.get('action')}
+    started_at = time.time()
+    published_at = msg.get(PUBLISHED_AT_FIELD)
+    if isinstance(published_at, (int, float)):
+      self.metrics.observe('consume_lag_seconds', max(0, started_at - published_at), tags)
+    try:
+      yield
+    except Exception:
+      self.metrics.increment('action_errors', tags=tags)
+      raise
+    finally:
+      self.metrics.observe('action_seconds', time.time() - started_at, tags)
+
+  def _reject(self, reason, msg):
+    """Count the message that can't be routed."""
+    with self._lock:
+      self.rejected[reason] += 1
+
+    if reason == 'action':
+      # the consumer class is our but not the action, most likely an error
+      logger.warning('Unknown action %r for %s.', msg.get('action'), msg.get('consumer_action_class'))
+    else:
+      logger.debug('Message not for us, unknown %s %r.', reason, msg.get(reason))
+    return None
@@ -0,0 +1,155 @@
+import json
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+RETRIES_KEY = 'pc_retries' # number of times the item failed, in the requeued items
+
+# what happened to a failed item
+RETRY = 'retry'
+DEAD_LETTER = 'dead_letter'
+DROPPED = 'dropped'
+LEFT = 'left' # not requeued, the whole sqs message come back after it visibility timeout
+
+MAX_BATCH_SIZE = 10 # sqs limit
+MAX_DELAY_SECONDS = 900 # sqs limit
+
+
+class FailedItem(namedtuple('FailedItem', ['message_id', 'item', 'error', 'retries', 'outcome'])):
+  """One item of a sqs message that failed, `outcome` is what was done with it."""
+
+  __slots__ = ()
+
+
+class ConsumeReport(object):
+  """Outcome of a consume call, the failed items are listed with what was done with them."""
+
+  def __init__(self):
+    """Start with nothing consumed."""
+    self.received = 0 # sqs messages
+    self.items = 0 # items in the messages, a message that can't be decoded count as one
+    self.failed = [] # list of FailedItem
+    self._lock = threading.Lock()
+
+  def add_received(self, count):
+    """Count the received sqs messages."""
+    with self._lock:
+      self.received += count
+
+  def add_items(self, count):
+    """Count the items to consume."""
+    with self._lock:
+      self.items += count
+
+  def add_failed(self, failed_items):
+    """Record the failed items."""
+    with self._lock:
+      self.failed.extend(failed_items)
+
+  @property
+  def succeeded(self):
+    """Number of items consumed without error."""
+    return self.items - len(self.failed)
+
+  @property
+  def errors(self):
+    """Exceptions of the failed items."""
+    return [failed_item.error for failed_item in self.failed]
+
+  def count(self, outcome):
+    """Number of failed items with this outcome."""
+    return len([failed_item for failed_item in self.failed if failed_item.outcome == outcome])
+
+  def as_dict(self):
+    """Summary of the report, to log or send."""
+    return {
+        'received': self.received,
+        'succeeded': self.succeeded,
+        'failed': len(self.failed),
+        RETRY: self.count(RETRY),
+        DEAD_LETTER: self.count(DEAD_LETTER),
+        DROPPED: self.count(DROPPED),
+        LEFT: self.count(LEFT),
+    }
+
+  def __repr__(self):
+    return 'ConsumeReport(%s)' % ', '.join('%s=%s' % item for item in sorted(self.as_dict().items()))
+
+
+class FailureHandler(object):
+  """Requeue the failed items of the consumed messages one by one so their siblings are not retried.
+
+    A failed item is sent alone to the `retry_queue` with it retry count in it payload, after
+    `retry_delay` seconds doubled at each retry. After `max_retries` it is sent to the
+    `dead_letter_queue` if any, else dropped. Once all the failed items of a sqs message are
+    requeued the sqs message can be deleted, if one could not be requeued the whole sqs message
+    is left to come back after it visibility timeout.
+    When `ordered` (fifo queue) nothing is requeued, a requeued item would be consumed after the next
+    ones of it group: the sqs message is left and the group wait for it, use a redrive policy on the
+    queue to move it to a dead letter queue after some receives.
+  """
+
+  def __init__(self, sqs_client, retry_queue, max_retries=3, dead_letter_queue=None, retry_delay=0, report=None, ordered=False):
+    """Set where the failed items are sent."""
+    self.sqs_client = sqs_client
+    self.retry_queue = retry_queue
+    self.max_retries = max_retries
+    self.dead_letter_queue = dead_letter_queue
+    self.retry_delay = retry_delay
+    self.report = report or ConsumeReport()
+    self.ordered = ordered
+
+  def handle(self, message, failures):
+    """Requeue the (item, error) that failed in the sqs message, return True if the message can be deleted."""
+    retries, dead_letters, failed_items = [], [], []
+    for item, error in failures:
+      logger.error('Failed to consume an item of message %s: %r', message.message_id, error)
+      if not isinstance(item, dict) or self.ordered:
+        # not decoded or ordered, nothing to requeue
+        failed_items.append(FailedItem(message.message_id, item, error, 0, LEFT))
+        continue
+
+      item = dict(item)
+      item[RETRIES_KEY] = item.get(RETRIES_KEY, 0) + 1
+      if item[RETRIES_KEY] <= self.max_retries:
+        retries.append((item, error))
+      elif self.dead_letter_queue:
+        dead_letters.append((item, error))
+      else:
+        logger.error('Item of message %s dropped after %d retries: %r', message.message_id, self.max_retries, item)
+        failed_items.append(FailedItem(message.message_id, item, error, item[RETRIES_KEY], DROPPED))
+
+    for queue_name, items, outcome in [(self.retry_queue, retries, RETRY), (self.dead_letter_queue, dead_letters, DEAD_LETTER)]:
+      if items:
+        sent = self._send(queue_name, items, outcome)
+        for item, error in items:
+          failed_items.append(FailedItem(message.message_id, item, error, item[RETRIES_KEY], outcome if sent else LEFT))
+
+    self.report.add_failed(failed_items)
+    return all(failed_item.outcome != LEFT for failed_item in failed_items)
+
+  def _send(self, queue_name, items, outcome):
+    """Send the (item, error) to the queue by batch of 10, return True if they are all sent."""
+    try:
+      for i in range(0, len(items), MAX_BATCH_SIZE):
+        entries = []
+        for j, (item, error) in enumerate(items[i:i + MAX_BATCH_SIZE]):
+          entry = {
+              'Id': str(j),
+              'MessageBody': json.dumps(item),
+              'MessageAttributes': {'pc_error': {'DataType': 'String', 'StringValue': repr(error)[:1000]}},
+          }
+          if outcome == RETRY and self.retry_delay:
+            entry['DelaySeconds'] = min(self.retry_delay * 2 ** (item[RETRIES_KEY] - 1), MAX_DELAY_SECONDS)
+          entries.append(entry)
+
+        response = self.sqs_client.send_message_batch(queue_name, entries)
+        if response.get('Failed'):
+          failure = response['Failed'][0]
+          raise RuntimeError('%s: %s' % (failure.get('Code'), failure.get('Message')))
+    except Exception:
+      logger.exception('Failed to send %d failed items to %s.', len(items), queue_name)
+      return False
+    return True
@@ -0,0 +1,47 @@
+"""Fifo topics and queues: ids of the published messages and group of the received ones."""
+import hashlib
+import re
+
+FIFO_SUFFIX = '.fifo' # aws require it at the end of the fifo topic and queue names
+GROUP_ATTRIBUTE = 'MessageGroupId' # sqs attribute of the messages received from a fifo queue
+
+# sns limit of the group and deduplication ids: 1 to 128 alphanumeric or punctuation characters
+_VALID_ID = re.compile(r'^[\x21-\x7e]{1,128}$')
+
+
+class GroupBlockedError(Exception):
+  """The item was not consumed because a previous item of it message group failed."""
+
+
+def is_fifo(name):
+  """True for the name of a fifo topic or queue."""
+  return name.endswith(FIFO_SUFFIX)
+
+
+def message_group(message):
+  """Group id of a received sqs message, None if it doesn't come from a fifo queue."""
+  return (message.attributes or {}).get(GROUP_ATTRIBUTE)
+
+
+def valid_id(value):
+  """The value if it is a valid sns id, else it hash."""
+  if _VALID_ID.match(value):
+    return value
+  return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+def field_id(message, fields):
+  """Id made of the values of the fields of the message, as text so a non ascii value is hashed on python 2 too."""
+  return valid_id(u'-'.join(u'%s' % (message.get(field, u''),) for field in fields))
+
+
+def content_id(payload):
+  """Id of the serialized message, the hash of it."""
+  return hashlib.sha256(payload).hexdigest()
+
+
+def chunk_deduplication_id(deduplication_ids):
+  """Deduplication id of a sns message holding several messages, from their deduplication ids."""
+  if len(deduplication_ids) == 1:
+    return deduplication_ids[0]
+  return hashlib.sha256('\n'.join(deduplication_ids).encode('utf-8')).hexdigest()
@@ -0,0 +1,92 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 10 # sqs limit
+
+
+def change_visibility(sqs_client, queue_name, messages, visibility_timeout):
+  """Set the visibility timeout of the messages by batch of 10, return the messages that failed."""
+  failed = []
+  for i in range(0, len(messages), MAX_BATCH_SIZE):
+    batch = messages[i:i + MAX_BATCH_SIZE]
+    entries = [
+        {'Id': str(j), 'ReceiptHandle': message.receipt_handle, 'VisibilityTimeout': visibility_timeout}
+        for j, message in enumerate(batch)
+    ]
+    response = sqs_client.change_message_visibility_batch(queue_name, entries)
+    for failure in response.get('Failed', []):
+      logger.warning('Failed to change the visibility of a message: %s %s', failure.get('Code'), failure.get('Message'))
+      failed.append(batch[int(failure['Id'])])
+  return failed
+
+
+class Heartbeat(object):
+  """Extend the visibility timeout of the messages being consumed so they don't come back in the queue.
+
+    Every `interval` seconds (a third of `visibility_timeout` by default) the visibility of the
+    tracked messages is set again to `visibility_timeout` from a background thread, so a short
+    visibility timeout can be used with long actions. Track the received messages with `add`
+    and stop with `remove` once they are deleted or failed, a failed message come back in the
+    queue at the end of it visibility timeout.
+  """
+
+  def __init__(self, sqs_client, queue_name, visibility_timeout=30, interval=None):
+    """Start the background thread."""
+    self.sqs_client = sqs_client
+    self.queue_name = queue_name
+    self.visibility_timeout = visibility_timeout
+    self.interval = interval or visibility_timeout / 3.0
+
+    self._messages = {} # message_id: message
+    self._lock = threading.Lock()
+    self._stopped = threading.Event()
+
+    self._thread = threading.Thread(target=self._run, name='paper-cup-heartbeat')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def add(self, messages):
+    """Start extending the visibility of the messages."""
+    with self._lock:
+      for message in messages:
+        self._messages[message.message_id] = message
+
+  def remove(self, message):
+    """Stop extending the visibility of the message."""
+    with self._lock:
+      self._messages.pop(message.message_id, None)
+
+  def release(self, messages):
+    """Stop tracking the messages and make them visible again right now, for the messages not consumed."""
+    for message in messages:
+      self.remove(message)
+    if messages:
+      try:
+        change_visibility(self.sqs_client, self.queue_name, messages, 0)
+      except Exception:
+        logger.exception('Failed to release %d messages.', len(messages))
+
+  def close(self):
+    """Stop the background thread, the messages still tracked come back at the end of their visibility timeout."""
+    self._stopped.set()
+    self._thread.join()
+
+  def _run(self):
+    """Background loop extending the visibility of the tracked messages."""
+    while not self._stopped.wait(self.interval):
+      with self._lock:
+        messages = list(self._messages.values())
+      if not messages:
+        continue
+
+      try:
+        failed = change_visibility(self.sqs_client, self.queue_name, messages, self.visibility_timeout)
+      except Exception:
+        logger.exception('Failed to extend the visibility of %d messages.', len(messages))
+        continue
+
+      # deleted meanwhile or already back in the queue, nothing more to do for them
+      for message in failed:
+        self.remove(message)
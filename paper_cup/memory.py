@@ -0,0 +1,702 @@
+"""In memory transport: sns topics, sqs queues and s3 buckets in the process, without network nor aws.
+
+The clients and the sqs resource have the subset of the boto3 interface used by SNSClient,
+SQSClient and S3Client (the claim check), select them with the transport 'memory' (PaperCup.PC_TRANSPORT). All the
+clients of the process share the same `broker`: a message published in a thread can be
+consumed in an other one, not in an other process.
+"""
+import hashlib
+import io
+import itertools
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+ACCOUNT_ID = '000000000000'
+FIFO_DEDUPLICATION_INTERVAL = 300 # seconds a fifo deduplication id is remembered, like sqs and sns
+LIST_TOPICS_PAGE_SIZE = 100
+
+
+def _error(code, message, operation, status=400):
+  """Botocore error, the same as the one of the aws api."""
+  return ClientError({'Error': {'Code': code, 'Message': message}, 'ResponseMetadata': {'HTTPStatusCode': status}}, operation)
+
+
+def _md5(value):
+  """Md5 of the text, like sqs MD5OfMessageBody."""
+  return hashlib.md5(value.encode('utf-8')).hexdigest()
+
+
+def _selected(values, names):
+  """The values whose names are asked, 'All' or '.*' for all of them, None if there is none."""
+  if not values or not names:
+    return None
+  if 'All' in names or '.*' in names:
+    selected = dict(values)
+  else:
+    selected = dict((name, value) for name, value in values.items() if name in names)
+  return selected or None
+
+
+def _matches(rule, value):
+  """True if the value of a message attribute match one rule of a filter policy."""
+  if isinstance(rule, dict):
+    if 'exists' in rule:
+      return rule['exists'] == (value is not None)
+    if value is None:
+      return False
+    if 'prefix' in rule:
+      return str(value).startswith(rule['prefix'])
+    if 'anything-but' in rule:
+      excluded = rule['anything-but']
+      return value not in (excluded if isinstance(excluded, list) else [excluded])
+    return False
+  return value is not None and value == rule
+
+
+def filter_policy_match(policy, attributes):
+  """True if the sns message attributes match the subscription filter policy."""
+  for name, rules in policy.items():
+    attribute = (attributes or {}).get(name)
+    if attribute is None:
+      values = [None]
+    elif attribute['DataType'] == 'String.Array':
+      values = json.loads(attribute['StringValue'])
+    elif attribute['DataType'] == 'Number':
+      values = [float(attribute['StringValue'])]
+    else:
+      values = [attribute['StringValue']]
+    rules = rules if isinstance(rules, list) else [rules]
+    if not any(_matches(rule, value) for rule in rules for value in values):
+      return False
+  return True
+
+
+class _StoredMessage(object):
+  """Sqs message kept by a MemoryQueue."""
+
+  def __init__(self, body, message_attributes, delay, group_id, deduplication_id, sequence_number):
+    self.message_id = str(uuid.uuid4())
+    self.body = body
+    self.message_attributes = message_attributes or {}
+    self.group_id = group_id
+    self.deduplication_id = deduplication_id
+    self.sequence_number = sequence_number
+    self.sent_at = time.time()
+    self.visible_at = self.sent_at + delay
+    self.receive_count = 0
+    self.first_received_at = None
+    self.receipt_handle = None
+
+  def system_attributes(self):
+    """Sqs attributes of the message."""
+    attributes = {
+        'SenderId': ACCOUNT_ID,
+        'SentTimestamp': str(int(self.sent_at * 1000)),
+        'ApproximateReceiveCount': str(self.receive_count),
+        'ApproximateFirstReceiveTimestamp': str(int((self.first_received_at or 0) * 1000)),
+    }
+    if self.group_id:
+      attributes.update(MessageGroupId=self.group_id, MessageDeduplicationId=self.deduplication_id, SequenceNumber=str(self.sequence_number))
+    return attributes
+
+
+class MemoryQueue(object):
+  """Sqs queue: delays, visibility timeouts, long polling, fifo groups and deduplication, redrive policy."""
+
+  def __init__(self, broker, name, region, attributes=None):
+    """Empty queue."""
+    self.broker = broker
+    self.name = name
+    self.url = 'memory://%s/%s/%s' % (region, ACCOUNT_ID, name)
+    self.arn = 'arn:aws:sqs:%s:%s:%s' % (region, ACCOUNT_ID, name)
+    self.created_at = time.time()
+    self.attributes = {'VisibilityTimeout': '30', 'DelaySeconds': '0', 'MessageRetentionPeriod': '345600'}
+    self.attributes.update(attributes or {})
+    self.fifo = self.attributes.get('FifoQueue') == 'true'
+    self.messages = OrderedDict() # message id: message, in the send order
+    self._handles = {} # receipt handle of the last receive: message id
+    self._deduplication_ids = {} # fifo deduplication id: expiration time
+    self._sequence = itertools.count(1)
+    self._condition = threading.Condition(broker.lock)
+
+  def send(self, body, message_attributes=None, delay=None, group_id=None, deduplication_id=None):
+    """Add a message, return it or the previous one with the same fifo deduplication id."""
+    if self.fifo:
+      if not group_id:
+        raise _error('MissingParameter', 'The request must contain the parameter MessageGroupId.', 'SendMessage')
+      if not deduplication_id:
+        if self.attributes.get('ContentBasedDeduplication') != 'true':
+          raise _error('InvalidParameterValue', 'The queue should either have ContentBasedDeduplication enabled or MessageDeduplicationId provided explicitly', 'SendMessage')
+        deduplication_id = hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+    with self._condition:
+      now = time.time()
+      if deduplication_id and self._deduplication_ids.get(deduplication_id, 0) > now:
+        return self._find_deduplicated(deduplication_id)
+
+      if delay is None:
+        delay = int(self.attributes.get('DelaySeconds', 0))
+      message = _StoredMessage(body, message_attributes, delay, group_id, deduplication_id, next(self._sequence))
+      self.messages[message.message_id] = message
+      if deduplication_id:
+        self._deduplication_ids[deduplication_id] = now + FIFO_DEDUPLICATION_INTERVAL
+      self._condition.notify_all()
+    return message
+
+  def receive(self, max_number=1, wait_time=0, visibility_timeout=None):
+    """Take up to max_number visible messages, waiting up to wait_time seconds for the first one."""
+    if visibility_timeout is None:
+      visibility_timeout = int(self.attributes.get('VisibilityTimeout', 30))
+    deadline = time.time() + (wait_time or 0)
+    with self._condition:
+      while True:
+        messages = self._take(max_number, visibility_timeout)
+        remaining = deadline - time.time()
+        if messages or remaining <= 0:
+          return messages
+        # woken by a send, or at the end of the wait, or to check the delayed and invisible messages
+        self._condition.wait(min(remaining, 0.1))
+
+  def delete(self, receipt_handle):
+    """Delete the message if the receipt handle is the one of it last receive, True if it was."""
+    with self._condition:
+      message_id = self._handles.pop(receipt_handle, None)
+      return self.messages.pop(message_id, None) is not None
+
+  def change_visibility(self, receipt_handle, visibility_timeout):
+    """Make the received message visible again in visibility_timeout seconds, False if it is not found."""
+    with self._condition:
+      message = self.messages.get(self._handles.get(receipt_handle))
+      if message is None:
+        return False
+      message.visible_at = time.time() + visibility_timeout
+      self._condition.notify_all()
+      return True
+
+  def purge(self):
+    """Delete all the messages."""
+    with self._condition:
+      self.messages.clear()
+      self._handles.clear()
+
+  def get_attributes(self):
+    """Attributes of the queue with the approximate numbers of messages."""
+    with self._condition:
+      now = time.time()
+      delayed = sum(1 for message in self.messages.values() if not message.receive_count and message.visible_at > now)
+      not_visible = sum(1 for message in self.messages.values() if message.receive_count and message.visible_at > now)
+      attributes = dict(self.attributes, **{
+          'QueueArn': self.arn,
+          'CreatedTimestamp': str(int(self.created_at)),
+          'ApproximateNumberOfMessages': str(len(self.messages) - delayed - not_visible),
+          'ApproximateNumberOfMessagesNotVisible': str(not_visible),
+          'ApproximateNumberOfMessagesDelayed': str(delayed),
+      })
+    return attributes
+
+  def _take(self, max_number, visibility_timeout):
+    """Receive the visible messages, the lock is held."""
+    now = time.time()
+    redrive = json.loads(self.attributes['RedrivePolicy']) if self.attributes.get('RedrivePolicy') else None
+    taken = []
+    blocked_groups = set()
+    for message in list(self.messages.values()):
+      if len(taken) >= max_number:
+        break
+      if message.group_id in blocked_groups:
+        continue
+      if message.visible_at > now:
+        # in flight (or delayed), the next messages of the group wait for it
+        if message.group_id:
+          blocked_groups.add(message.group_id)
+        continue
+
+      if redrive and message.receive_count >= int(redrive['maxReceiveCount']):
+        self._forget(message)
+        self.broker.dead_letter(redrive['deadLetterTargetArn'], message)
+        continue
+
+      message.receive_count += 1
+      message.first_received_at = message.first_received_at or now
+      message.visible_at = now + visibility_timeout
+      self._handles.pop(message.receipt_handle, None)
+      message.receipt_handle = str(uuid.uuid4())
+      self._handles[message.receipt_handle] = message.message_id
+      taken.append(message)
+    return taken
+
+  def _forget(self, message):
+    """Remove the message, the lock is held."""
+    self.messages.pop(message.message_id, None)
+    self._handles.pop(message.receipt_handle, None)
+
+  def _find_deduplicated(self, deduplication_id):
+    """Message already sent with the deduplication id, it may be deleted already."""
+    for message in self.messages.values():
+      if message.deduplication_id == deduplication_id:
+        return message
+    return _StoredMessage('', None, 0, None, deduplication_id, 0)
+
+
+class MemoryTopic(object):
+  """Sns topic delivering the messages to it sqs subscriptions."""
+
+  def __init__(self, name, region, attributes=None):
+    """Topic without subscription."""
+    self.name = name
+    self.arn = 'arn:aws:sns:%s:%s:%s' % (region, ACCOUNT_ID, name)
+    self.attributes = dict(attributes or {})
+    self.fifo = self.attributes.get('FifoTopic') == 'true'
+    self.subscriptions = [] # (subscription arn, queue arn, attributes)
+    self._deduplication_ids = {}
+
+  def deduplication_id(self, message, group_id, deduplication_id):
+    """Check the fifo fields of a published message, return it deduplication id, the hash of it with the content based deduplication."""
+    if not group_id:
+      raise _error('InvalidParameter', 'Invalid parameter: The MessageGroupId parameter is required for FIFO topics', 'Publish')
+    if deduplication_id:
+      return deduplication_id
+    if self.attributes.get('ContentBasedDeduplication') != 'true':
+      raise _error('InvalidParameter', 'Invalid parameter: The topic should either have ContentBasedDeduplication enabled or MessageDeduplicationId provided explicitly', 'Publish')
+    return hashlib.sha256(message.encode('utf-8')).hexdigest()
+
+
+class MemoryBroker(object):
+  """Topics, queues and buckets of the process, shared by all the memory clients."""
+
+  def __init__(self):
+    """No topic, queue nor bucket."""
+    self.lock = threading.RLock()
+    self.topics = {} # arn: MemoryTopic
+    self.queues = {} # url: MemoryQueue
+    self.buckets = {} # name: {key: bytes}
+
+  def reset(self):
+    """Drop all the topics, queues and buckets."""
+    with self.lock:
+      self.topics.clear()
+      self.queues.clear()
+      self.buckets.clear()
+
+  def bucket(self, name, operation):
+    """Get the objects of the bucket, the NoSuchBucket error of s3 if it doesn't exist."""
+    bucket = self.buckets.get(name)
+    if bucket is None:
+      raise _error('NoSuchBucket', 'The specified bucket does not exist', operation, 404)
+    return bucket
+
+  def topic(self, topic_arn, operation):
+    """Get the topic from it arn, the NotFound error of sns if it doesn't exist."""
+    topic = self.topics.get(topic_arn)
+    if topic is None:
+      raise _error('NotFound', 'Topic does not exist', operation, 404)
+    return topic
+
+  def queue(self, queue_url, operation):
+    """Get the queue from it url, the NonExistentQueue error of sqs if it doesn't exist."""
+    queue = self.queues.get(queue_url)
+    if queue is None:
+      raise _error('AWS.SimpleQueueService.NonExistentQueue', 'The specified queue does not exist.', operation)
+    return queue
+
+  def queue_by_arn(self, queue_arn):
+    """Get the queue from it arn, None if it doesn't exist."""
+    with self.lock:
+      for queue in self.queues.values():
+        if queue.arn == queue_arn:
+          return queue
+    return None
+
+  def deliver(self, topic, message, attributes, group_id, deduplication_id):
+    """Send a published message to the subscribed queues, return it sns message id."""
+    now = time.time()
+    with self.lock:
+      if topic.fifo:
+        deduplication_id = topic.deduplication_id(message, group_id, deduplication_id)
+        previous = topic._deduplication_ids.get(deduplication_id)
+        if previous and previous[1] > now:
+          return previous[0]
+
+      message_id = str(uuid.uuid4())
+      if topic.fifo:
+        topic._deduplication_ids[deduplication_id] = (message_id, now + FIFO_DEDUPLICATION_INTERVAL)
+      subscriptions = list(topic.subscriptions)
+
+    for _, queue_arn, subscription_attributes in subscriptions:
+      policy = subscription_attributes.get('FilterPolicy')
+      if policy and not filter_policy_match(json.loads(policy), attributes):
+        continue
+      queue = self.queue_by_arn(queue_arn)
+      if queue is None:
+        continue
+      if subscription_attributes.get('RawMessageDelivery') == 'true':
+        queue.send(message, attributes, group_id=group_id, deduplication_id=deduplication_id)
+      else:
+        envelope = self._envelope(topic, message_id, message, attributes, now)
+        queue.send(envelope, group_id=group_id, deduplication_id=deduplication_id)
+    return message_id
+
+  def dead_letter(self, queue_arn, message):
+    """Move a message received too many times to the dead letter queue."""
+    queue = self.queue_by_arn(queue_arn)
+    if queue is not None:
+      queue.send(message.body, message.message_attributes, delay=0, group_id=message.group_id, deduplication_id=message.deduplication_id)
+
+  def _envelope(self, topic, message_id, message, attributes, published_at):
+    """Sns json notification wrapping the message, the sqs body without raw message delivery."""
+    envelope = {
+        'Type': 'Notification',
+        'MessageId': message_id,
+        'TopicArn': topic.arn,
+        'Message': message,
+        'Timestamp': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(published_at)) + '.%03dZ' % (published_at % 1 * 1000),
+        'SignatureVersion': '1',
+    }
+    if attributes:
+      envelope['MessageAttributes'] = dict(
+          (name, {'Type': attribute['DataType'], 'Value': attribute.get('StringValue')}) for name, attribute in attributes.items()
+      )
+    return json.dumps(envelope)
+
+
+broker = MemoryBroker()
+
+
+class MemorySNSClient(object):
+  """Sns client of the memory transport, same methods and responses as the boto3 one."""
+
+  def __init__(self, region, broker=broker):
+    """Client of the topics of the broker."""
+    self.region = region
+    self.broker = broker
+
+  def create_topic(self, Name, Attributes=None, **kwargs):
+    """Create the topic, or return the arn of the existing one."""
+    topic = MemoryTopic(Name, self.region, Attributes)
+    if topic.fifo != Name.endswith('.fifo'):
+      raise _error('InvalidParameter', 'Invalid parameter: Fifo Topic names must end with .fifo and must be made up of only uppercase and lowercase ASCII letters, numbers, underscores, and hyphens, and must be between 1 and 256 characters long.', 'CreateTopic')
+    with self.broker.lock:
+      topic = self.broker.topics.setdefault(topic.arn, topic)
+    return {'TopicArn': topic.arn}
+
+  def delete_topic(self, TopicArn):
+    """Delete the topic and it subscriptions."""
+    with self.broker.lock:
+      self.broker.topics.pop(TopicArn, None)
+    return {}
+
+  def list_topics(self, NextToken=None):
+    """List the topics by pages of 100."""
+    with self.broker.lock:
+      arns = sorted(self.broker.topics)
+    start = int(NextToken or 0)
+    response = {'Topics': [{'TopicArn': arn} for arn in arns[start:start + LIST_TOPICS_PAGE_SIZE]]}
+    if start + LIST_TOPICS_PAGE_SIZE < len(arns):
+      response['NextToken'] = str(start + LIST_TOPICS_PAGE_SIZE)
+    return response
+
+  def subscribe(self, TopicArn, Protocol, Endpoint, Attributes=None, **kwargs):
+    """Subscribe a sqs queue to the topic, the only protocol of this transport."""
+    if Protocol != 'sqs':
+      raise _error('InvalidParameter', 'Invalid parameter: only the sqs protocol is supported in memory', 'Subscribe')
+    with self.broker.lock:
+      topic = self.broker.topic(TopicArn, 'Subscribe')
+      for subscription_arn, queue_arn, _ in topic.subscriptions:
+        if queue_arn == Endpoint:
+          return {'SubscriptionArn': subscription_arn}
+      subscription_arn = '%s:%s' % (TopicArn, uuid.uuid4())
+      topic.subscriptions.append((subscription_arn, Endpoint, dict(Attributes or {})))
+    return {'SubscriptionArn': subscription_arn}
+
+  def publish(self, TopicArn, Message, MessageAttributes=None, MessageGroupId=None, MessageDeduplicationId=None, **kwargs):
+    """Deliver the message to the subscribed queues."""
+    topic = self.broker.topic(TopicArn, 'Publish')
+    message_id = self.broker.deliver(topic, Message, MessageAttributes, MessageGroupId, MessageDeduplicationId)
+    return {'MessageId': message_id}
+
+  def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+    """Deliver up to 10 messages to the subscribed queues."""
+    if len(PublishBatchRequestEntries) > 10:
+      raise _error('TooManyEntriesInBatchRequest', 'The batch request contains more entries than permissible.', 'PublishBatch')
+    topic = self.broker.topic(TopicArn, 'PublishBatch')
+    response = {'Successful': [], 'Failed': []}
+    for entry in PublishBatchRequestEntries:
+      try:
+        message_id = self.broker.deliver(
+            topic, entry['Message'], entry.get('MessageAttributes'), entry.get('MessageGroupId'), entry.get('MessageDeduplicationId'),
+        )
+      except ClientError as e:
+        error = e.response['Error']
+        response['Failed'].append({'Id': entry['Id'], 'Code': error['Code'], 'Message': error['Message'], 'SenderFault': True})
+      else:
+        response['Successful'].append({'Id': entry['Id'], 'MessageId': message_id})
+    return response
+
+
+class MemorySQSClient(object):
+  """Sqs client of the memory transport, same methods and responses as the boto3 one."""
+
+  def __init__(self, region, broker=broker):
+    """Client of the queues of the broker."""
+    self.region = region
+    self.broker = broker
+
+  def create_queue(self, QueueName, Attributes=None, **kwargs):
+    """Create the queue, or return the url of the existing one."""
+    queue = MemoryQueue(self.broker, QueueName, self.region, Attributes)
+    if queue.fifo != QueueName.endswith('.fifo'):
+      raise _error('InvalidParameterValue', 'The name of a FIFO queue can only include alphanumeric characters, hyphens, or underscores, must end with .fifo suffix.', 'CreateQueue')
+    with self.broker.lock:
+      queue = self.broker.queues.setdefault(queue.url, queue)
+    return {'QueueUrl': queue.url}
+
+  def delete_queue(self, QueueUrl):
+    """Delete the queue and it messages."""
+    with self.broker.lock:
+      self.broker.queue(QueueUrl, 'DeleteQueue')
+      del self.broker.queues[QueueUrl]
+    return {}
+
+  def get_queue_url(self, QueueName, **kwargs):
+    """Url of the queue from it name."""
+    with self.broker.lock:
+      for queue in self.broker.queues.values():
+        if queue.name == QueueName:
+          return {'QueueUrl': queue.url}
+    raise _error('AWS.SimpleQueueService.NonExistentQueue', 'The specified queue does not exist.', 'GetQueueUrl')
+
+  def get_queue_attributes(self, QueueUrl, AttributeNames=None):
+    """Attributes of the queue."""
+    attributes = self.broker.queue(QueueUrl, 'GetQueueAttributes').get_attributes()
+    return {'Attributes': _selected(attributes, AttributeNames or []) or {}}
+
+  def set_queue_attributes(self, QueueUrl, Attributes):
+    """Change attributes of the queue, like the RedrivePolicy."""
+    queue = self.broker.queue(QueueUrl, 'SetQueueAttributes')
+    with self.broker.lock:
+      queue.attributes.update(Attributes)
+    return {}
+
+  def send_message(self, QueueUrl, MessageBody, DelaySeconds=None, MessageAttributes=None, MessageGroupId=None, MessageDeduplicationId=None):
+    """Send one message to the queue."""
+    message = self.broker.queue(QueueUrl, 'SendMessage').send(MessageBody, MessageAttributes, DelaySeconds, MessageGroupId, MessageDeduplicationId)
+    return {'MessageId': message.message_id, 'MD5OfMessageBody': _md5(MessageBody)}
+
+  def send_message_batch(self, QueueUrl, Entries):
+    """Send up to 10 messages to the queue."""
+    return self._batch(QueueUrl, Entries, 'SendMessageBatch', lambda queue, entry: {'MessageId': queue.send(
+        entry['MessageBody'], entry.get('MessageAttributes'), entry.get('DelaySeconds'), entry.get('MessageGroupId'), entry.get('MessageDeduplicationId'),
+    ).message_id, 'MD5OfMessageBody': _md5(entry['MessageBody'])})
+
+  def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, VisibilityTimeout=None, MessageAttributeNames=None, AttributeNames=None, **kwargs):
+    """Receive up to MaxNumberOfMessages messages, waiting up to WaitTimeSeconds for them."""
+    queue = self.broker.queue(QueueUrl, 'ReceiveMessage')
+    messages = []
+    for message in queue.receive(MaxNumberOfMessages, WaitTimeSeconds, VisibilityTimeout):
+      received = {'MessageId': message.message_id, 'ReceiptHandle': message.receipt_handle, 'Body': message.body, 'MD5OfBody': _md5(message.body)}
+      attributes = _selected(message.system_attributes(), AttributeNames)
+      if attributes:
+        received['Attributes'] = attributes
+      message_attributes = _selected(message.message_attributes, MessageAttributeNames)
+      if message_attributes:
+        received['MessageAttributes'] = message_attributes
+      messages.append(received)
+    return {'Messages': messages} if messages else {}
+
+  def delete_message(self, QueueUrl, ReceiptHandle):
+    """Delete a received message."""
+    self.broker.queue(QueueUrl, 'DeleteMessage').delete(ReceiptHandle)
+    return {}
+
+  def delete_message_batch(self, QueueUrl, Entries):
+    """Delete up to 10 received messages."""
+    return self._batch(QueueUrl, Entries, 'DeleteMessageBatch', lambda queue, entry: queue.delete(entry['ReceiptHandle']) and {})
+
+  def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+    """Change the visibility timeout of a received message."""
+    if not self.broker.queue(QueueUrl, 'ChangeMessageVisibility').change_visibility(ReceiptHandle, VisibilityTimeout):
+      raise _error('ReceiptHandleIsInvalid', 'The input receipt handle is invalid.', 'ChangeMessageVisibility')
+    return {}
+
+  def change_message_visibility_batch(self, QueueUrl, Entries):
+    """Change the visibility timeout of up to 10 received messages."""
+    return self._batch(QueueUrl, Entries, 'ChangeMessageVisibilityBatch', lambda queue, entry: queue.change_visibility(
+        entry['ReceiptHandle'], entry['VisibilityTimeout'],
+    ) and {})
+
+  def purge_queue(self, QueueUrl):
+    """Delete all the messages of the queue."""
+    self.broker.queue(QueueUrl, 'PurgeQueue').purge()
+    return {}
+
+  def _batch(self, queue_url, entries, operation, action):
+    """Run the action on each entry, it return the response entry or a falsy value for the invalid receipt handles."""
+    if len(entries) > 10:
+      raise _error('AWS.SimpleQueueService.TooManyEntriesInBatchRequest', 'Maximum number of entries per request are 10.', operation)
+    queue = self.broker.queue(queue_url, operation)
+    response = {'Successful': [], 'Failed': []}
+    for entry in entries:
+      try:
+        result = action(queue, entry)
+      except ClientError as e:
+        error = e.response['Error']
+        response['Failed'].append({'Id': entry['Id'], 'Code': error['Code'], 'Message': error['Message'], 'SenderFault': True})
+        continue
+      if result is False:
+        # sqs accept deleting an old receipt handle but not changing it visibility
+        if operation == 'DeleteMessageBatch':
+          result = {}
+        else:
+          response['Failed'].append({'Id': entry['Id'], 'Code': 'ReceiptHandleIsInvalid', 'Message': 'The input receipt handle is invalid.', 'SenderFault': True})
+          continue
+      result = dict(result, Id=entry['Id'])
+      response['Successful'].append(result)
+    return response
+
+
+class MemoryMessage(object):
+  """Received sqs message, like the boto3 sqs.Message resource."""
+
+  def __init__(self, client, queue_url, received):
+    """Message from the receive_message response."""
+    self._client = client
+    self.queue_url = queue_url
+    self.message_id = received['MessageId']
+    self.receipt_handle = received['ReceiptHandle']
+    self.body = received['Body']
+    self.md5_of_body = received['MD5OfBody']
+    self.attributes = received.get('Attributes')
+    self.message_attributes = received.get('MessageAttributes')
+
+  def delete(self):
+    """Delete the message from the queue."""
+    return self._client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=self.receipt_handle)
+
+  def change_visibility(self, VisibilityTimeout):
+    """Change the visibility timeout of the message."""
+    return self._client.change_message_visibility(QueueUrl=self.queue_url, ReceiptHandle=self.receipt_handle, VisibilityTimeout=VisibilityTimeout)
+
+
+class MemoryQueueResource(object):
+  """Sqs queue, like the boto3 sqs.Queue resource."""
+
+  def __init__(self, client, url):
+    """Queue of the url, it attributes are loaded when read."""
+    self._client = client
+    self.url = url
+    self._attributes = None
+
+  @property
+  def attributes(self):
+    """Attributes of the queue, loaded on the first read then by reload."""
+    if self._attributes is None:
+      self.reload()
+    return self._attributes
+
+  def reload(self):
+    """Read the attributes of the queue again."""
+    self._attributes = self._client.get_queue_attributes(QueueUrl=self.url, AttributeNames=['All'])['Attributes']
+
+  def receive_messages(self, **kwargs):
+    """Receive the messages, same arguments as receive_message."""
+    response = self._client.receive_message(QueueUrl=self.url, **kwargs)
+    return [MemoryMessage(self._client, self.url, received) for received in response.get('Messages', [])]
+
+  def send_message(self, **kwargs):
+    """Send one message."""
+    return self._client.send_message(QueueUrl=self.url, **kwargs)
+
+  def send_messages(self, Entries):
+    """Send up to 10 messages."""
+    return self._client.send_message_batch(QueueUrl=self.url, Entries=Entries)
+
+  def delete_messages(self, Entries):
+    """Delete up to 10 messages."""
+    return self._client.delete_message_batch(QueueUrl=self.url, Entries=Entries)
+
+  def change_message_visibility_batch(self, Entries):
+    """Change the visibility timeout of up to 10 messages."""
+    return self._client.change_message_visibility_batch(QueueUrl=self.url, Entries=Entries)
+
+  def purge(self):
+    """Delete all the messages."""
+    return self._client.purge_queue(QueueUrl=self.url)
+
+
+class MemorySQSResource(object):
+  """Sqs resource of the memory transport, only the queues."""
+
+  def __init__(self, region, broker=broker):
+    """Resource of the queues of the broker."""
+    self._client = MemorySQSClient(region, broker)
+
+  def Queue(self, url):
+    """Queue from it url."""
+    return MemoryQueueResource(self._client, url)
+
+
+class MemoryS3Client(object):
+  """S3 client of the memory transport, the objects of the claim check."""
+
+  def __init__(self, region, broker=broker):
+    """Client of the buckets of the broker."""
+    self.region = region
+    self.broker = broker
+
+  def create_bucket(self, Bucket, **kwargs):
+    """Create the bucket, the BucketAlreadyOwnedByYou error of s3 if it exists."""
+    with self.broker.lock:
+      if Bucket in self.broker.buckets:
+        raise _error('BucketAlreadyOwnedByYou', 'Your previous request to create the named bucket succeeded and you already own it.', 'CreateBucket', 409)
+      self.broker.buckets[Bucket] = {}
+    return {'Location': '/' + Bucket}
+
+  def put_object(self, Bucket, Key, Body, **kwargs):
+    """Store the bytes, or the text as utf-8."""
+    data = Body.encode('utf-8') if not isinstance(Body, bytes) else Body
+    with self.broker.lock:
+      self.broker.bucket(Bucket, 'PutObject')[Key] = data
+    return {'ETag': '"%s"' % hashlib.md5(data).hexdigest()}
+
+  def get_object(self, Bucket, Key):
+    """Get the object, it Body is a stream like the StreamingBody of boto3."""
+    with self.broker.lock:
+      data = self.broker.bucket(Bucket, 'GetObject').get(Key)
+    if data is None:
+      raise _error('NoSuchKey', 'The specified key does not exist.', 'GetObject', 404)
+    return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+  def delete_object(self, Bucket, Key):
+    """Delete the object, nothing if it doesn't exist like s3."""
+    with self.broker.lock:
+      self.broker.bucket(Bucket, 'DeleteObject').pop(Key, None)
+    return {}
+
+  def list_objects_v2(self, Bucket, Prefix=''):
+    """Objects of the bucket, all of them in one page."""
+    with self.broker.lock:
+      keys = sorted(key for key in self.broker.bucket(Bucket, 'ListObjectsV2') if key.startswith(Prefix))
+      contents = [{'Key': key, 'Size': len(self.broker.buckets[Bucket][key])} for key in keys]
+    response = {'Name': Bucket, 'Prefix': Prefix, 'KeyCount': len(contents), 'IsTruncated': False}
+    if contents:
+      response['Contents'] = contents
+    return response
+
+
+def build(kind, service, endpoint_url, region, aws_access_key_id=None, aws_secret_access_key=None, config=None):
+  """Build the memory client or resource of the service, the transport factory of ClientRegistry."""
+  factories = {
+      ('client', 'sns'): MemorySNSClient,
+      ('client', 'sqs'): MemorySQSClient,
+      ('resource', 'sqs'): MemorySQSResource,
+      ('client', 's3'): MemoryS3Client,
+  }
+  factory = factories.get((kind, service))
+  if factory is None:
+    raise NotImplementedError('No %s %s in the memory transport.' % (service, kind))
+  return factory(region)
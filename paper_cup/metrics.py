@@ -0,0 +1,208 @@
+"""Metrics of the publish and consume paths: hooks called by paper cup and the exporters of them.
+
+Set PaperCup.PC_METRICS to a Metrics instance to get them, without it nothing is measured.
+The names, with their tags:
+
+  publish_calls, published_messages, publish_errors (topic)  counters of the sns calls
+  publish_seconds (topic), serialize_seconds                 duration of the sns calls and serializations
+  received_messages, empty_receives (queue)                  counters of the sqs receives
+  receive_batch_size (queue)                                 messages by non empty receive
+  action_seconds, action_errors (consumer, action)           duration and failures of the consumer actions
+  consume_lag_seconds (consumer, action)                     time from the publishing to the start of the action
+  retries, circuit_open (call)                               retries of the aws calls, calls refused by the circuit breaker
+"""
+import logging
+import socket
+import threading
+
+try:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError: # python 2
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+logger = logging.getLogger(__name__)
+
+PUBLISHED_AT_FIELD = 'pc_published_at' # timestamp added to the messages by the publisher, prefixed to not clash with a field of the app
+
+# upper bounds of the histograms buckets, in seconds for the durations
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+SIZE_BUCKETS = (1, 2, 3, 5, 8, 10) # messages by receive
+
+
+class Metrics(object):
+  """Hooks of the publish and consume paths, subclass it to send the metrics elsewhere."""
+
+  def increment(self, name, value=1, tags=None):
+    """Add to a counter."""
+    raise NotImplementedError()
+
+  def observe(self, name, value, tags=None):
+    """Record a value of a histogram, a duration in seconds for the names ending by _seconds."""
+    raise NotImplementedError()
+
+
+class CallbackMetrics(Metrics):
+  """Call `callback(kind, name, value, tags)` for each metric, kind is 'increment' or 'observe'."""
+
+  def __init__(self, callback):
+    """Use the callback."""
+    self.callback = callback
+
+  def increment(self, name, value=1, tags=None):
+    self.callback('increment', name, value, tags or {})
+
+  def observe(self, name, value, tags=None):
+    self.callback('observe', name, value, tags or {})
+
+
+class PrometheusMetrics(Metrics):
+  """Counters and histograms kept in the process, `render` give them in the prometheus text format.
+
+    `serve(port)` expose them on http for the prometheus scrapes. With the process workers the
+    actions metrics stay in the worker processes, use StatsDMetrics for them.
+  """
+
+  def __init__(self, prefix='paper_cup', buckets=None):
+    """Start with no metric, `buckets` by histogram name replace the default ones."""
+    self.prefix = prefix
+    self.buckets = dict({'receive_batch_size': SIZE_BUCKETS}, **(buckets or {}))
+    self._counters = {} # (name, tags): value
+    self._histograms = {} # (name, tags): [bucket counts, sum, count]
+    self._lock = threading.Lock()
+    self._server = None
+
+  def increment(self, name, value=1, tags=None):
+    key = (name, tuple(sorted((tags or {}).items())))
+    with self._lock:
+      self._counters[key] = self._counters.get(key, 0) + value
+
+  def observe(self, name, value, tags=None):
+    key = (name, tuple(sorted((tags or {}).items())))
+    buckets = self.buckets.get(name, DEFAULT_BUCKETS)
+    with self._lock:
+      histogram = self._histograms.get(key)
+      if histogram is None:
+        histogram = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+      for i, bound in enumerate(buckets):
+        if value <= bound:
+          histogram[0][i] += 1
+      histogram[1] += value
+      histogram[2] += 1
+
+  def render(self):
+    """Metrics in the prometheus text exposition format."""
+    with self._lock:
+      counters = sorted(self._counters.items())
+      histograms = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._histograms.items())
+
+    lines = []
+    typed = set()
+    for (name, tags), value in counters:
+      metric = '%s_%s_total' % (self.prefix, name)
+      if metric not in typed:
+        typed.add(metric)
+        lines.append('# TYPE %s counter' % metric)
+      lines.append('%s%s %s' % (metric, _labels(tags), _number(value)))
+    for (name, tags), (counts, total, count) in histograms:
+      metric = '%s_%s' % (self.prefix, name)
+      if metric not in typed:
+        typed.add(metric)
+        lines.append('# TYPE %s histogram' % metric)
+      for bound, bucket_count in zip(self.buckets.get(name, DEFAULT_BUCKETS), counts):
+        lines.append('%s_bucket%s %d' % (metric, _labels(tags + (('le', _number(bound)),)), bucket_count))
+      lines.append('%s_bucket%s %d' % (metric, _labels(tags + (('le', '+Inf'),)), count))
+      lines.append('%s_sum%s %s' % (metric, _labels(tags), _number(total)))
+      lines.append('%s_count%s %d' % (metric, _labels(tags), count))
+    return '\n'.join(lines) + '\n'
+
+  def serve(self, port, address=''):
+    """Serve `render` on http in a daemon thread, return the server."""
+    metrics = self
+
+    class Handler(BaseHTTPRequestHandler):
+
+      def do_GET(self):
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, *args):
+        pass
+
+    self._server = HTTPServer((address, port), Handler)
+    thread = threading.Thread(target=self._server.serve_forever, name='paper-cup-metrics')
+    thread.daemon = True
+    thread.start()
+    return self._server
+
+  def close(self):
+    """Stop the http server."""
+    if self._server:
+      self._server.shutdown()
+      self._server.server_close()
+      self._server = None
+
+
+class StatsDMetrics(Metrics):
+  """Send each metric to a statsd agent over udp, the tags in the dogstatsd format.
+
+    The durations (names ending by _seconds) are sent as timings in milliseconds, the other
+    values as histograms. A send that fail is dropped, the metrics never fail the caller.
+  """
+
+  def __init__(self, host='127.0.0.1', port=8125, prefix='paper_cup', tags=True):
+    """Use the agent, without `tags` they are left out for the agents that don't support them."""
+    self.address = (host, port)
+    self.prefix = prefix
+    self.tags = tags
+    self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self._socket.setblocking(False)
+
+  def increment(self, name, value=1, tags=None):
+    self._send('%s.%s:%s|c' % (self.prefix, name, _number(value)), tags)
+
+  def observe(self, name, value, tags=None):
+    if name.endswith('_seconds'):
+      self._send('%s.%s:%s|ms' % (self.prefix, name[:-len('_seconds')], _number(value * 1000)), tags)
+    else:
+      self._send('%s.%s:%s|h' % (self.prefix, name, _number(value)), tags)
+
+  def close(self):
+    """Close the socket."""
+    self._socket.close()
+
+  def _send(self, line, tags):
+    """Send the statsd line."""
+    if tags and self.tags:
+      line += '|#' + ','.join('%s:%s' % (key, value) for key, value in sorted(tags.items()))
+    try:
+      self._socket.sendto(line.encode('utf-8'), self.address)
+    except (socket.error, OSError):
+      logger.debug('Failed to send the metric %s.', line)
+
+
+def record_receive(metrics, queue_name, count):
+  """Metrics of a receive call that got `count` messages."""
+  tags = {'queue': queue_name}
+  if count:
+    metrics.increment('received_messages', count, tags)
+    metrics.observe('receive_batch_size', count, tags)
+  else:
+    metrics.increment('empty_receives', tags=tags)
+
+
+def _labels(tags):
+  """Prometheus labels of the (name, value) tags."""
+  if not tags:
+    return ''
+  return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in tags)
+
+
+def _number(value):
+  """Number without useless decimals."""
+  if isinstance(value, float) and value.is_integer():
+    return str(int(value))
+  return repr(value) if isinstance(value, float) else str(value)
@@ -0,0 +1,182 @@
+"""Consumer of several queues sharing one worker pool, by weight."""
+import copy
+import logging
+import threading
+import time
+
+from .failures import ConsumeReport
+from .paper_cup import ConsumePC, _ConsumeSession
+from .polling import AdaptivePoller
+from .workers import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+
+class CapacityScheduler(object):
+  """Share the slots of the worker pool between the queues by weight.
+
+    Each queue has a reserved share of the `total` slots by weight (at least one). A queue can
+    also take the free slots that are not reserved by the other active queues, a queue is active
+    when it has messages in flight or received some in the last `active_for` seconds. So a flood
+    on one queue use all the workers while the others are idle, but can't take their share once
+    they receive messages again.
+  """
+
+  def __init__(self, total, weights, active_for=30):
+    """Compute the reserved slots of each queue from the weights."""
+    total_weight = float(sum(weights.values()))
+    self.total = total
+    self.reserved = dict((name, max(1, int(total * weight / total_weight))) for name, weight in weights.items())
+    self.in_flight = dict.fromkeys(weights, 0)
+    self.active_for = active_for
+    self._active_at = dict.fromkeys(weights, 0)
+    self._lock = threading.Lock()
+
+  def available(self, name):
+    """Number of messages the queue can receive now."""
+    with self._lock:
+      now = time.time()
+      free = self.total - sum(self.in_flight.values())
+      own = max(0, self.reserved[name] - self.in_flight[name])
+      others = sum(
+          max(0, self.reserved[other] - self.in_flight[other])
+          for other in self.reserved
+          if other != name and (self.in_flight[other] or now - self._active_at[other] < self.active_for)
+      )
+      return max(0, min(free, max(own, free - others)))
+
+  def acquire(self, name, count):
+    """The queue received `count` messages."""
+    with self._lock:
+      self.in_flight[name] += count
+      self._active_at[name] = time.time()
+
+  def release(self, name, count=1):
+    """The queue is done with `count` messages."""
+    with self._lock:
+      self.in_flight[name] -= count
+
+
+class MultiQueueConsumePC(ConsumePC):
+  """Consumer of the queues of PC_SQS_QUEUES, with their weight.
+
+    Each queue is received by it own thread and the workers are shared by weight (see
+    CapacityScheduler), a flood on a low weight queue doesn't starve the others. The consumer
+    action classes are subclasses of it like with ConsumePC, they handle the messages of all the
+    queues. The failed items are requeued in the queue they come from.
+  """
+
+  _pc_base_class = True
+
+  PC_SQS_QUEUES = {} # queue name: weight, ex: {'orders_high': 3, 'orders_low': 1}
+  # seconds a queue keep it reserved workers after it last received messages
+  PC_QUEUE_ACTIVE_FOR = 30
+
+  sqs_clients = None # queue name: SQSClient
+  pollers = None # queue name: AdaptivePoller
+
+  def __init__(self, *args, **kwargs):
+    """Build a consumer by queue, the consumer action classes share the client of the consumer."""
+    if not self.PC_ENABLE or kwargs.get('sqs_client'):
+      super(MultiQueueConsumePC, self).__init__(*args, **kwargs)
+      return
+
+    assert(self.PC_SQS_QUEUES)
+    self.sqs_clients = {}
+    for queue_name in sorted(self.PC_SQS_QUEUES):
+      self.sqs_client = self.sqs_clients[queue_name] = self._lane(queue_name)._build_sqs_client()
+
+  def consume(self, workers=None, executor=None, prefetch=None):
+    """Read the messages of all the queues until they are empty, return a ConsumeReport.
+
+      The queues are received concurrently, `prefetch` is not used.
+    """
+    return self._consume_lanes(workers, executor, until_empty=True)
+
+  def run_forever(self, workers=None, executor=None):
+    """Consume the messages of all the queues until `stop` is called, return a ConsumeReport."""
+    return self._consume_lanes(workers, executor, until_empty=False)
+
+  def stop(self):
+    """Stop receiving from all the queues, called before they are received it stop them at once."""
+    self._stop_requested = True
+    for poller in (self.pollers or {}).values():
+      poller.stop()
+
+  def _consume_lanes(self, workers, executor, until_empty):
+    """Receive each queue from it own thread and run the actions on the shared worker pool."""
+    # the queues share the deduplicator
+    self._get_deduplicator()
+    lanes = dict((queue_name, self._lane(queue_name)) for queue_name in self.sqs_clients)
+    workers = workers or self.PC_CONSUME_WORKERS or len(lanes)
+    executor = executor or self.PC_CONSUME_EXECUTOR
+
+    dispatcher = self._get_dispatcher()
+    report = ConsumeReport()
+    pool = WorkerPool(self, workers, executor=executor)
+    scheduler = CapacityScheduler(pool.max_in_flight, self.PC_SQS_QUEUES, active_for=self.PC_QUEUE_ACTIVE_FOR)
+
+    self.pollers = {}
+    sessions = {}
+    for queue_name, lane in lanes.items():
+      lane._dispatcher = dispatcher
+      sessions[queue_name] = _ConsumeSession(lane, report)
+      self.pollers[queue_name] = AdaptivePoller(
+          lane.sqs_client, lane._receive_kwargs(), min_wait_time=0 if until_empty else self.PC_POLL_MIN_WAIT_TIME,
+          max_wait_time=self.PC_POLL_MAX_WAIT_TIME, depth_interval=self.PC_POLL_DEPTH_INTERVAL, until_empty=until_empty,
+          metrics=self.PC_METRICS, queue_name=queue_name, drain=pool.join,
+      )
+    if self._stop_requested:
+      # stopped (SIGTERM) while starting, don't receive at all
+      self.stop()
+
+    errors = []
+    threads = [
+        threading.Thread(target=self._consume_lane, args=(queue_name, sessions[queue_name], pool, scheduler, errors), name='paper-cup-queue-%s' % queue_name)
+        for queue_name in lanes
+    ]
+    try:
+      for thread in threads:
+        thread.daemon = True
+        thread.start()
+      for thread in threads:
+        thread.join()
+    finally:
+      # stop receiving then let the actions in flight finish before deleting their messages
+      self.stop()
+      self._stop_requested = False
+      for thread in threads:
+        thread.join()
+      try:
+        pool.shutdown()
+      finally:
+        for session in sessions.values():
+          session.close()
+
+    if errors:
+      raise errors[0]
+    return report
+
+  def _lane(self, queue_name):
+    """Copy of the consumer for one of the queues, with the current settings."""
+    lane = copy.copy(self)
+    lane.PC_SQS_QUEUE = queue_name
+    lane.sqs_client = (self.sqs_clients or {}).get(queue_name)
+    return lane
+
+  def _consume_lane(self, queue_name, session, pool, scheduler, errors):
+    """Receive the messages of one queue within it share of the workers."""
+    def on_done(message, failures):
+      scheduler.release(queue_name)
+      session.done(message, failures)
+
+    try:
+      for messages in self.pollers[queue_name].batches(capacity=lambda: scheduler.available(queue_name)):
+        scheduler.acquire(queue_name, len(messages))
+        submitted = session.submit(messages, pool, on_done=on_done)
+        # the messages that can't be decoded are not submitted
+        scheduler.release(queue_name, len(messages) - submitted)
+    except Exception as e:
+      logger.exception('Failed to consume the queue %s.', queue_name)
+      errors.append(e)
+      self.stop()
@@ -0,0 +1,76 @@
+from collections import namedtuple
+
+
+class PublishResult(namedtuple('PublishResult', ['index', 'message_id', 'error'])):
+  """Outcome of one message of a bulk publish, `index` is the position of the message in the bulk."""
+
+  __slots__ = ()
+
+  @property
+  def success(self):
+    """True if the message was published."""
+    return self.error is None
+
+
+class Chunk(object):
+  """Serialized messages that will be published by the same sns call."""
+
+  __slots__ = ('items', 'size')
+
+  def __init__(self, overhead):
+    """Start an empty chunk, `overhead` is the number of bytes used even with no item."""
+    self.items = [] # list of (key, serialized message)
+    self.size = overhead
+
+  @property
+  def payloads(self):
+    """List of the serialized messages."""
+    return [payload for _, payload in self.items]
+
+
+class MessagePacker(object):
+  """Group serialized messages in chunks fitting in one sns request.
+
+    The size of the chunk is counted incrementally when adding a message, so each message
+    is serialized and measured only once. The messages are serialized bytes.
+    A message bigger than `max_bytes` get a chunk for itself, the caller has to check the chunk size.
+  """
+
+  def __init__(self, max_bytes, max_count=None, overhead=0, separator=0):
+    """Set the limits of a chunk and the bytes used to join the messages."""
+    self.max_bytes = max_bytes
+    self.max_count = max_count
+    self.overhead = overhead
+    self.separator = separator
+    self._chunk = Chunk(overhead)
+
+  @classmethod
+  def array(cls, max_bytes, serializer):
+    """Packer of messages published together as an array of the serializer, ex: json [msg,msg,...]."""
+    return cls(max_bytes, overhead=serializer.array_overhead, separator=serializer.array_separator)
+
+  @classmethod
+  def sns_batch(cls, max_bytes, max_count=10):
+    """Packer of messages published as the entries of one sns publish_batch request."""
+    return cls(max_bytes, max_count=max_count)
+
+  def add(self, key, payload):
+    """Add a serialized message, return the chunk that is completed by it if any."""
+    chunk = self._chunk
+    size = len(payload) + (self.separator if chunk.items else 0)
+
+    done = None
+    if chunk.items and (chunk.size + size > self.max_bytes or len(chunk.items) == self.max_count):
+      done = self.flush()
+      chunk = self._chunk
+      size = len(payload)
+
+    chunk.items.append((key, payload))
+    chunk.size += size
+    return done
+
+  def flush(self):
+    """Return the chunk in progress (None if empty) and start a new one."""
+    chunk = self._chunk
+    self._chunk = Chunk(self.overhead)
+    return chunk if chunk.items else None
@@ -1,5 +1,29 @@
 import json
-from .client import SNSClient, SQSClient
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+
+from .acknowledger import Acknowledger
+from .buffered import BufferedPublisher
+from .client import THROTTLING_ERROR_CODES, SNSClient, SQSClient, is_throttling_error
+from .claim_check import ClaimCheck, FileSystemPayloadStore, PayloadStore, S3PayloadStore
+from .codec import CLAIM_CHECK_ATTRIBUTE, CODEC_ATTRIBUTE, MessageCodec, codec_attributes, decode_envelope
+from .dedup import Deduplicator, DedupStore, MemoryDedupStore, SQLiteDedupStore
+from .dispatch import ConsumerType, Dispatcher
+from .failures import FailureHandler
+from .fifo import GROUP_ATTRIBUTE, GroupBlockedError, chunk_deduplication_id, content_id, field_id, is_fifo, message_group
+from .heartbeat import Heartbeat
+from .metrics import PUBLISHED_AT_FIELD, record_receive
+from .packer import MessagePacker, PublishResult
+from .polling import AdaptivePoller
+from .prefetch import Prefetcher
+from .ratelimit import get_rate_limiter
+from .workers import WorkerPool
+
+logger = logging.getLogger(__name__)
 
 
 class PaperCup(object):
@@ -15,6 +39,39 @@ class PaperCup(object):
   PC_SUPPORTED_CONSUME_CLIENT = ['SQS']
 
   PC_SNS_TOPIC = 'topic'
+  PC_SNS_MAX_MESSAGE_BYTES = 256000 # under the sns limit to keep room for the attributes
+
+  # 'array': bulk messages sent as json arrays in sns messages, 'batch': sent by 10 with sns publish_batch
+  PC_BULK_PUBLISH_MODE = 'array'
+  PC_SUPPORTED_BULK_PUBLISH_MODE = ['array', 'batch']
+
+  # buffered publisher: publish() only enqueue the message, a background thread send them by batch
+  PC_PUBLISH_BUFFERED = False
+  PC_BUFFER_MAX_BATCH_SIZE = 100
+  PC_BUFFER_MAX_BATCH_BYTES = 256000
+  PC_BUFFER_LINGER_MS = 50
+  PC_BUFFER_MAX_QUEUE_SIZE = 10000
+  PC_BUFFER_ON_FULL = 'block' # 'block' the caller or 'drop' the message when the queue is full
+
+  # client side limit of the sns messages and bytes published per second (None: no limit), lowered while sns
+  # throttle us, shared by all the publishers of the topic ('topic') or by the instances of the class ('class')
+  PC_PUBLISH_RATE_LIMIT = None
+  PC_PUBLISH_BYTES_RATE_LIMIT = None
+  PC_PUBLISH_RATE_LIMIT_SCOPE = 'topic'
+
+  # serializer of the published messages: 'json', 'orjson' or 'msgpack' (the consumer read any of them)
+  PC_CODEC = 'json'
+  # compression of the sns messages bigger than PC_COMPRESS_ABOVE_BYTES: None, 'zlib' or 'zstd'
+  PC_COMPRESSION = None
+  PC_COMPRESS_ABOVE_BYTES = 1024
+  # expected compression ratio, used to pack the bulk messages before compressing them
+  PC_COMPRESSION_RATIO = 4
+
+  # fifo topic and queue: their name end with .fifo, the messages of a group are consumed in order and the groups in parallel
+  # group id of a published message: the values of these message fields (None: one group by consumer action class)
+  PC_MESSAGE_GROUP_FIELDS = None
+  # deduplication id of a published message: the values of these message fields (None: hash of the message)
+  PC_DEDUPLICATION_FIELDS = None
   PC_SQS_QUEUE = 'queue'
 
   # default values set for test
@@ -23,15 +80,134 @@ class PaperCup(object):
   PC_AWS_LOCAL_ENDPOINT = 'http://192.168.56.1:9010' # we use moto
 
   PC_AWS_REGION = 'ap-northeast-1'
+  # 'aws' to use boto3, 'memory' for topics and queues in the process, without network (local runs and tests)
+  PC_TRANSPORT = 'aws'
+  # size of the http connection pool of the boto3 clients, to raise with the number of workers (None: botocore default)
+  PC_MAX_POOL_CONNECTIONS = None
+
+  # topic arn and queue url are cached by the clients, ttl in seconds (None: never expire)
+  PC_CLIENT_CACHE_TTL = None
+  # resolve the topic arn / queue url when the client is created instead of on first usage
+  PC_CLIENT_CACHE_PREWARM = False
+
+  # consumed messages are deleted by batch (max 10), after each receive or every interval seconds if set
+  PC_ACK_BATCH_SIZE = 10
+  PC_ACK_FLUSH_INTERVAL = None
+
+  # number of workers to run the consumer actions concurrently (None: one by one), 'thread' or 'process' workers
+  PC_CONSUME_WORKERS = None
+  PC_CONSUME_EXECUTOR = 'thread'
+
+  # seconds a received message stay hidden from the other consumers, extended while it is consumed
+  PC_VISIBILITY_TIMEOUT = 30
+  # seconds between the visibility extensions of the messages being consumed (None: a third of PC_VISIBILITY_TIMEOUT)
+  PC_HEARTBEAT_INTERVAL = None
+
+  # failed items of the consumed messages are sent alone to PC_RETRY_QUEUE (None: PC_SQS_QUEUE) up to PC_MAX_RETRIES
+  # times, after PC_RETRY_DELAY seconds doubled at each retry, then to PC_DEAD_LETTER_QUEUE if set or dropped
+  PC_MAX_RETRIES = 3
+  PC_RETRY_QUEUE = None
+  PC_RETRY_DELAY = 0
+  PC_DEAD_LETTER_QUEUE = None
+  # number of received batches to prefetch while the current one is consumed (None: no prefetch)
+  PC_CONSUME_PREFETCH = None
+
+  # run_forever receives: long poll wait time from min to max (20) seconds, doubled after each empty receive,
+  # batch size limited by the queue depth read every PC_POLL_DEPTH_INTERVAL seconds (None: never read)
+  PC_POLL_MIN_WAIT_TIME = 1
+  PC_POLL_MAX_WAIT_TIME = 20
+  PC_POLL_DEPTH_INTERVAL = 60
+
+  # skip the items already consumed: None, 'memory', 'sqlite' or a DedupStore instance. The key of an item is it
+  # PC_IDEMPOTENCY_KEY_FIELD value set by the publisher if any, else the sns message id and the item position
+  PC_DEDUP_STORE = None
+  PC_DEDUP_TTL = 3600 # seconds a consumed item is remembered
+  PC_DEDUP_MAX_SIZE = 100000 # items remembered by the 'memory' store
+  PC_DEDUP_SQLITE_PATH = 'paper_cup_dedup.sqlite3'
+  PC_IDEMPOTENCY_KEY_FIELD = 'idempotency_key'
+
+  # asyncio classes: max number of actions running at the same time and of threads doing the aws calls
+  PC_ASYNC_CONCURRENCY = 100
+  PC_ASYNC_IO_WORKERS = 8
+
+  # paper_cup.metrics.Metrics getting the metrics of the publish and consume paths, ex: PrometheusMetrics()
+  # or StatsDMetrics(), None to measure nothing
+  PC_METRICS = None
+
+  # claim check: the messages above PC_CLAIM_CHECK_THRESHOLD bytes are stored in PC_CLAIM_CHECK_STORE, 's3' (in
+  # PC_CLAIM_CHECK_BUCKET), 'file' (in PC_CLAIM_CHECK_DIRECTORY) or a PayloadStore instance, and only their reference
+  # is published. The consumers load them from PC_CLAIM_CHECK_BUCKET or PC_CLAIM_CHECK_DIRECTORY only, the payloads
+  # up to PC_CLAIM_CHECK_CACHE_ITEM_BYTES are cached, the bigger ones are streamed
+  PC_CLAIM_CHECK_STORE = None
+  PC_CLAIM_CHECK_THRESHOLD = 200000
+  PC_CLAIM_CHECK_BUCKET = None
+  PC_CLAIM_CHECK_DIRECTORY = None
+  PC_CLAIM_CHECK_CACHE_BYTES = 8 * 1024 * 1024
+  PC_CLAIM_CHECK_CACHE_ITEM_BYTES = 1024 * 1024
 
   # set default attribut values
   sns_client = False
   sqs_client = False
+  _claim_check = None
+
+  def _build_sns_client(self):
+    """Build the sns client from the settings, the boto3 client is shared by the instances with the same settings."""
+    prewarm = [self.PC_SNS_TOPIC] if self.PC_CLIENT_CACHE_PREWARM else None
+    sns_client = SNSClient(
+        self.PC_AWS_LOCAL_ENDPOINT, region=self.PC_AWS_REGION, aws_access_key_id=self.PC_AWS_ACCESS_KEY_ID, aws_secret_access_key=self.PC_AWS_SECRET_ACCESS_KEY_ID,
+        cache_ttl=self.PC_CLIENT_CACHE_TTL, prewarm=prewarm, max_pool_connections=self.PC_MAX_POOL_CONNECTIONS, transport=self.PC_TRANSPORT,
+    )
+    return self._with_metrics(sns_client)
+
+  def _build_sqs_client(self):
+    """Build the sqs client from the settings, with the queue object of PC_SQS_QUEUE."""
+    sqs_client = SQSClient(
+        self.PC_AWS_LOCAL_ENDPOINT, region=self.PC_AWS_REGION, aws_access_key_id=self.PC_AWS_ACCESS_KEY_ID, aws_secret_access_key=self.PC_AWS_SECRET_ACCESS_KEY_ID,
+        cache_ttl=self.PC_CLIENT_CACHE_TTL, max_pool_connections=self.PC_MAX_POOL_CONNECTIONS, transport=self.PC_TRANSPORT,
+    )
+    sqs_client.queue = sqs_client.get_queue_by_name(self.PC_SQS_QUEUE)
+    return self._with_metrics(sqs_client)
+
+  def _get_claim_check(self):
+    """Get the claim check of the settings, built once."""
+    if self._claim_check is None:
+      store = self.PC_CLAIM_CHECK_STORE
+      if store and not isinstance(store, PayloadStore):
+        store = self._build_payload_store(store)
+      self._claim_check = ClaimCheck(
+          store, build_store=self._build_payload_store, cache_bytes=self.PC_CLAIM_CHECK_CACHE_BYTES, cache_item_bytes=self.PC_CLAIM_CHECK_CACHE_ITEM_BYTES,
+      )
+    return self._claim_check
+
+  def _build_payload_store(self, scheme):
+    """Build the payload store 's3' or 'file' from the settings, only if it bucket or directory is set."""
+    if scheme == 's3':
+      if not self.PC_CLAIM_CHECK_BUCKET:
+        raise ValueError('No payload store s3, PC_CLAIM_CHECK_BUCKET is not set.')
+      return S3PayloadStore(
+          self.PC_CLAIM_CHECK_BUCKET, self.PC_AWS_LOCAL_ENDPOINT, self.PC_AWS_REGION, aws_access_key_id=self.PC_AWS_ACCESS_KEY_ID,
+          aws_secret_access_key=self.PC_AWS_SECRET_ACCESS_KEY_ID, transport=self.PC_TRANSPORT,
+      )
+    if scheme == 'file':
+      if not self.PC_CLAIM_CHECK_DIRECTORY:
+        raise ValueError('No payload store file, PC_CLAIM_CHECK_DIRECTORY is not set.')
+      return FileSystemPayloadStore(self.PC_CLAIM_CHECK_DIRECTORY)
+    raise ValueError('Unknown payload store %r.' % scheme)
+
+  def _with_metrics(self, client):
+    """Count the retries of the client in PC_METRICS, the retry guard is shared by the clients of the service."""
+    if self.PC_METRICS:
+      client.guard.metrics = self.PC_METRICS
+    return client
 
 
 class PublishPC(PaperCup):
   """Public class for Publisher."""
 
+  buffer = None
+  rate_limiter = None # RateLimiter of the sns messages with PC_PUBLISH_RATE_LIMIT or PC_PUBLISH_BYTES_RATE_LIMIT
+  _codec = None
+
   def __init__(self, *args, **kwargs):
     """"""
     if self.PC_ENABLE:
@@ -39,52 +215,321 @@ class PublishPC(PaperCup):
       assert(client in PaperCup.PC_SUPPORTED_PUBLISH_CLIENT)
 
       if client == 'SNS':
-        self.sns_client = SNSClient(self.PC_AWS_LOCAL_ENDPOINT, region=self.PC_AWS_REGION, aws_access_key_id=self.PC_AWS_ACCESS_KEY_ID, aws_secret_access_key=self.PC_AWS_SECRET_ACCESS_KEY_ID)
+        self.sns_client = kwargs.get('sns_client') or self._build_sns_client()
+        self.rate_limiter = self._build_rate_limiter()
       elif client == 'SQS':
-        self.sqs_client = SQSClient(self.PC_AWS_LOCAL_ENDPOINT, region=self.PC_AWS_REGION, aws_access_key_id=self.PC_AWS_ACCESS_KEY_ID, aws_secret_access_key=self.PC_AWS_SECRET_ACCESS_KEY_ID)
-        self.sqs_client.queue = self.sqs_client.get_queue_by_name(self.PC_SQS_QUEUE)
+        self.sqs_client = kwargs.get('sqs_client') or self._build_sqs_client()
+
+      if self.sns_client and kwargs.get('buffered', self.PC_PUBLISH_BUFFERED):
+        self.buffer = BufferedPublisher(
+            self,
+            max_batch_size=self.PC_BUFFER_MAX_BATCH_SIZE,
+            max_batch_bytes=self.PC_BUFFER_MAX_BATCH_BYTES,
+            linger_ms=self.PC_BUFFER_LINGER_MS,
+            max_queue_size=self.PC_BUFFER_MAX_QUEUE_SIZE,
+            on_full=self.PC_BUFFER_ON_FULL,
+        )
+
+  def publish(self, message, action, callback=None):
+    """Send message to sns.
+
+      When buffered the message is only enqueued and a Future of it sns message id is returned,
+      `callback` is called with the Future once the message is sent.
+    """
+    if self.buffer:
+      return self.buffer.publish(message, action, callback=callback)
 
-  def publish(self, message, action):
-    """Send message to sns."""
     if self.sns_client:
       message = self._add_more_data(message, action)
-      message = json.dumps(message)
-      self.sns_client.sns.publish(message, self.PC_SNS_TOPIC)
+      payload, fifo_ids = self._serialize(message)
+      message, attributes = self._encode(payload, [action])
+      group_id, deduplication_id = fifo_ids or (None, None)
+      with self._rate_limited(1, len(message.encode('utf-8'))), self._measured(1):
+        response = self.sns_client.publish(message, self.PC_SNS_TOPIC, attributes=attributes, group_id=group_id, deduplication_id=deduplication_id)
+      self._count_published(1)
+      return response
 
-  def _add_more_data(self, message, action):
-    """Add necessary data to detemine the consumer and action function."""
+  def flush(self):
+    """Wait until the buffered messages are sent."""
+    if self.buffer:
+      self.buffer.flush()
+
+  def close(self):
+    """Send the buffered messages and stop the buffer."""
+    if self.buffer:
+      self.buffer.close()
+
+  def _build_rate_limiter(self):
+    """Get the rate limiter shared by the publishers of the topic or of the class, None without limit."""
+    if not (self.PC_PUBLISH_RATE_LIMIT or self.PC_PUBLISH_BYTES_RATE_LIMIT):
+      return None
+    assert(self.PC_PUBLISH_RATE_LIMIT_SCOPE in ('topic', 'class'))
+    if self.PC_PUBLISH_RATE_LIMIT_SCOPE == 'topic':
+      key = ('topic', self.PC_AWS_LOCAL_ENDPOINT, self.PC_AWS_REGION, self.PC_SNS_TOPIC)
+    else:
+      key = ('class', self.__class__)
+    return get_rate_limiter(key, self.PC_PUBLISH_RATE_LIMIT, self.PC_PUBLISH_BYTES_RATE_LIMIT)
+
+  @contextmanager
+  def _rate_limited(self, messages, size):
+    """Wait for the rate limiter before the sns call and tell it each time sns throttled it, the retries of the call included."""
+    if not self.rate_limiter:
+      yield
+      return
+
+    self.rate_limiter.acquire(messages, size)
+    guard = getattr(self.sns_client, 'guard', None)
+    try:
+      if guard:
+        with guard.listen(self.rate_limiter.throttled):
+          yield
+      else:
+        yield
+    except Exception as e:
+      # without guard only the error of the last attempt is seen
+      if not guard and is_throttling_error(e):
+        self.rate_limiter.throttled()
+      raise
+    else:
+      self.rate_limiter.succeeded()
+
+  @contextmanager
+  def _measured(self, messages):
+    """Time the sns call of the messages and count it failure in PC_METRICS."""
+    metrics = self.PC_METRICS
+    if not metrics:
+      yield
+      return
+
+    tags = {'topic': self.PC_SNS_TOPIC}
+    started_at = time.time()
+    try:
+      yield
+    except Exception:
+      metrics.increment('publish_errors', messages, tags)
+      raise
+    finally:
+      metrics.increment('publish_calls', tags=tags)
+      metrics.observe('publish_seconds', time.time() - started_at, tags)
+
+  def _count_published(self, messages, errors=0):
+    """Count the messages sns accepted and the ones it refused in PC_METRICS."""
+    if self.PC_METRICS:
+      tags = {'topic': self.PC_SNS_TOPIC}
+      if messages:
+        self.PC_METRICS.increment('published_messages', messages, tags)
+      if errors:
+        self.PC_METRICS.increment('publish_errors', errors, tags)
+
+  def _get_codec(self):
+    """Get the codec of the published messages, built once."""
+    if self._codec is None:
+      self._codec = MessageCodec(
+          self.PC_CODEC, compression=self.PC_COMPRESSION,
+          compress_above=self.PC_COMPRESS_ABOVE_BYTES, compression_ratio=self.PC_COMPRESSION_RATIO,
+      )
+    return self._codec
+
+  def _serialize(self, message):
+    """Serialize the message, return the bytes and for a fifo topic the (group id, deduplication id) of it, else None."""
+    if self.PC_METRICS:
+      started_at = time.time()
+      payload = self._get_codec().dumps(message)
+      self.PC_METRICS.observe('serialize_seconds', time.time() - started_at)
+    else:
+      payload = self._get_codec().dumps(message)
+    if not is_fifo(self.PC_SNS_TOPIC):
+      return payload, None
+
+    group_id = field_id(message, self.PC_MESSAGE_GROUP_FIELDS or ['consumer_action_class'])
+    if self.PC_DEDUPLICATION_FIELDS:
+      deduplication_id = field_id(message, self.PC_DEDUPLICATION_FIELDS)
+    else:
+      # the same message published again is a duplicate, whenever it was published, the keys sorted as
+      # the order of a dict is arbitrary on python 2
+      content = dict((key, value) for key, value in message.items() if key != PUBLISHED_AT_FIELD)
+      deduplication_id = content_id(json.dumps(content, sort_keys=True, separators=(',', ':'), default=repr).encode('utf-8'))
+    return payload, (group_id, deduplication_id)
+
+  def _encode(self, data, actions):
+    """Get the sns message and it attributes from the serialized bytes and the actions of the messages in it.
+
+      With PC_CLAIM_CHECK_STORE a message above PC_CLAIM_CHECK_THRESHOLD bytes is offloaded, the sns message is it reference.
+    """
+    codec = self._get_codec()
+    data, codec_name = codec.compress(data)
+    message, codec_name = codec.text(data, codec_name)
+    attributes = self._routing_attributes(actions)
+    if self.PC_CLAIM_CHECK_STORE and len(message.encode('utf-8')) > self.PC_CLAIM_CHECK_THRESHOLD:
+      message, claim_attributes = self._get_claim_check().offload(data, codec_name)
+      attributes.update(claim_attributes)
+    else:
+      attributes.update(codec_attributes(codec_name))
+    return message, attributes
+
+  def _routing_attributes(self, actions):
+    """Sns message attributes used by the subscription filter policies, an array of the actions for a bulk message."""
+    actions = sorted(set(actions))
+    if len(actions) == 1:
+      action = {'DataType': 'String', 'StringValue': actions[0]}
+    else:
+      action = {'DataType': 'String.Array', 'StringValue': json.dumps(actions)}
+    return {
+        'sender': {'DataType': 'String', 'StringValue': self.PC_SERVICE_SENDER},
+        'consumer_action_class': {'DataType': 'String', 'StringValue': self._consumer_action_class()},
+        'action': action,
+    }
+
+  def _consumer_action_class(self):
+    """Name of the consumer action class of our messages."""
     # we expect the publish class name as PublishUser and it's cosumer will be ConsumeUser
-    class_name = self.__class__.__name__
-    message['consumer_action_class'] = class_name.replace('Publish', 'Consume')
+    return self.__class__.__name__.replace('Publish', 'Consume')
+
+  def _add_more_data(self, message, action):
+    """Add necessary data to detemine the consumer and action function, and the publishing time for the consume lag."""
+    message['consumer_action_class'] = self._consumer_action_class()
     message['action'] = action
     message['sender'] = self.PC_SERVICE_SENDER
+    message[PUBLISHED_AT_FIELD] = time.time()
     return message
 
-  def bulk_publish(self, list_message, list_action):
-    """Send message by bulk to sns.
-      Please limit the list to 50 messages (Need to be done in the call as it depends on the message).
+  def bulk_publish(self, list_message, list_action, mode=None):
+    """Send message by bulk to sns and return a PublishResult by message.
+
+      In 'array' mode the messages are packed in arrays of up to PC_SNS_MAX_MESSAGE_BYTES, each array
+      is one sns message. In 'batch' mode each message is one sns message, sent by 10 with publish_batch.
+      With compression the arrays are packed with the expected PC_COMPRESSION_RATIO and split again if
+      they are still too big once compressed.
+      On a fifo topic an array holds the messages of only one group.
     """
-    message = ''
-    msg_list = []
     if self.sns_client:
-      for i, one_message in enumerate(list_message):
-        full_message = self._add_more_data(one_message, list_action[i])
-        temp_message = json.dumps(full_message)
-        # check max size of the message to publish under the limit
-        if (len(message) + len(temp_message)) > 256000:
-          self.sns_client.publish(message, self.PC_SNS_TOPIC)
-          msg_list = [full_message]
-        else:
-          msg_list.append(one_message)
-        message = json.dumps(msg_list)
+      mode = mode or self.PC_BULK_PUBLISH_MODE
+      assert(mode in PaperCup.PC_SUPPORTED_BULK_PUBLISH_MODE)
+
+      serialized_messages = (
+          (i,) + self._serialize(self._add_more_data(message, action)) + (action,)
+          for i, (message, action) in enumerate(zip(list_message, list_action))
+      )
+      return self._publish_serialized(serialized_messages, mode)
+    return []
+
+  def _publish_serialized(self, serialized_messages, mode):
+    """Pack the (key, serialized message, fifo ids, action) and publish them chunk by chunk, return a PublishResult by message."""
+    codec = self._get_codec()
+    max_bytes = codec.max_raw_bytes(self.PC_SNS_MAX_MESSAGE_BYTES)
+    if mode == 'batch':
+      new_packer = partial(MessagePacker.sns_batch, max_bytes)
+    else:
+      new_packer = partial(MessagePacker.array, max_bytes, codec.serializer)
+
+    results = []
+    actions = {}
+    fifo_ids = {}
+    packers = {} # by group for the fifo arrays
+    for key, payload, ids, action in serialized_messages:
+      actions[key] = action
+      fifo_ids[key] = ids
+      group_id = ids[0] if ids and mode != 'batch' else None
+      if group_id not in packers:
+        packers[group_id] = new_packer()
+      chunk = packers[group_id].add(key, payload)
+      if chunk:
+        results.extend(self._publish_chunk(chunk.items, mode, actions, fifo_ids))
+
+    for group_id in packers:
+      chunk = packers[group_id].flush()
+      if chunk:
+        results.extend(self._publish_chunk(chunk.items, mode, actions, fifo_ids))
+    if len(packers) > 1:
+      results.sort(key=lambda result: result.index)
+    return results
+
+  def _publish_chunk(self, items, mode, actions, fifo_ids):
+    """Publish the (key, serialized message) of one chunk, return a PublishResult by message.
+
+      A chunk too big once encoded is split in two, a single message too big fail.
+    """
+    keys = [key for key, _ in items]
+    if mode == 'batch':
+      encoded = [self._encode(payload, [actions[key]]) for key, payload in items]
+    else:
+      encoded = [self._encode(self._get_codec().join([payload for _, payload in items]), [actions[key] for key in keys])]
+
+    size = sum(len(message.encode('utf-8')) for message, _ in encoded)
+    if size > self.PC_SNS_MAX_MESSAGE_BYTES:
+      if len(items) > 1:
+        half = len(items) // 2
+        return self._publish_chunk(items[:half], mode, actions, fifo_ids) + self._publish_chunk(items[half:], mode, actions, fifo_ids)
+      error = ValueError('Message of %d bytes is over the limit of %d bytes.' % (size, self.PC_SNS_MAX_MESSAGE_BYTES))
+      return [PublishResult(key, None, error) for key in keys]
+
+    try:
+      with self._rate_limited(len(encoded), size), self._measured(len(keys)):
+        response = self._send_chunk(keys, encoded, mode, fifo_ids)
+    except Exception as e:
+      logger.warning('Failed to publish %d messages: %r', len(keys), e)
+      return [PublishResult(key, None, e) for key in keys]
+
+    if mode != 'batch':
+      self._count_published(len(keys))
+      return [PublishResult(key, response['MessageId'], None) for key in keys]
 
-      if message:
-        self.sns_client.publish(message, self.PC_SNS_TOPIC)
+    results = [None] * len(keys)
+    for entry in response.get('Successful', []):
+      position = int(entry['Id'])
+      results[position] = PublishResult(keys[position], entry['MessageId'], None)
+    throttled = False
+    for entry in response.get('Failed', []):
+      position = int(entry['Id'])
+      error = RuntimeError('%s: %s' % (entry.get('Code'), entry.get('Message')))
+      logger.warning('Failed to publish message %s: %s', keys[position], error)
+      results[position] = PublishResult(keys[position], None, error)
+      throttled = throttled or entry.get('Code') in THROTTLING_ERROR_CODES
+    if throttled and self.rate_limiter:
+      self.rate_limiter.throttled()
+    self._count_published(len(response.get('Successful', [])), len(response.get('Failed', [])))
+    return results
 
+  def _send_chunk(self, keys, encoded, mode, fifo_ids):
+    """Send the encoded (message, attributes) of one chunk, return the sns response."""
+    if mode == 'batch':
+      entries = []
+      for i, (message, attributes) in enumerate(encoded):
+        entry = {'Id': str(i), 'Message': message}
+        if attributes:
+          entry['MessageAttributes'] = attributes
+        if fifo_ids[keys[i]]:
+          entry['MessageGroupId'], entry['MessageDeduplicationId'] = fifo_ids[keys[i]]
+        entries.append(entry)
+      return self.sns_client.publish_batch(entries, self.PC_SNS_TOPIC)
 
-class ConsumePC(PaperCup):
+    message, attributes = encoded[0]
+    group_id = deduplication_id = None
+    if fifo_ids[keys[0]]:
+      group_id = fifo_ids[keys[0]][0]
+      deduplication_id = chunk_deduplication_id([fifo_ids[key][1] for key in keys])
+    return self.sns_client.publish(message, self.PC_SNS_TOPIC, attributes=attributes, group_id=group_id, deduplication_id=deduplication_id)
+
+
+# python 2 and 3 compatible way to set the metaclass registering the consumer classes
+_ConsumeBase = ConsumerType('_ConsumeBase', (PaperCup,), {'_pc_base_class': True})
+
+
+class ConsumePC(_ConsumeBase):
   """Public class for Consume."""
 
+  # set on the classes to subclass that are not consumer action classes
+  _pc_base_class = True
+  _dispatcher = None
+  _stop_requested = False # stop called, maybe before run_forever had a poller to stop
+  poller = None
+  deduplicator = None # Deduplicator with the hit and miss counters, once consumed with PC_DEDUP_STORE
+
+  # sqs message attributes to receive, the codec of the messages sent with raw message delivery
+  RECEIVE_ATTRIBUTE_NAMES = [CODEC_ATTRIBUTE, CLAIM_CHECK_ATTRIBUTE]
+  # sns limit of the number of combinations of values of a filter policy
+  FILTER_POLICY_MAX_COMBINATIONS = 150
+
   def __init__(self, *args, **kwargs):
     """"""
     if self.PC_ENABLE:
@@ -92,53 +537,339 @@ class ConsumePC(PaperCup):
       assert(client in PaperCup.PC_SUPPORTED_CONSUME_CLIENT)
 
       if client == 'SQS':
-        self.sqs_client = SQSClient(self.PC_AWS_LOCAL_ENDPOINT, region=self.PC_AWS_REGION, aws_access_key_id=self.PC_AWS_ACCESS_KEY_ID, aws_secret_access_key=self.PC_AWS_SECRET_ACCESS_KEY_ID)
-        self.sqs_client.queue = self.sqs_client.get_queue_by_name(self.PC_SQS_QUEUE)
+        # the consumer action classes share the clients of the consumer
+        self.sqs_client = kwargs.get('sqs_client') or self._build_sqs_client()
+
+  def consume(self, workers=None, executor=None, prefetch=None):
+    """Read the message in queue and use the class that will handle the action, return a ConsumeReport.
 
-  def consume(self):
-    """Read the message in queue and use the class that will handle the action."""
+      A message is deleted once all its actions are done, until then a heartbeat extend it visibility
+      timeout. The items of a message that failed are requeued alone (see PC_MAX_RETRIES) and the
+      consume continue, a message that can't be decoded or requeued come back after PC_VISIBILITY_TIMEOUT.
+      With `workers` the actions are run concurrently by a pool of 'thread' or 'process' `executor`.
+      With `prefetch` the next batches are received in background while the current one is consumed.
+      From a fifo queue the messages of a group are consumed in order and the groups in parallel, after a
+      failure the next messages of the group are left in the queue with it.
+    """
+    if self.sqs_client.queue:
+      prefetch = prefetch or self.PC_CONSUME_PREFETCH
+
+      def receive(pool):
+        if prefetch:
+          # without workers the actions of the batches are done once the next one is asked
+          return Prefetcher(
+              self.sqs_client, self.PC_SQS_QUEUE, depth=prefetch, visibility_timeout=self.PC_VISIBILITY_TIMEOUT, attribute_names=self.RECEIVE_ATTRIBUTE_NAMES,
+              system_attribute_names=self._receive_kwargs().get('AttributeNames'), metrics=self.PC_METRICS, drain=pool.join if pool else lambda: None,
+          )
+        return self._receive_batches(pool)
+
+      return self._consume_batches(receive, workers, executor)
+
+  def run_forever(self, workers=None, executor=None):
+    """Consume the messages until `stop` is called, return a ConsumeReport.
+
+      Unlike `consume` it doesn't stop when the queue is empty, the receive calls are adapted to the
+      traffic (see PC_POLL_*), the counters of the receives are in `poller.stats`.
+    """
     if self.sqs_client.queue:
-      # get all the consumer classes that will handle actions
-      action_classes = {cls.__name__: cls() for cls in self.__class__.__subclasses__() if 'Consume' in cls.__name__}
-      messages = self.sqs_client.queue.receive_messages(WaitTimeSeconds=20, MaxNumberOfMessages=10, VisibilityTimeout=30)
-
-      while messages:
-        for message in messages:
-          body = json.loads(message.body)
-          msg = json.loads(body['Message'])
-
-          # remove the message before consuming to prevent queue stuck if consume loop take time
-          message.delete()
-          
-          if isinstance(msg, list):
-            raised_exception = []
-            for one_msg in msg:
-              try:
-                self._consume_msg(one_msg, action_classes)
-              except Exception as e:
-                raised_exception.append(e)
-            if raised_exception:
-              # raise the first one
-              raise raised_exception[0]
-          else:
-            self._consume_msg(msg, action_classes)
-
-        messages = self.sqs_client.queue.receive_messages(MaxNumberOfMessages=10, VisibilityTimeout=30)
-
-  def _consume_msg(self, msg, action_classes):
-    """Common call to consume the queue."""
-    action = msg.get('action')
-    sender = msg.get('sender')
-
-    # check that the consumer listen from the sender and do the action
-    if sender in self.PC_SERVICE_LISTEN:
-      consumer_action_class = msg.get('consumer_action_class')
-      action_class = action_classes.get(consumer_action_class)
-      # only handle the action with consumers
-      if action_class:
-        action_class._do_action(msg, action)
-
-  def _do_action(self, message, action):
-    """Call the action of the consumer class."""
-    method = getattr(self, action)
-    method(message)
+      self.poller = AdaptivePoller(
+          self.sqs_client, self._receive_kwargs(), min_wait_time=self.PC_POLL_MIN_WAIT_TIME,
+          max_wait_time=self.PC_POLL_MAX_WAIT_TIME, depth_interval=self.PC_POLL_DEPTH_INTERVAL,
+          metrics=self.PC_METRICS, queue_name=self.PC_SQS_QUEUE,
+      )
+      if self._stop_requested:
+        # stopped (SIGTERM) while starting, don't receive at all
+        self.poller.stop()
+      try:
+        return self._consume_batches(lambda pool: self.poller.batches(capacity=pool.available if pool else None), workers, executor)
+      finally:
+        self._stop_requested = False
+
+  def stop(self):
+    """Stop `run_forever` once the receive in progress is done, called before it started it stop it at once."""
+    self._stop_requested = True
+    if self.poller:
+      self.poller.stop()
+
+  def _consume_batches(self, receive, workers, executor):
+    """Consume the batches of messages given by `receive(pool)`, see `consume`."""
+    workers = workers or self.PC_CONSUME_WORKERS
+    executor = executor or self.PC_CONSUME_EXECUTOR
+
+    # build the routing table before receiving
+    self._get_dispatcher()
+    session = _ConsumeSession(self)
+    pool = WorkerPool(self, workers, executor=executor, on_done=session.done) if workers else None
+    batches = receive(pool)
+
+    try:
+      for messages in batches:
+        if pool:
+          session.submit(messages, pool)
+        else:
+          session.consume(messages)
+    finally:
+      # stop receiving then let the actions in flight finish before deleting their messages
+      try:
+        batches.close()
+        if pool:
+          pool.shutdown()
+      finally:
+        session.close()
+
+    return session.report
+
+  def filter_policy(self):
+    """Sns subscription filter policy accepting only the messages we consume.
+
+      The messages of the senders of PC_SERVICE_LISTEN to our consumer action classes. Sns limit
+      a policy to 150 combinations of values, above it only the sender is filtered.
+      The messages published without the routing attributes (older publishers) don't match it.
+    """
+    policy = {'sender': sorted(self.PC_SERVICE_LISTEN)}
+    classes = sorted(self._get_dispatcher().routes)
+    if classes and len(classes) * len(policy['sender']) <= self.FILTER_POLICY_MAX_COMBINATIONS:
+      policy['consumer_action_class'] = classes
+    elif classes:
+      logger.warning('Too many consumer action classes (%d) for the filter policy, only the sender is filtered.', len(classes))
+    return policy
+
+  def subscribe(self, sns_client, topic_name, raw=False):
+    """Subscribe our queue to the topic with the filter policy of our consumers."""
+    queue_arn = self.sqs_client.get_queue_arn(self.PC_SQS_QUEUE)
+    return sns_client.add_sqs_subscription(topic_name, queue_arn, raw=raw, filter_policy=self.filter_policy())
+
+  def _build_failure_handler(self, report=None):
+    """Build the handler of the failed items from the settings."""
+    return FailureHandler(
+        self.sqs_client, self.PC_RETRY_QUEUE or self.PC_SQS_QUEUE, max_retries=self.PC_MAX_RETRIES,
+        dead_letter_queue=self.PC_DEAD_LETTER_QUEUE, retry_delay=self.PC_RETRY_DELAY, report=report, ordered=is_fifo(self.PC_SQS_QUEUE),
+    )
+
+  def _receive_batches(self, pool=None):
+    """Yield the received messages until the queue is empty, only the first receive wait for messages.
+
+      With a `pool` the queue is received once more after the actions in flight, their failed items are requeued.
+    """
+    messages = self._receive(WaitTimeSeconds=20)
+    while messages:
+      yield messages
+      messages = self._receive()
+      if not messages and pool and pool.in_flight:
+        pool.join()
+        messages = self._receive()
+
+  def _receive(self, **kwargs):
+    """Receive a batch of messages, counted in PC_METRICS."""
+    kwargs.update(self._receive_kwargs())
+    messages = self.sqs_client.queue.receive_messages(**kwargs)
+    if self.PC_METRICS:
+      record_receive(self.PC_METRICS, self.PC_SQS_QUEUE, len(messages))
+    return messages
+
+  def _receive_kwargs(self):
+    """Parameters of the receive calls, with the attributes of the raw delivered messages and the group of the fifo messages."""
+    kwargs = dict(MaxNumberOfMessages=10, VisibilityTimeout=self.PC_VISIBILITY_TIMEOUT, MessageAttributeNames=self.RECEIVE_ATTRIBUTE_NAMES)
+    if is_fifo(self.PC_SQS_QUEUE):
+      kwargs['AttributeNames'] = [GROUP_ATTRIBUTE]
+    return kwargs
+
+  def _get_dispatcher(self):
+    """Get the routing table of the messages to the consumer actions, built once."""
+    if self._dispatcher is None or self._dispatcher.stale:
+      self._dispatcher = Dispatcher(self)
+    return self._dispatcher
+
+  def _get_deduplicator(self):
+    """Get the deduplicator of the consumed items from PC_DEDUP_STORE, built once, None without deduplication."""
+    if self.deduplicator is None and self.PC_DEDUP_STORE:
+      store = self.PC_DEDUP_STORE
+      if store == 'memory':
+        store = MemoryDedupStore(max_size=self.PC_DEDUP_MAX_SIZE, ttl=self.PC_DEDUP_TTL)
+      elif store == 'sqlite':
+        store = SQLiteDedupStore(self.PC_DEDUP_SQLITE_PATH, ttl=self.PC_DEDUP_TTL)
+      assert(isinstance(store, DedupStore))
+      self.deduplicator = Deduplicator(store, key_field=self.PC_IDEMPOTENCY_KEY_FIELD)
+    return self.deduplicator
+
+  def _decode_message(self, message):
+    """Get the list of messages sent in the sqs message and the sns message id, a bulk message contains several of them.
+
+      The body is the sns envelope of the message or, with raw message delivery, the message itself.
+      An offloaded message is loaded from it payload store.
+    """
+    msg, sns_message_id = decode_envelope(message.body, message.message_attributes, claim_check=self._get_claim_check())
+    return (msg if isinstance(msg, list) else [msg]), sns_message_id
+
+  def _decode_items(self, message, failure_handler):
+    """Decode the sqs message, (None, None) if it can't be decoded, counted as one failed item."""
+    try:
+      return self._decode_message(message)
+    except Exception as e:
+      failure_handler.report.add_items(1)
+      failure_handler.handle(message, [(None, e)])
+      return None, None
+
+  def _consume_msg(self, msg):
+    """Common call to consume the queue, only handle the messages of our consumers from the senders we listen."""
+    self._get_dispatcher().dispatch(msg)
+
+
+class _ConsumeSession(object):
+  """Messages received from the queue of a consumer until they are deleted.
+
+    A heartbeat extend the visibility of the messages being consumed, a message is deleted once
+    all its actions are done and the items of it that failed are requeued alone.
+    From a fifo queue the messages are `ordered` by group, see `ConsumePC.consume`.
+  """
+
+  def __init__(self, consumer, report=None):
+    """Start the deletion and the heartbeat of the messages of the consumer queue."""
+    self.consumer = consumer
+    self.acknowledger = Acknowledger(
+        consumer.sqs_client, consumer.PC_SQS_QUEUE, batch_size=consumer.PC_ACK_BATCH_SIZE, flush_interval=consumer.PC_ACK_FLUSH_INTERVAL,
+    )
+    self.heartbeat = Heartbeat(
+        consumer.sqs_client, consumer.PC_SQS_QUEUE, visibility_timeout=consumer.PC_VISIBILITY_TIMEOUT, interval=consumer.PC_HEARTBEAT_INTERVAL,
+    )
+    self.failure_handler = consumer._build_failure_handler(report)
+    self.report = self.failure_handler.report
+    self.ordered = is_fifo(consumer.PC_SQS_QUEUE)
+    self.deduplicator = consumer._get_deduplicator()
+    self._keys = {} # sqs message id: (msg, key) of the items to remember once consumed
+    self._lock = threading.Lock()
+
+  def received(self, messages):
+    """Track the received messages."""
+    self.heartbeat.add(messages)
+    self.report.add_received(len(messages))
+
+  def decode(self, message):
+    """Get the items of the message to consume, without the ones already consumed, None if it can't be decoded."""
+    msgs, sns_message_id = self.consumer._decode_items(message, self.failure_handler)
+    if msgs is not None and self.deduplicator:
+      keyed_msgs = []
+      for i, msg in enumerate(msgs):
+        key = self.deduplicator.key(msg, i, sns_message_id or message.message_id)
+        if self.deduplicator.claim(key):
+          keyed_msgs.append((msg, key))
+      with self._lock:
+        self._keys[message.message_id] = keyed_msgs
+      msgs = [msg for msg, _ in keyed_msgs]
+
+    if msgs is not None:
+      self.report.add_items(len(msgs))
+    return msgs
+
+  def submit(self, messages, pool, on_done=None):
+    """Run the actions of the messages on the worker pool, return the number of messages submitted.
+
+      Without PC_ACK_FLUSH_INTERVAL the deletions are flushed once all the messages of the batch are done.
+    """
+    self.received(messages)
+    remaining = None
+    if not self.consumer.PC_ACK_FLUSH_INTERVAL:
+      # messages of the batch not done yet, plus one until they are all submitted
+      remaining = [1]
+      on_done = partial(self._done_in_batch, on_done or pool.on_done, remaining)
+    submitted = 0
+    groups = OrderedDict() # group id: (message, msgs) of the group to run in order
+    blocked = set() # groups of the messages that can't be decoded
+    for message in messages:
+      group = message_group(message) if self.ordered else None
+      msgs = self.decode(message)
+      if msgs is None:
+        self.heartbeat.remove(message)
+        if self.ordered:
+          blocked.add(group)
+      elif group in blocked:
+        self.done(message, self.blocked_failures(msgs, group))
+      elif self.ordered:
+        groups.setdefault(group, []).append((message, msgs))
+      else:
+        self._batch_progress(remaining, 1)
+        pool.submit(message, msgs, on_done=on_done)
+        submitted += 1
+
+    for group_messages in groups.values():
+      self._batch_progress(remaining, len(group_messages))
+      pool.submit_ordered(group_messages, on_done=on_done)
+      submitted += len(group_messages)
+    self._batch_progress(remaining, -1)
+    return submitted
+
+  def _done_in_batch(self, on_done, remaining, message, failures):
+    """A message of a submitted batch is done, see `submit`."""
+    try:
+      on_done(message, failures)
+    finally:
+      self._batch_progress(remaining, -1)
+
+  def _batch_progress(self, remaining, count):
+    """Add `count` to the messages of the batch not done, flush the deletions once there is none left."""
+    if remaining is None:
+      return
+    with self._lock:
+      remaining[0] += count
+      last = not remaining[0]
+    if last:
+      self.acknowledger.flush()
+
+  def consume(self, messages):
+    """Run the actions of the messages one by one."""
+    self.received(messages)
+    blocked = set() # groups with a failed message
+    for message in messages:
+      group = message_group(message) if self.ordered else None
+      msgs = self.decode(message)
+      failures = []
+      for one_msg in msgs or []:
+        if group in blocked:
+          failures.extend(self.blocked_failures([one_msg], group))
+          continue
+        try:
+          self.consumer._consume_msg(one_msg)
+        except Exception as e:
+          failures.append((one_msg, e))
+          if self.ordered:
+            blocked.add(group)
+
+      if msgs is None:
+        self.heartbeat.remove(message)
+        if self.ordered:
+          blocked.add(group)
+      else:
+        self.done(message, failures)
+
+    if not self.consumer.PC_ACK_FLUSH_INTERVAL:
+      self.acknowledger.flush()
+
+  def done(self, message, failures):
+    """All the actions of the message are done, delete it once it failed items are requeued."""
+    self.heartbeat.remove(message)
+    if self.deduplicator:
+      with self._lock:
+        keyed_msgs = self._keys.pop(message.message_id, [])
+      failed_msgs = [msg for msg, _ in failures]
+      for msg, key in keyed_msgs:
+        self.deduplicator.release(key, msg not in failed_msgs)
+    if not failures or self.failure_handler.handle(message, failures):
+      self.acknowledger.ack(message)
+
+  def close(self):
+    """Delete the messages consumed, the ones still in progress come back after their visibility timeout."""
+    try:
+      self.heartbeat.close()
+    finally:
+      self.acknowledger.close()
+    # the items not done are claimed until now
+    for keyed_msgs in self._keys.values():
+      for _, key in keyed_msgs:
+        self.deduplicator.release(key, False)
+    if self.report.failed:
+      logger.warning('Consumed from %s with failures: %r', self.consumer.PC_SQS_QUEUE, self.report)
+
+  def blocked_failures(self, msgs, group):
+    """Failures of the msgs not consumed after a failure in their group."""
+    error = GroupBlockedError('Not consumed after the failure of a previous message of group %s.' % group)
+    return [(msg, error) for msg in msgs]
@@ -0,0 +1,145 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from .metrics import record_receive
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 10 # sqs limit
+MAX_WAIT_TIME = 20 # sqs limit
+
+
+class PollStats(object):
+  """Counters of the receive calls, the empty receive ratio is the cost of waiting for messages."""
+
+  def __init__(self, window=100):
+    """Start the counters, the ratio is computed on the last `window` receives."""
+    self.receives = 0
+    self.empty_receives = 0
+    self.messages = 0
+    self.queue_depth = None # last ApproximateNumberOfMessages read
+    self._recent = deque(maxlen=window)
+    self._lock = threading.Lock()
+
+  def add(self, count):
+    """Count a receive call that got `count` messages."""
+    with self._lock:
+      self.receives += 1
+      self.messages += count
+      if not count:
+        self.empty_receives += 1
+      self._recent.append(not count)
+
+  @property
+  def empty_receive_ratio(self):
+    """Part of the last receives that got no message, 0 to 1."""
+    with self._lock:
+      return float(sum(self._recent)) / len(self._recent) if self._recent else 0.0
+
+  def as_dict(self):
+    """Summary of the counters, to log or send."""
+    return {
+        'receives': self.receives,
+        'empty_receives': self.empty_receives,
+        'messages': self.messages,
+        'queue_depth': self.queue_depth,
+        'empty_receive_ratio': self.empty_receive_ratio,
+    }
+
+
+class AdaptivePoller(object):
+  """Receive the messages until stopped, adapting the receive calls to the traffic.
+
+    The wait time of the long polls is `min_wait_time` while messages are received and doubles
+    after each empty receive up to `max_wait_time`, so an idle queue cost few calls. When the
+    queue depth, read every `depth_interval` seconds, shows a backlog of a full batch the receives
+    don't wait at all. The batch size is limited by the free `capacity` of the consumer so the
+    messages are not kept invisible while waiting for a worker.
+    With `until_empty` it stops at the first empty receive, like `ConsumePC.consume`, and a receive
+    that still fail once retried by the client is raised, with `drain` (a function waiting for the
+    actions in flight, they requeue their failed items) it receives once more after calling it.
+    Without `until_empty` the error is logged and the receives go on.
+    With `metrics` (see paper_cup.metrics) the receives are counted with the tag of `queue_name`.
+  """
+
+  def __init__(self, sqs_client, receive_kwargs=None, min_wait_time=1, max_wait_time=MAX_WAIT_TIME, depth_interval=60, stats=None, until_empty=False, metrics=None, queue_name=None, drain=None):
+    """Set the limits of the receive calls, `receive_kwargs` are the other parameters of the calls."""
+    self.sqs_client = sqs_client
+    self.receive_kwargs = dict(receive_kwargs or {})
+    self.min_wait_time = max(0, min(min_wait_time, MAX_WAIT_TIME))
+    self.max_wait_time = max(self.min_wait_time, min(max_wait_time, MAX_WAIT_TIME))
+    self.depth_interval = depth_interval
+    self.stats = stats or PollStats()
+    self.until_empty = until_empty
+    self.drain = drain
+    self.metrics = metrics
+    self.queue_name = queue_name
+
+    self.wait_time = self.max_wait_time
+    self._depth_read_at = None
+    self._stopped = threading.Event()
+
+  def stop(self):
+    """Stop after the receive in progress, that can wait up to max_wait_time."""
+    self._stopped.set()
+
+  def batches(self, capacity=None):
+    """Yield the received batches until stopped, `capacity` is a function giving the number of messages the consumer can take."""
+    drained = False
+    while not self._stopped.is_set():
+      batch_size = min(MAX_BATCH_SIZE, capacity() if capacity else MAX_BATCH_SIZE)
+      if batch_size <= 0:
+        # wait for the consumer
+        self._stopped.wait(0.05)
+        continue
+
+      kwargs = dict(self.receive_kwargs, MaxNumberOfMessages=batch_size, WaitTimeSeconds=self._wait_time(batch_size))
+      try:
+        messages = self.sqs_client.receive_messages(self.sqs_client.queue, **kwargs)
+      except Exception:
+        if self.until_empty:
+          # not a transient error, the client retried them
+          raise
+        logger.exception('Failed to receive sqs messages.')
+        self._stopped.wait(self.min_wait_time or 1)
+        continue
+
+      self.stats.add(len(messages))
+      if self.metrics:
+        record_receive(self.metrics, self.queue_name, len(messages))
+      if messages:
+        self.wait_time = self.min_wait_time
+        drained = False
+        yield messages
+      elif self.until_empty:
+        if drained or not self.drain:
+          break
+        self.drain()
+        drained = True
+      else:
+        self.wait_time = min(max(self.wait_time * 2, 1), self.max_wait_time)
+
+  def _wait_time(self, batch_size):
+    """Seconds the next receive wait for messages."""
+    depth = self._queue_depth()
+    if depth is not None and depth >= batch_size and self.wait_time == self.min_wait_time:
+      # backlog, the batch will be full without waiting
+      return 0
+    return self.wait_time
+
+  def _queue_depth(self):
+    """Approximate number of messages in the queue, read again every depth_interval seconds."""
+    if not self.depth_interval:
+      return None
+    now = time.time()
+    if self._depth_read_at is None or now - self._depth_read_at >= self.depth_interval:
+      self._depth_read_at = now
+      try:
+        queue = self.sqs_client.queue
+        queue.reload()
+        self.stats.queue_depth = int(queue.attributes['ApproximateNumberOfMessages'])
+      except Exception:
+        logger.exception('Failed to read the queue depth.')
+    return self.stats.queue_depth
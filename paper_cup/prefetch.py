@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+
+try:
+  from queue import Empty, Full, Queue
+except ImportError: # python 2
+  from Queue import Empty, Full, Queue
+
+from .heartbeat import change_visibility
+from .metrics import record_receive
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch(object):
+  """Messages of one receive call and when their visibility timeout started."""
+
+  def __init__(self, messages):
+    self.messages = messages
+    self.visible_at = time.time()
+
+
+class Prefetcher(object):
+  """Receive the next batches of messages in background while the current one is consumed.
+
+    Up to `depth` received batches are kept in memory. The visibility of the batches
+    waiting in the buffer for more than `extend_after` seconds is extended so they
+    don't come back in the queue before being consumed. Like the consume loop, it stops
+    at the first empty receive, with `drain` (a function waiting for the actions of the
+    batches consumed, they requeue their failed items) it receives once more after calling it.
+
+    Iterate on it to get the received batches, then close it to release the ones left.
+    `attribute_names` are the sqs message attributes to receive with the messages and
+    `system_attribute_names` the sqs attributes of the messages, ex: MessageGroupId.
+    With `metrics` (see paper_cup.metrics) the receives are counted.
+  """
+
+  MAX_BATCH_SIZE = 10 # sqs limit
+
+  def __init__(self, sqs_client, queue_name, depth=2, visibility_timeout=30, extend_after=None, wait_time=20, attribute_names=None, system_attribute_names=None, metrics=None, drain=None):
+    """Start the background poller."""
+    self.sqs_client = sqs_client
+    self.queue_name = queue_name
+    self.visibility_timeout = visibility_timeout
+    self.extend_after = extend_after if extend_after is not None else visibility_timeout / 2.0
+    self.wait_time = wait_time
+    self.metrics = metrics
+    self.drain = drain
+    self._receive_kwargs = {'MessageAttributeNames': attribute_names} if attribute_names else {}
+    if system_attribute_names:
+      self._receive_kwargs['AttributeNames'] = system_attribute_names
+
+    self._batches = Queue(maxsize=depth)
+    self._buffered = []
+    self._lock = threading.Lock()
+    self._stopped = threading.Event()
+    self._error = None
+    self._received = 0 # batches received by the poller since it started
+
+    self._start_poller(wait_time)
+
+    self._watcher = threading.Thread(target=self._watch, name='paper-cup-prefetch-visibility')
+    self._watcher.daemon = True
+    self._watcher.start()
+
+  def __iter__(self):
+    """Yield the received batches of messages until the queue is empty."""
+    while not self._stopped.is_set():
+      try:
+        batch = self._batches.get(timeout=0.1)
+      except Empty:
+        if not self._poller.is_alive() and self._batches.empty():
+          if self._drained():
+            continue
+          break
+        continue
+
+      with self._lock:
+        self._buffered.remove(batch)
+      yield batch.messages
+
+    if self._error is not None:
+      raise self._error
+
+  def close(self):
+    """Stop the poller and make the messages not consumed visible again."""
+    self._stopped.set()
+    self._poller.join()
+    self._watcher.join()
+
+    with self._lock:
+      batches, self._buffered = self._buffered, []
+    if batches:
+      change_visibility(self.sqs_client, self.queue_name, [message for batch in batches for message in batch.messages], 0)
+
+  def _start_poller(self, wait_time):
+    """Start the background loop receiving the batches."""
+    self._received = 0
+    self._poller = threading.Thread(target=self._poll, args=(wait_time,), name='paper-cup-prefetch')
+    self._poller.daemon = True
+    self._poller.start()
+
+  def _drained(self):
+    """Once the poller stopped at an empty receive after some batches, call `drain` and start it again, True if started."""
+    if not self.drain or not self._received or self._error is not None or self._stopped.is_set():
+      return False
+    self.drain()
+    self._start_poller(0)
+    return True
+
+  def _poll(self, wait_time):
+    """Background loop receiving the batches."""
+    try:
+      while not self._stopped.is_set():
+        messages = self.sqs_client.queue.receive_messages(WaitTimeSeconds=wait_time, MaxNumberOfMessages=self.MAX_BATCH_SIZE, VisibilityTimeout=self.visibility_timeout, **self._receive_kwargs)
+        # like the consume loop, only the first receive is a long poll
+        wait_time = 0
+        if self.metrics:
+          record_receive(self.metrics, self.queue_name, len(messages))
+        if not messages:
+          break
+
+        self._received += 1
+        batch = _Batch(messages)
+        with self._lock:
+          self._buffered.append(batch)
+        while not self._stopped.is_set():
+          try:
+            self._batches.put(batch, timeout=0.1)
+            break
+          except Full:
+            pass
+    except Exception as e:
+      logger.exception('Failed to receive sqs messages.')
+      self._error = e
+
+  def _watch(self):
+    """Background loop extending the visibility of the batches waiting for too long."""
+    interval = max(min(self.extend_after / 2.0, 1), 0.01)
+    while not self._stopped.wait(interval):
+      now = time.time()
+      with self._lock:
+        expiring = [batch for batch in self._buffered if now - batch.visible_at >= self.extend_after]
+      for batch in expiring:
+        try:
+          change_visibility(self.sqs_client, self.queue_name, batch.messages, self.visibility_timeout)
+          batch.visible_at = now
+        except Exception:
+          logger.exception('Failed to extend the visibility of prefetched messages.')
@@ -0,0 +1,160 @@
+"""Client side rate limit of the publishing, so sns doesn't throttle us."""
+import threading
+import time
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class TokenBucket(object):
+  """Tokens added at `rate` per second up to `capacity` (default: one second of tokens).
+
+    Taking more tokens than the capacity is allowed once the bucket is full, it is then in debt,
+    so a message bigger than the bytes per second is sent alone instead of never.
+    The bucket is not locked, the RateLimiter lock it.
+  """
+
+  def __init__(self, rate, capacity=None):
+    """Start full."""
+    assert(rate > 0)
+    self.rate = float(rate)
+    self.capacity = float(capacity or rate)
+    self.tokens = self.capacity
+    self._updated_at = time.time()
+
+  def refill(self):
+    """Add the tokens of the time elapsed since the last refill."""
+    now = time.time()
+    self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+    self._updated_at = now
+
+  def wait_time(self, tokens):
+    """Seconds until the tokens can be taken, 0 if they can be taken now."""
+    missing = min(tokens, self.capacity) - self.tokens
+    return max(0.0, missing / self.rate)
+
+  def set_rate(self, rate):
+    """Change the rate, the capacity stay one second of tokens."""
+    self.refill()
+    self.rate = float(rate)
+    self.capacity = self.rate
+    self.tokens = min(self.tokens, self.capacity)
+
+  def take(self, tokens):
+    """Take the tokens, check wait_time before."""
+    self.tokens -= tokens
+
+
+class RateLimiter(object):
+  """Limit of the messages and bytes per second shared by threads, lowered when the service throttle us.
+
+    The rate is halved at each throttling (at most once per second, down to `min_ratio` of the limit)
+    and raised back by `recovery` of the limit by second of calls without throttling (AIMD).
+  """
+
+  def __init__(self, messages_per_second=None, bytes_per_second=None, min_ratio=0.1, decrease=0.5, recovery=0.1):
+    """Limit on the messages, the bytes or both."""
+    assert(messages_per_second or bytes_per_second)
+    self.messages_per_second = messages_per_second
+    self.bytes_per_second = bytes_per_second
+    self.min_ratio = min_ratio
+    self.decrease = decrease
+    self.recovery = recovery
+    self.ratio = 1.0 # part of the limit used now
+    self.throttles = 0
+    self.waited = 0.0 # seconds spent waiting in acquire
+    if messages_per_second:
+      self._messages = TokenBucket(messages_per_second)
+    if bytes_per_second:
+      self._bytes = TokenBucket(bytes_per_second)
+    self._adjusted_at = time.time()
+    self._lock = threading.Lock()
+
+  def try_acquire(self, messages=1, size=0):
+    """Take the messages and bytes if they are available now, return False else."""
+    with self._lock:
+      return self._try_acquire(messages, size) == 0
+
+  def wait_time(self, messages=1, size=0):
+    """Seconds until the messages and bytes can be taken."""
+    with self._lock:
+      return self._wait_time(messages, size)
+
+  def acquire(self, messages=1, size=0, timeout=None):
+    """Wait until the messages and bytes are taken, return False if it would take more than `timeout` seconds."""
+    deadline = time.time() + timeout if timeout is not None else None
+    while True:
+      with self._lock:
+        wait = self._try_acquire(messages, size)
+      if not wait:
+        return True
+      if deadline is not None and time.time() + wait > deadline:
+        return False
+      self.waited += wait
+      time.sleep(wait)
+
+  def throttled(self):
+    """The service throttled a call, lower the rate."""
+    with self._lock:
+      self.throttles += 1
+      now = time.time()
+      # the calls in flight are throttled together, lower once for them
+      if now - self._adjusted_at >= 1 or self.ratio == 1.0:
+        self._set_ratio(self.ratio * self.decrease)
+        self._adjusted_at = now
+
+  def succeeded(self):
+    """A call was not throttled, raise the rate back toward the limit."""
+    with self._lock:
+      now = time.time()
+      if self.ratio < 1.0 and now - self._adjusted_at >= 1:
+        self._set_ratio(self.ratio + self.recovery * (now - self._adjusted_at))
+        self._adjusted_at = now
+
+  def as_dict(self):
+    """Summary of the current rates and counters, to log or send."""
+    return {
+        'messages_per_second': self.messages_per_second and self.messages_per_second * self.ratio,
+        'bytes_per_second': self.bytes_per_second and self.bytes_per_second * self.ratio,
+        'throttles': self.throttles,
+        'waited': self.waited,
+    }
+
+  def _wait_time(self, messages, size):
+    """Seconds to wait for the tokens, the lock is held."""
+    wait = 0.0
+    if self.messages_per_second:
+      self._messages.refill()
+      wait = max(wait, self._messages.wait_time(messages))
+    if self.bytes_per_second:
+      self._bytes.refill()
+      wait = max(wait, self._bytes.wait_time(size))
+    return wait
+
+  def _try_acquire(self, messages, size):
+    """Take the tokens of both buckets or none, return the seconds to wait (0 once taken), the lock is held."""
+    wait = self._wait_time(messages, size)
+    if not wait:
+      if self.messages_per_second:
+        self._messages.take(messages)
+      if self.bytes_per_second:
+        self._bytes.take(size)
+    return wait
+
+  def _set_ratio(self, ratio):
+    """Use this part of the limit, the lock is held."""
+    self.ratio = min(1.0, max(self.min_ratio, ratio))
+    if self.messages_per_second:
+      self._messages.set_rate(self.messages_per_second * self.ratio)
+    if self.bytes_per_second:
+      self._bytes.set_rate(self.bytes_per_second * self.ratio)
+
+
+def get_rate_limiter(key, messages_per_second=None, bytes_per_second=None):
+  """Get the rate limiter shared under the key, created with the limits the first time."""
+  with _limiters_lock:
+    limiter = _limiters.get(key)
+    if limiter is None:
+      limiter = RateLimiter(messages_per_second, bytes_per_second)
+      _limiters[key] = limiter
+  return limiter
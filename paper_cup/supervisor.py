@@ -0,0 +1,185 @@
+import importlib
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = '%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s'
+
+
+def load_consumer(path):
+  """Get the consumer class from it dotted path, 'module.Class' or 'module:Class'."""
+  if ':' in path:
+    module_name, class_name = path.split(':', 1)
+  else:
+    module_name, _, class_name = path.rpartition('.')
+  if not module_name or not class_name:
+    raise ValueError('Expected a consumer path as module.Class or module:Class, got %r.' % path)
+  return getattr(importlib.import_module(module_name), class_name)
+
+
+def run_worker(consumer_class, workers=None, executor=None, log_level=None):
+  """Entry point of a worker process, consume until SIGTERM (or SIGINT) then drain the actions in flight."""
+  if log_level is not None and not logging.getLogger().handlers:
+    # the spawned processes don't get the logging of the supervisor
+    logging.basicConfig(level=log_level, format=LOG_FORMAT)
+  consumer = consumer_class()
+
+  def stop(signum, frame):
+    logger.info('Worker %d stopping on signal %d.', os.getpid(), signum)
+    consumer.stop()
+
+  signal.signal(signal.SIGTERM, stop)
+  signal.signal(signal.SIGINT, stop)
+  report = consumer.run_forever(workers=workers, executor=executor)
+  logger.info('Worker %d stopped: %r', os.getpid(), report)
+
+
+def desired_processes(queue_depth, messages_per_process, min_processes, max_processes):
+  """Number of processes for the queue depth, one by `messages_per_process` messages waiting."""
+  if queue_depth is None:
+    return None
+  wanted = int(math.ceil(float(queue_depth) / messages_per_process))
+  return max(min_processes, min(max_processes, wanted))
+
+
+class Supervisor(object):
+  """Run the consumer in worker processes, restart the ones that crash and stop them gracefully.
+
+    Each process run `consumer_class().run_forever(workers, executor)`. On `stop` (SIGTERM or SIGINT
+    to the supervisor) the processes stop receiving and finish their actions in flight, the ones
+    still running after `drain_timeout` seconds are killed and their messages come back in the
+    queue after the visibility timeout. A process that exit on it own is restarted after
+    `restart_delay` seconds.
+
+    With `max_processes` the number of processes follow the queue depth, read every `scale_interval`
+    seconds: one process by `messages_per_process` messages waiting, from `processes` to
+    `max_processes`. The extra processes are stopped one at a time.
+  """
+
+  def __init__(self, consumer_class, processes=1, workers=None, executor=None, drain_timeout=30, restart_delay=1,
+               max_processes=None, messages_per_process=100, scale_interval=30, target=run_worker):
+    """Set the processes to run, `target(consumer_class, workers, executor, log_level)` is run by each of them."""
+    assert(processes >= 1)
+    assert(max_processes is None or max_processes >= processes)
+    self.consumer_class = consumer_class
+    self.min_processes = processes
+    self.max_processes = max_processes or processes
+    self.workers = workers
+    self.executor = executor
+    self.drain_timeout = drain_timeout
+    self.restart_delay = restart_delay
+    self.messages_per_process = messages_per_process
+    self.scale_interval = scale_interval
+    self.target = target
+
+    self.processes = []
+    self.restarts = 0
+    self.wanted = processes
+    self._context = multiprocessing.get_context('spawn') if hasattr(multiprocessing, 'get_context') else multiprocessing
+    self._consumer = None
+    self._scaled_at = None
+    self._stopped = threading.Event()
+
+  def run(self):
+    """Start the processes and supervise them until stopped, return once they are all stopped."""
+    self._install_signals()
+    try:
+      while len(self.processes) < self.wanted:
+        self._start()
+      while not self._stopped.wait(0.2):
+        self._restart_exited()
+        self._scale()
+    finally:
+      self._drain()
+
+  def stop(self, *args):
+    """Stop the processes, they finish their actions in flight."""
+    self._stopped.set()
+
+  def queue_depth(self):
+    """Approximate number of messages in the queue of the consumer, None if it can't be read."""
+    try:
+      if self._consumer is None:
+        self._consumer = self.consumer_class()
+      queue = self._consumer.sqs_client.queue
+      queue.reload()
+      return int(queue.attributes['ApproximateNumberOfMessages'])
+    except Exception:
+      logger.exception('Failed to read the queue depth.')
+      return None
+
+  def _install_signals(self):
+    """Stop on SIGTERM and SIGINT, only possible from the main thread."""
+    try:
+      signal.signal(signal.SIGTERM, self.stop)
+      signal.signal(signal.SIGINT, self.stop)
+    except ValueError:
+      logger.debug('Not in the main thread, stop the supervisor with `stop`.')
+
+  def _start(self):
+    """Start a worker process."""
+    args = (self.consumer_class, self.workers, self.executor, logging.getLogger().getEffectiveLevel())
+    process = self._context.Process(target=self.target, args=args, name='paper-cup-worker')
+    process.daemon = False
+    process.start()
+    self.processes.append(process)
+    logger.info('Started worker %d of %s.', process.pid, self.consumer_class.__name__)
+    return process
+
+  def _restart_exited(self):
+    """Restart the processes that exited."""
+    for process in [process for process in self.processes if not process.is_alive()]:
+      process.join()
+      self.processes.remove(process)
+      if len(self.processes) >= self.wanted:
+        # stopped by the scale down
+        continue
+      logger.warning('Worker %d exited with code %s, restarting it in %s seconds.', process.pid, process.exitcode, self.restart_delay)
+      if self._stopped.wait(self.restart_delay):
+        return
+      self.restarts += 1
+      self._start()
+
+  def _scale(self):
+    """Adapt the number of processes to the queue depth."""
+    if self.max_processes == self.min_processes:
+      return
+    now = time.time()
+    if self._scaled_at is not None and now - self._scaled_at < self.scale_interval:
+      return
+    self._scaled_at = now
+
+    wanted = desired_processes(self.queue_depth(), self.messages_per_process, self.min_processes, self.max_processes)
+    if wanted is None or wanted == self.wanted:
+      return
+    if wanted < self.wanted:
+      # one at a time, the queue may fill again
+      wanted = self.wanted - 1
+    logger.info('Scaling %s from %d to %d workers.', self.consumer_class.__name__, self.wanted, wanted)
+    self.wanted = wanted
+    while len(self.processes) < self.wanted:
+      self._start()
+    for process in self.processes[self.wanted:]:
+      process.terminate()
+
+  def _drain(self):
+    """Stop the processes, kill the ones still running after drain_timeout."""
+    for process in self.processes:
+      if process.is_alive():
+        process.terminate()
+    deadline = time.time() + self.drain_timeout
+    for process in self.processes:
+      process.join(max(0, deadline - time.time()))
+      if process.is_alive():
+        logger.warning('Worker %d still running after %s seconds, killing it.', process.pid, self.drain_timeout)
+        if hasattr(process, 'kill'):
+          process.kill()
+        else: # python 2
+          os.kill(process.pid, signal.SIGKILL)
+        process.join()
@@ -0,0 +1,201 @@
+import asyncio
+import threading
+from unittest import TestCase
+
+from paper_cup.aio import AsyncConsumePC, AsyncPublishPC, async_retry
+from .test_paper_cup import DummyAppMessage
+from .test_ratelimit import throttling_sns_client
+
+
+class TestAsyncRetry(TestCase):
+
+  FAST_MORE_RETRY = {'tries': 4, 'delay': 0.01, 'backoff': 1}
+
+  def run_coroutine(self, coroutine):
+    """Run the coroutine on a new event loop."""
+    loop = asyncio.new_event_loop()
+    self.addCleanup(loop.close)
+    return loop.run_until_complete(coroutine)
+
+  def test_limit_is_reached(self):
+    """Check that the number of retry is what we asked."""
+    self.counter = 0
+
+    @async_retry(ValueError, **self.FAST_MORE_RETRY)
+    async def always_fails():
+      self.counter += 1
+      raise ValueError('failed')
+
+    with self.assertRaises(ValueError):
+      self.run_coroutine(always_fails())
+    self.assertEqual(self.counter, self.FAST_MORE_RETRY['tries'])
+
+  def test_success_after_retry(self):
+    """Check that the result is returned once it stop failing."""
+    self.counter = 0
+
+    @async_retry(ValueError, **self.FAST_MORE_RETRY)
+    async def fails_once():
+      self.counter += 1
+      if self.counter < 2:
+        raise ValueError('failed')
+      return 'success'
+
+    self.assertEqual('success', self.run_coroutine(fails_once()))
+
+  def test_rate_limiter_throttled(self):
+    """Check that each throttled attempt of the publish is told to the rate limiter."""
+
+    class PublishAsyncRateLimitedPC(AsyncPublishPC):
+      PC_SNS_TOPIC = 'topic_async_rate_limited'
+      PC_PUBLISH_RATE_LIMIT = 1000
+      PC_PUBLISH_RATE_LIMIT_SCOPE = 'class'
+
+    publisher = PublishAsyncRateLimitedPC(sns_client=throttling_sns_client(PublishAsyncRateLimitedPC.PC_SNS_TOPIC, throttles=2))
+    self.assertEqual({'MessageId': '3'}, self.run_coroutine(publisher.publish({'number': 1}, 'index')))
+    self.assertEqual(2, publisher.rate_limiter.throttles)
+
+
+class TestAsyncPaperCup(TestCase):
+
+  def setUp(self):
+    """Create the queue and the topic and subscribe the queue to the topic."""
+    from paper_cup.client import SNSClient, SQSClient
+    from paper_cup.paper_cup import PaperCup
+
+    self.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(self.loop)
+
+    self.sqs = SQSClient(endpoint_url=PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test')
+    self.sqs.create_queue(PaperCup.PC_SQS_QUEUE)
+    self.sns = SNSClient(endpoint_url=PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test')
+    self.sns.create_topic(PaperCup.PC_SNS_TOPIC)
+    self.sns.add_sqs_subscription(PaperCup.PC_SNS_TOPIC, self.sqs.get_queue_arn(PaperCup.PC_SQS_QUEUE))
+
+  def tearDown(self):
+    """Clean the queue and topic."""
+    from paper_cup.paper_cup import PaperCup
+    self.sqs.delete_queue(PaperCup.PC_SQS_QUEUE)
+    self.sns.delete_topic(PaperCup.PC_SNS_TOPIC)
+    self.loop.close()
+    asyncio.set_event_loop(None)
+
+  def test_publish_consume(self):
+    """Check that async and blocking actions are consumed concurrently."""
+
+    class PublishAsyncDummyPC(AsyncPublishPC):
+      """Dummy async publisher."""
+
+    class ConsumeAsyncDummyPC(AsyncConsumePC):
+      """Dummy async consumer."""
+
+      result = {}
+      running = [0, 0] # running now, max running at the same time
+
+      async def index(self, message):
+        """Store the message, wait a bit to see if the other actions run at the same time."""
+        self.running[0] += 1
+        self.running[1] = max(self.running)
+        await asyncio.sleep(0.1)
+        self.running[0] -= 1
+        self.result[message['number']] = 'index'
+
+      def delete(self, message):
+        """Blocking action, run outside of the event loop thread."""
+        self.result[message['number']] = threading.current_thread().name
+
+    async def run():
+      publisher = PublishAsyncDummyPC()
+      for i in range(10):
+        await publisher.publish(DummyAppMessage(number=i), 'index')
+      await publisher.publish(DummyAppMessage(number=10), 'delete')
+      await AsyncConsumePC().consume()
+
+    self.loop.run_until_complete(run())
+
+    self.assertEqual(['index'] * 10, [ConsumeAsyncDummyPC.result[i] for i in range(10)])
+    self.assertNotEqual(threading.current_thread().name, ConsumeAsyncDummyPC.result[10])
+    self.assertTrue(ConsumeAsyncDummyPC.running[1] > 1)
+
+  def test_buffered_and_bulk(self):
+    """Check that the buffered publish, it callback and the bulk publish mode work as with PublishPC."""
+
+    class PublishAsyncBulkPC(AsyncPublishPC):
+      """Dummy buffered async publisher."""
+      PC_PUBLISH_BUFFERED = True
+
+    class ConsumeAsyncBulkPC(AsyncConsumePC):
+      """Dummy async consumer."""
+
+      result = []
+
+      async def index(self, message):
+        self.result.append(message['number'])
+
+    sent = []
+
+    async def run():
+      publisher = PublishAsyncBulkPC()
+      future = await publisher.publish(DummyAppMessage(number=0), 'index', callback=sent.append)
+      message_id = await future
+      publisher.close()
+      results = await PublishAsyncBulkPC(buffered=False).bulk_publish([DummyAppMessage(number=i) for i in (1, 2)], ['index'] * 2, mode='batch')
+      await AsyncConsumePC().consume()
+      return message_id, results
+
+    message_id, results = self.loop.run_until_complete(run())
+
+    self.assertTrue(message_id)
+    self.assertEqual([message_id], [future.result() for future in sent])
+    self.assertEqual([None, None], [result.error for result in results])
+    self.assertEqual([0, 1, 2], sorted(ConsumeAsyncBulkPC.result))
+
+  def test_flush_per_batch(self):
+    """Check that the messages of a partial batch are deleted once it is done, before the next batch is consumed."""
+
+    class PublishAsyncFlushPC(AsyncPublishPC):
+      """Dummy async publisher."""
+
+    publisher = PublishAsyncFlushPC()
+    deleted = []
+    deleted_at_receive = [] # messages deleted when the batches after the first are received
+
+    class FlushingAsyncPC(AsyncConsumePC):
+      """Consumer publishing a second batch once the first one is consumed."""
+
+      async def _receive_messages(self, **kwargs):
+        if 'WaitTimeSeconds' not in kwargs:
+          # the actions of the previous batch are done
+          await asyncio.sleep(0.2)
+          deleted_at_receive.append(len(deleted))
+          if len(deleted_at_receive) == 1:
+            await publisher.publish(DummyAppMessage(number=2), 'index')
+        return await super(FlushingAsyncPC, self)._receive_messages(**kwargs)
+
+    class ConsumeAsyncFlushPC(FlushingAsyncPC):
+      """Dummy async consumer."""
+
+      result = []
+
+      async def index(self, message):
+        self.result.append(message['number'])
+
+    consumer = FlushingAsyncPC()
+    delete_message_batch = consumer.sqs_client.delete_message_batch
+
+    def counted_delete(queue_name, entries):
+      deleted.extend(entries)
+      return delete_message_batch(queue_name, entries)
+
+    consumer.sqs_client.delete_message_batch = counted_delete
+
+    async def run():
+      for i in range(2):
+        await publisher.publish(DummyAppMessage(number=i), 'index')
+      return await consumer.consume()
+
+    report = self.loop.run_until_complete(run())
+
+    self.assertEqual([0, 1, 2], sorted(ConsumeAsyncFlushPC.result))
+    self.assertEqual(3, report.succeeded)
+    self.assertEqual([2, 3], deleted_at_receive[:2])
@@ -0,0 +1,91 @@
+from unittest import TestCase
+
+from paper_cup import PaperCup
+from paper_cup.acknowledger import Acknowledger
+from paper_cup.client import SQSClient
+
+
+class DummySQSMessage(object):
+  """Minimal received sqs message with only what the acknowledger need."""
+
+  def __init__(self, message_id, receipt_handle):
+    self.message_id = message_id
+    self.receipt_handle = receipt_handle
+
+
+class TestAcknowledger(TestCase):
+
+  def setUp(self):
+    """Create an empty queue and wrap the batch delete to count the calls."""
+    self.sqs_client = SQSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test')
+    self.sqs_client.create_queue(PaperCup.PC_SQS_QUEUE)
+    self.queue = self.sqs_client.get_queue_by_name(PaperCup.PC_SQS_QUEUE)
+
+    self.calls = []
+    delete_message_batch = self.sqs_client.delete_message_batch
+
+    def counted_delete_message_batch(queue_name, entries):
+      self.calls.append(entries)
+      return delete_message_batch(queue_name, entries)
+
+    self.sqs_client.delete_message_batch = counted_delete_message_batch
+
+  def tearDown(self):
+    """Remove the queue."""
+    self.sqs_client.delete_queue(PaperCup.PC_SQS_QUEUE)
+
+  def receive_all(self, number):
+    """Send then receive the given number of messages."""
+    for i in range(number):
+      self.queue.send_message(MessageBody=str(i))
+
+    messages = []
+    while len(messages) < number:
+      messages.extend(self.queue.receive_messages(MaxNumberOfMessages=10, VisibilityTimeout=30))
+    return messages
+
+  def test_batch(self):
+    """Check that messages are deleted by batch of 10."""
+    acknowledger = Acknowledger(self.sqs_client, PaperCup.PC_SQS_QUEUE)
+    for message in self.receive_all(12):
+      acknowledger.ack(message)
+
+    # the first batch is sent as soon as it is full
+    self.assertEqual(1, len(self.calls))
+    self.assertEqual(10, len(self.calls[0]))
+
+    self.assertEqual([], acknowledger.flush())
+    self.assertEqual(2, len(self.calls))
+    self.assertEqual(2, len(self.calls[1]))
+
+    # nothing left in the queue
+    self.assertEqual([], self.queue.receive_messages(VisibilityTimeout=0))
+
+  def test_failures(self):
+    """Check that failed entries are reported and that sender errors are not retried."""
+    reported = []
+    acknowledger = Acknowledger(self.sqs_client, PaperCup.PC_SQS_QUEUE, on_failure=reported.extend)
+
+    message = self.receive_all(1)[0]
+    acknowledger.ack(message)
+    acknowledger.ack(DummySQSMessage('wrong-message', 'wrong-receipt-handle'))
+
+    failures = acknowledger.flush()
+    self.assertEqual(1, len(self.calls))
+    self.assertEqual(1, len(failures))
+    self.assertEqual('wrong-message', failures[0]['message_id'])
+    self.assertTrue(failures[0]['sender_fault'])
+    self.assertEqual(failures, reported)
+
+  def test_flush_interval(self):
+    """Check that the timer delete the messages without explicit flush."""
+    import time
+
+    acknowledger = Acknowledger(self.sqs_client, PaperCup.PC_SQS_QUEUE, flush_interval=0.05)
+    for message in self.receive_all(3):
+      acknowledger.ack(message)
+
+    time.sleep(0.5)
+    self.assertEqual(1, len(self.calls))
+    self.assertEqual(3, len(self.calls[0]))
+    acknowledger.close()
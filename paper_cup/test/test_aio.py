@@ -0,0 +1,5 @@
+import sys
+
+if sys.version_info >= (3, 5):
+  # the asyncio tests are in a module python 2 never compile
+  from .aio_cases import TestAsyncPaperCup, TestAsyncRetry # noqa: F401
@@ -0,0 +1,24 @@
+from unittest import TestCase
+
+from benchmarks.bench import Benchmark, percentile
+
+
+class TestBenchmark(TestCase):
+
+  def test_percentile(self):
+    """Check the nearest rank percentiles."""
+    values = list(range(1, 101))
+    self.assertEqual(50, percentile(values, 50))
+    self.assertEqual(99, percentile(values, 99))
+    self.assertEqual(100, percentile(values, 100))
+    self.assertIsNone(percentile([], 50))
+
+  def test_run(self):
+    """Check that the benchmarks run on the memory transport and count the api calls."""
+    report = Benchmark('memory', messages=20).run(['publish', 'get_topic_arn'])
+    self.assertEqual('memory', report['meta']['transport'])
+    publish, cached, uncached = report['results']
+    self.assertEqual({'Publish': 20}, publish['api_calls'])
+    self.assertEqual(1.0, publish['api_calls_per_message'])
+    self.assertEqual({}, cached['api_calls'])
+    self.assertEqual({'ListTopics': 20}, uncached['api_calls'])
@@ -0,0 +1,101 @@
+import threading
+from unittest import TestCase
+
+from paper_cup.buffered import BufferedPublisher, BufferFullError
+from paper_cup.codec import MessageCodec
+from paper_cup.packer import PublishResult
+
+
+class DummyPublisher(object):
+  """Publisher that store the batches instead of sending them."""
+
+  PC_BULK_PUBLISH_MODE = 'array'
+
+  def __init__(self):
+    self.batches = []
+    self.release = threading.Event()
+    self.release.set()
+
+  def _get_codec(self):
+    return MessageCodec()
+
+  def _serialize(self, message):
+    return self._get_codec().dumps(message), None
+
+  def _add_more_data(self, message, action):
+    message['action'] = action
+    return message
+
+  def _publish_serialized(self, serialized_messages, mode):
+    self.release.wait()
+    batch = list(serialized_messages)
+    self.batches.append(batch)
+    return [PublishResult(key, 'id-%s' % key, None) for key, _, _, _ in batch]
+
+
+class TestBufferedPublisher(TestCase):
+
+  def test_batch(self):
+    """Check that the messages are sent by batch and that the futures get the message id."""
+    publisher = DummyPublisher()
+    buffered = BufferedPublisher(publisher, max_batch_size=10, linger_ms=1000)
+    futures = [buffered.publish({'number': i}, 'index') for i in range(25)]
+    buffered.close()
+
+    self.assertEqual([10, 10, 5], [len(batch) for batch in publisher.batches])
+    self.assertTrue(all(future.result().startswith('id-') for future in futures))
+
+  def test_linger(self):
+    """Check that an incomplete batch is sent after the linger time."""
+    publisher = DummyPublisher()
+    buffered = BufferedPublisher(publisher, max_batch_size=10, linger_ms=10)
+    future = buffered.publish({'number': 1}, 'index')
+    self.assertEqual('id-0', future.result(timeout=1))
+    buffered.close()
+
+  def test_max_bytes(self):
+    """Check that a batch is sent when it reach the size limit."""
+    publisher = DummyPublisher()
+    buffered = BufferedPublisher(publisher, max_batch_bytes=100, linger_ms=1000)
+    for i in range(10):
+      buffered.publish({'data': 'x' * 40}, 'index')
+    buffered.flush()
+
+    self.assertEqual(5, len(publisher.batches))
+    buffered.close()
+
+  def test_flush(self):
+    """Check that flush send the messages without waiting for the linger time."""
+    publisher = DummyPublisher()
+    buffered = BufferedPublisher(publisher, linger_ms=60000)
+    future = buffered.publish({'number': 1}, 'index')
+    buffered.flush()
+    self.assertTrue(future.done())
+    buffered.close()
+
+  def test_drop(self):
+    """Check that the messages are dropped when the queue is full."""
+    publisher = DummyPublisher()
+    publisher.release.clear()
+    buffered = BufferedPublisher(publisher, max_batch_size=1, max_queue_size=1, on_full='drop')
+
+    results = []
+    futures = [buffered.publish({'number': i}, 'index', callback=results.append) for i in range(10)]
+    dropped = [future for future in futures if future.done()]
+    self.assertTrue(dropped)
+    self.assertEqual(len(dropped), buffered.dropped)
+    self.assertTrue(isinstance(dropped[0].exception(), BufferFullError))
+
+    publisher.release.set()
+    buffered.close()
+    # the callback is called for all the messages
+    self.assertEqual(10, len(results))
+
+  def test_failure(self):
+    """Check that a failed message fail it future."""
+    publisher = DummyPublisher()
+    publisher._publish_serialized = lambda serialized_messages, mode: [PublishResult(key, None, ValueError()) for key, _, _ in serialized_messages]
+    buffered = BufferedPublisher(publisher)
+    future = buffered.publish({'number': 1}, 'index')
+    buffered.close()
+    self.assertTrue(isinstance(future.exception(), ValueError))
@@ -0,0 +1,220 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import TestCase
+
+from botocore.exceptions import ClientError
+
+from paper_cup.claim_check import ClaimCheck, FileSystemPayloadStore, PayloadCache, S3PayloadStore
+from paper_cup.client import S3Client, SNSClient, SQSClient
+from paper_cup.codec import MessageCodec, decode_stream
+from paper_cup.paper_cup import ConsumePC, PaperCup, PublishPC
+
+BUCKET = 'paper-cup-claim-check'
+BIG_DATA = 'x' * 300000 # over the sns limit
+
+
+class ClaimRootPC(ConsumePC):
+  PC_SQS_QUEUE = 'claim_check_queue'
+  PC_CLAIM_CHECK_BUCKET = BUCKET
+
+
+class ConsumeClaimPC(ClaimRootPC):
+  result = []
+
+  def index(self, message):
+    self.result.append((message['number'], len(message['data'])))
+
+
+class PublishClaimPC(PublishPC):
+  PC_SNS_TOPIC = 'claim_check_topic'
+  PC_CLAIM_CHECK_STORE = 's3'
+  PC_CLAIM_CHECK_BUCKET = BUCKET
+
+
+class TestDecodeStream(TestCase):
+
+  message = {'number': 1, 'data': 'x' * 200000}
+
+  def check(self, serializer, compression=None):
+    """Check that the bytes of the codec are decoded from a stream."""
+    try:
+      message_codec = MessageCodec(serializer, compression=compression)
+    except ImportError as e:
+      raise unittest.SkipTest(str(e))
+    data, codec_name = message_codec.compress(message_codec.dumps(self.message))
+    self.assertEqual(self.message, decode_stream(io.BytesIO(data), codec_name))
+
+  def test_json(self):
+    self.check('json')
+
+  def test_zlib(self):
+    self.check('json', 'zlib')
+
+  def test_msgpack_zstd(self):
+    self.check('msgpack', 'zstd')
+
+
+class TestClaimCheck(TestCase):
+
+  def setUp(self):
+    """File store in a temporary directory."""
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+    self.store = FileSystemPayloadStore(self.directory)
+
+  def test_file_store(self):
+    """Check that a stored payload is read back from it reference and deleted."""
+    reference = self.store.put(b'payload')
+    self.assertTrue(reference.startswith('file://'))
+    stream, size = self.store.open(reference)
+    with stream:
+      self.assertEqual((b'payload', 7), (stream.read(), size))
+    self.store.delete(reference)
+    with self.assertRaises(IOError):
+      self.store.open(reference)
+
+  def test_cache(self):
+    """Check that the small payloads are cached and the big ones streamed."""
+    claim_check = ClaimCheck(self.store, cache_bytes=100, cache_item_bytes=50)
+    small, attributes = claim_check.offload(b'{"a": 1}', 'json')
+    self.assertEqual({'pc_claim_check': {'DataType': 'String', 'StringValue': 'json'}}, attributes)
+    big, _ = claim_check.offload(b'{"a": "%s"}' % (b'x' * 100), 'json')
+
+    self.assertEqual({'a': 1}, claim_check.load(small, 'json'))
+    self.store.delete(small)
+    # from the cache once deleted
+    self.assertEqual({'a': 1}, claim_check.load(small, 'json'))
+    self.assertEqual(100, len(claim_check.load(big, 'json')['a']))
+    self.assertEqual((1, 2, 8), (claim_check.cache.hits, claim_check.cache.misses, claim_check.cache.size))
+
+  def test_cache_size(self):
+    """Check that the least recently used payloads are dropped."""
+    cache = PayloadCache(10)
+    cache.set('a', b'aaaa')
+    cache.set('b', b'bbbb')
+    cache.get('a')
+    cache.set('c', b'cccc')
+    self.assertEqual((b'aaaa', None, b'cccc'), (cache.get('a'), cache.get('b'), cache.get('c')))
+    cache.set('d', b'd' * 11)
+    self.assertIsNone(cache.get('d'))
+
+  def test_unknown_store(self):
+    """Check that a reference without store fail to load."""
+    with self.assertRaises(ValueError):
+      ClaimCheck().load('file:///nowhere', 'json')
+
+  def test_outside_store(self):
+    """Check that the references out of the directory or the bucket of the store are refused."""
+    outside = tempfile.NamedTemporaryFile(delete=False)
+    outside.write(b'{"secret": 1}')
+    outside.close()
+    self.addCleanup(os.remove, outside.name)
+    link = os.path.join(self.directory, 'link')
+    os.symlink(outside.name, link)
+
+    claim_check = ClaimCheck(self.store)
+    for reference in ['file://' + outside.name, 'file://%s/../%s' % (self.directory, os.path.basename(outside.name)), 'file://' + link, 'file:///etc/passwd']:
+      with self.assertRaises(ValueError):
+        claim_check.load(reference, 'json')
+    with self.assertRaises(ValueError):
+      FileSystemPayloadStore().open('file://' + outside.name)
+    with self.assertRaises(ValueError):
+      self.store.delete('file://' + outside.name)
+    self.assertTrue(os.path.exists(outside.name))
+
+    s3_store = S3PayloadStore(BUCKET, PaperCup.PC_AWS_LOCAL_ENDPOINT, PaperCup.PC_AWS_REGION, transport='memory')
+    for reference in ['s3://other-bucket/paper_cup/key', 's3://%s-other/paper_cup/key' % BUCKET]:
+      with self.assertRaises(ValueError):
+        s3_store.open(reference)
+    with self.assertRaises(ValueError):
+      S3PayloadStore(None, PaperCup.PC_AWS_LOCAL_ENDPOINT, PaperCup.PC_AWS_REGION, transport='memory').open('s3://%s/key' % BUCKET)
+
+  def test_unconfigured_store(self):
+    """Check that a consumer without the bucket or the directory setting don't load the references of it scheme."""
+    claim_check = PaperCup()._get_claim_check()
+    for reference in ['s3://%s/paper_cup/key' % BUCKET, 'file:///etc/passwd']:
+      with self.assertRaises(ValueError):
+        claim_check.load(reference, 'json')
+
+
+class TestClaimCheckPublish(TestCase):
+
+  def setUp(self):
+    """Topic subscribed by the queue and the bucket of the payloads."""
+    settings = dict(region=PaperCup.PC_AWS_REGION, aws_access_key_id=PaperCup.PC_AWS_ACCESS_KEY_ID, aws_secret_access_key=PaperCup.PC_AWS_SECRET_ACCESS_KEY_ID, transport=PaperCup.PC_TRANSPORT)
+    sns = SNSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, **settings)
+    sqs = SQSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, **settings)
+    sns.create_topic(PublishClaimPC.PC_SNS_TOPIC)
+    sqs.create_queue(ClaimRootPC.PC_SQS_QUEUE)
+    self.addCleanup(sns.delete_topic, PublishClaimPC.PC_SNS_TOPIC)
+    self.addCleanup(sqs.delete_queue, ClaimRootPC.PC_SQS_QUEUE)
+    sns.add_sqs_subscription(PublishClaimPC.PC_SNS_TOPIC, sqs.get_queue_arn(ClaimRootPC.PC_SQS_QUEUE), raw=self.raw)
+    self.create_store()
+    ConsumeClaimPC.result = []
+
+  raw = False
+
+  def create_store(self):
+    self.s3 = S3Client(PaperCup.PC_AWS_LOCAL_ENDPOINT, PaperCup.PC_AWS_REGION, PaperCup.PC_AWS_ACCESS_KEY_ID, PaperCup.PC_AWS_SECRET_ACCESS_KEY_ID, transport=PaperCup.PC_TRANSPORT)
+    try:
+      self.s3.create_bucket(BUCKET)
+    except ClientError as e:
+      if e.response['Error']['Code'] != 'BucketAlreadyOwnedByYou':
+        raise
+
+  def stored(self):
+    """Number of payloads in the store."""
+    return self.s3._s3_client.list_objects_v2(Bucket=BUCKET).get('KeyCount', 0)
+
+  def test_publish(self):
+    """Check that the big messages are offloaded and consumed by a consumer with the bucket or directory setting only."""
+    stored = self.stored()
+    publisher = PublishClaimPC()
+    publisher.publish({'number': 0, 'data': BIG_DATA}, 'index')
+    results = publisher.bulk_publish([{'number': i, 'data': BIG_DATA if i % 2 else 'x'} for i in range(1, 4)], ['index'] * 3, mode='batch')
+    self.assertEqual([None] * 3, [result.error for result in results])
+    self.assertEqual(stored + 3, self.stored())
+
+    report = ClaimRootPC().consume()
+    self.assertEqual(4, report.succeeded)
+    self.assertEqual([(0, len(BIG_DATA)), (1, len(BIG_DATA)), (2, 1), (3, len(BIG_DATA))], sorted(ConsumeClaimPC.result))
+
+  def test_small(self):
+    """Check that the messages under the threshold are published as usual."""
+    publisher = PublishClaimPC()
+    message, attributes = publisher._encode(publisher._serialize(publisher._add_more_data({'number': 0, 'data': 'x'}, 'index'))[0], ['index'])
+    self.assertNotIn('pc_claim_check', attributes)
+    self.assertIn('"number": 0', message)
+
+
+class TestClaimCheckMemory(TestClaimCheckPublish):
+  """Same with the topic, the queue and the bucket in memory, without moto."""
+
+  def setUp(self):
+    """Use the memory transport."""
+    PaperCup.PC_TRANSPORT = 'memory'
+    self.addCleanup(setattr, PaperCup, 'PC_TRANSPORT', 'aws')
+    super(TestClaimCheckMemory, self).setUp()
+
+
+class TestClaimCheckFile(TestClaimCheckPublish):
+  """Same with the file store, compressed messages and the raw message delivery."""
+
+  raw = True
+
+  def create_store(self):
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+    # zlib make the data small enough for sns, offloaded with the lower threshold
+    settings = [('PC_CLAIM_CHECK_STORE', 'file'), ('PC_CLAIM_CHECK_DIRECTORY', self.directory), ('PC_COMPRESSION', 'zlib'), ('PC_CLAIM_CHECK_THRESHOLD', 200)]
+    for name, value in settings:
+      self.addCleanup(setattr, PublishClaimPC, name, getattr(PublishClaimPC, name))
+      setattr(PublishClaimPC, name, value)
+    self.addCleanup(setattr, ClaimRootPC, 'PC_CLAIM_CHECK_DIRECTORY', None)
+    ClaimRootPC.PC_CLAIM_CHECK_DIRECTORY = self.directory
+
+  def stored(self):
+    return len(os.listdir(self.directory))
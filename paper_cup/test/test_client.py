@@ -44,13 +44,21 @@ class TestSNSClient(TestCase):
 
   def test_get_topic_arn_with_token(self):
     """Test that the pagination work."""
-    limit = 10
-    # TODO
+    pages = {
+      None: {'Topics': [{'TopicArn': 'arn:aws:sns:us-east-1:123456789012:other'}], 'NextToken': 'page-2'},
+      'page-2': {'Topics': [{'TopicArn': 'arn:aws:sns:us-east-1:123456789012:%s' % PaperCup.PC_SNS_TOPIC}]},
+    }
+
+    class PagedSNS(object):
+      def list_topics(self, NextToken=None):
+        return pages[NextToken]
+
+    self.sns_client._sns_client = PagedSNS()
+    self.assertEqual('arn:aws:sns:us-east-1:123456789012:%s' % PaperCup.PC_SNS_TOPIC, self.sns_client.get_topic_arn(PaperCup.PC_SNS_TOPIC))
 
   def test_subscribe_error(self):
     """Check that it raise error if the topic or queue don't exist."""
 
-
   def test_subscribe_correct(self):
     """Check that the subscribtion work when linking a topic to a queue."""
     # create a topic
@@ -64,6 +72,125 @@ class TestSNSClient(TestCase):
     # now we can subscribe the queue to the topic
     self.sns_client.add_sqs_subscription(PaperCup.PC_SNS_TOPIC, queue_arn)
 
+  def test_topic_arn_cache(self):
+    """Check that the topic arn is resolved only once."""
+    self.sns_client.create_topic(PaperCup.PC_SNS_TOPIC)
+    # use a fresh client so the arn is not already cached by create_topic
+    sns_client = SNSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION)
+    calls = count_calls(self, sns_client._sns_client, 'list_topics')
+
+    topic_arn = sns_client.get_topic_arn(PaperCup.PC_SNS_TOPIC)
+    self.assertEqual(topic_arn, sns_client.get_topic_arn(PaperCup.PC_SNS_TOPIC))
+    sns_client.publish('{}', PaperCup.PC_SNS_TOPIC)
+    self.assertEqual(1, len(calls))
+
+    # once invalidated we need to ask sns again
+    sns_client.invalidate_topic_arn(PaperCup.PC_SNS_TOPIC)
+    sns_client.get_topic_arn(PaperCup.PC_SNS_TOPIC)
+    self.assertEqual(2, len(calls))
+
+    self.sns_client.delete_topic(PaperCup.PC_SNS_TOPIC)
+
+  def test_topic_arn_cache_ttl(self):
+    """Check that the cached arn expire."""
+    self.sns_client.create_topic(PaperCup.PC_SNS_TOPIC)
+    sns_client = SNSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, cache_ttl=0)
+    calls = count_calls(self, sns_client._sns_client, 'list_topics')
+
+    sns_client.get_topic_arn(PaperCup.PC_SNS_TOPIC)
+    sns_client.get_topic_arn(PaperCup.PC_SNS_TOPIC)
+    self.assertEqual(2, len(calls))
+
+    self.sns_client.delete_topic(PaperCup.PC_SNS_TOPIC)
+
+  def test_topic_arn_cache_prewarm(self):
+    """Check that the arn is resolved in the constructor when asked."""
+    self.sns_client.create_topic(PaperCup.PC_SNS_TOPIC)
+    sns_client = SNSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, prewarm=[PaperCup.PC_SNS_TOPIC])
+    calls = count_calls(self, sns_client._sns_client, 'list_topics')
+
+    sns_client.publish('{}', PaperCup.PC_SNS_TOPIC)
+    self.assertEqual(0, len(calls))
+
+    self.sns_client.delete_topic(PaperCup.PC_SNS_TOPIC)
+
+  def test_topic_arn_cache_not_found(self):
+    """Check that the cached arn is dropped when the topic don't exist anymore."""
+    from botocore.exceptions import ClientError
+
+    self.sns_client.create_topic(PaperCup.PC_SNS_TOPIC)
+    sns_client = SNSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, prewarm=[PaperCup.PC_SNS_TOPIC])
+    # the topic is deleted by someone else
+    self.sns_client.delete_topic(PaperCup.PC_SNS_TOPIC)
+
+    with self.assertRaises(ClientError):
+      sns_client.publish('{}', PaperCup.PC_SNS_TOPIC)
+    self.assertIsNone(sns_client._topic_arns.get(PaperCup.PC_SNS_TOPIC))
+
+  def test_publish_batch_without_boto3_support(self):
+    """Check that with a boto3 older than publish_batch the entries are published one by one."""
+    from botocore.exceptions import ClientError
+
+    published = []
+
+    class OldSNS(object):
+      def publish(self, **kwargs):
+        if kwargs['Message'] == 'throttled':
+          raise ClientError({'Error': {'Code': 'Throttling', 'Message': 'slow down'}, 'ResponseMetadata': {'HTTPStatusCode': 400}}, 'Publish')
+        published.append(kwargs)
+        return {'MessageId': str(len(published))}
+
+    self.sns_client._sns_client = OldSNS()
+    self.sns_client._topic_arns.set(PaperCup.PC_SNS_TOPIC, 'arn')
+    entries = [{'Id': '0', 'Message': 'a', 'MessageAttributes': {}}, {'Id': '1', 'Message': 'throttled'}, {'Id': '2', 'Message': 'b'}]
+    response = self.sns_client.publish_batch(entries, PaperCup.PC_SNS_TOPIC)
+    self.assertEqual([{'Id': '0', 'MessageId': '1'}, {'Id': '2', 'MessageId': '2'}], response['Successful'])
+    self.assertEqual([{'Id': '1', 'Code': 'Throttling', 'Message': 'slow down', 'SenderFault': True}], response['Failed'])
+    self.assertEqual([{'TopicArn': 'arn', 'Message': 'a', 'MessageAttributes': {}}, {'TopicArn': 'arn', 'Message': 'b'}], published)
+
+  def test_publish_fifo_without_boto3_support(self):
+    """Check that a boto3 without the fifo fields of publish fail with a clear error."""
+    class Model(object):
+      def operation_model(self, name):
+        return Model()
+
+    Model.service_model = Model()
+    Model.input_shape = Model()
+    Model.members = {'TopicArn': None, 'Message': None}
+
+    class OldSNS(object):
+      meta = Model()
+
+    self.sns_client._sns_client = OldSNS()
+    self.assertFalse(self.sns_client.supports_fifo)
+    with self.assertRaises(NotImplementedError):
+      self.sns_client.publish('{}', 'topic.fifo', group_id='a')
+    with self.assertRaises(NotImplementedError):
+      self.sns_client.publish_batch([{'Id': '0', 'Message': '{}', 'MessageGroupId': 'a'}], 'topic.fifo')
+
+  def test_nested_retries(self):
+    """Check that a throttled get_topic_arn inside publish is tried `tries` times in all, the retries debited from the budget."""
+    from botocore.exceptions import ClientError
+    from paper_cup.decorators import RetryBudget, RetryGuard
+    from paper_cup.client import is_throttling_error
+
+    class ThrottledSNS(object):
+      calls = 0
+
+      def list_topics(self, **kwargs):
+        ThrottledSNS.calls += 1
+        raise ClientError({'Error': {'Code': 'Throttling'}, 'ResponseMetadata': {'HTTPStatusCode': 400}}, 'ListTopics')
+
+      def publish(self, **kwargs):
+        return {'MessageId': '1'}
+
+    self.sns_client._sns_client = ThrottledSNS()
+    self.sns_client.guard = RetryGuard(budget=RetryBudget(ratio=0, min_retries=10), throttled_if=is_throttling_error)
+    with self.assertRaises(ClientError):
+      self.sns_client.publish('{}', 'not-cached')
+    self.assertEqual(SNSClient.RETRY_TRIES, ThrottledSNS.calls)
+    self.assertEqual(SNSClient.RETRY_TRIES - 1, self.sns_client.guard.budget.retries)
+
 
 class TestSQSClient(TestCase):
 
@@ -73,3 +200,101 @@ class TestSQSClient(TestCase):
     # check that we correctly set an sqs session
     self.assertTrue(sqs_client._sqs_client)
     self.assertTrue(sqs_client._sqs_resource)
+
+  def test_queue_url_cache(self):
+    """Check that the queue url is resolved only once."""
+    SQSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION).create_queue(PaperCup.PC_SQS_QUEUE)
+    sqs_client = SQSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION)
+    calls = count_calls(self, sqs_client._sqs_client, 'get_queue_url')
+
+    queue_url = sqs_client.get_queue_url(PaperCup.PC_SQS_QUEUE)
+    self.assertEqual(queue_url, sqs_client.get_queue_by_name(PaperCup.PC_SQS_QUEUE).url)
+    sqs_client.get_queue_arn(PaperCup.PC_SQS_QUEUE)
+    self.assertEqual(1, len(calls))
+
+    # deleting the queue also drop it from the cache
+    sqs_client.delete_queue(PaperCup.PC_SQS_QUEUE)
+    self.assertIsNone(sqs_client._queue_urls.get(PaperCup.PC_SQS_QUEUE))
+
+
+class TestClientRegistry(TestCase):
+
+  def test_shared_client(self):
+    """Check that the clients with the same settings share the boto3 client."""
+    sns_client = SNSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION)
+    self.assertIs(sns_client._sns_client, SNSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION)._sns_client)
+
+    sqs_client = SQSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION)
+    other_sqs_client = SQSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION)
+    self.assertIs(sqs_client._sqs_client, other_sqs_client._sqs_client)
+    self.assertIs(sqs_client._sqs_resource, other_sqs_client._sqs_resource)
+
+  def test_different_settings(self):
+    """Check that different credentials or pool size get their own client."""
+    sns_client = SNSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION)
+    other_credentials = SNSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='other', aws_secret_access_key='other')
+    self.assertIsNot(sns_client._sns_client, other_credentials._sns_client)
+
+    pooled = SNSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, max_pool_connections=50)
+    self.assertIsNot(sns_client._sns_client, pooled._sns_client)
+    self.assertEqual(50, pooled._sns_client.meta.config.max_pool_connections)
+
+  def test_credentials(self):
+    """Check that the access key id is the one given."""
+    sns_client = SNSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='key_id', aws_secret_access_key='secret')
+    self.assertEqual('key_id', sns_client._sns_client._request_signer._credentials.access_key)
+
+  def test_fork(self):
+    """Check that the clients are not shared with a forked process."""
+    from paper_cup.client import ClientRegistry
+
+    registry = ClientRegistry()
+    client = registry.client('sns', PaperCup.PC_AWS_LOCAL_ENDPOINT, PaperCup.PC_AWS_REGION)
+    self.assertIs(client, registry.client('sns', PaperCup.PC_AWS_LOCAL_ENDPOINT, PaperCup.PC_AWS_REGION))
+    # act as if we were in a child process
+    registry._pid = -1
+    self.assertIsNot(client, registry.client('sns', PaperCup.PC_AWS_LOCAL_ENDPOINT, PaperCup.PC_AWS_REGION))
+
+  def test_shared_guard(self):
+    """Check that the clients of the same endpoint share the circuit breaker and retry budget."""
+    sns_client = SNSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION)
+    self.assertIs(sns_client.guard, SNSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, max_pool_connections=50).guard)
+    self.assertIsNot(sns_client.guard, SQSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION).guard)
+
+
+class TestRetryableErrors(TestCase):
+
+  def test_classification(self):
+    """Check that the throttling, 5xx and connection errors are retryable, not the others."""
+    from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+    from paper_cup.client import is_retryable_error, is_throttling_error
+
+    def client_error(code, status):
+      return ClientError({'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, 'Publish')
+
+    self.assertTrue(is_throttling_error(client_error('Throttling', 400)))
+    self.assertTrue(is_throttling_error(client_error('Other', 429)))
+    self.assertFalse(is_throttling_error(client_error('InternalError', 500)))
+    self.assertTrue(is_retryable_error(client_error('RequestThrottled', 400)))
+    self.assertTrue(is_retryable_error(client_error('Other', 503)))
+    self.assertTrue(is_retryable_error(EndpointConnectionError(endpoint_url='http://localhost')))
+    self.assertTrue(is_retryable_error(ReadTimeoutError(endpoint_url='http://localhost')))
+    self.assertFalse(is_retryable_error(client_error('NotFound', 404)))
+    self.assertFalse(is_retryable_error(ValueError()))
+
+
+def count_calls(test_case, boto_client, method_name):
+  """Wrap a method of the boto client and return the list of the calls done.
+
+    The boto clients are shared, the method is put back at the end of the test.
+  """
+  calls = []
+  method = getattr(boto_client, method_name)
+
+  def counted_method(*args, **kwargs):
+    calls.append(kwargs)
+    return method(*args, **kwargs)
+
+  setattr(boto_client, method_name, counted_method)
+  test_case.addCleanup(delattr, boto_client, method_name)
+  return calls
@@ -0,0 +1,116 @@
+# -*- coding:utf-8 -*-
+import unittest
+from unittest import TestCase
+
+from paper_cup import codec
+from paper_cup.codec import CODEC_ATTRIBUTE, MessageCodec, codec_attributes, decode, decode_body
+
+
+class TestMessageCodec(TestCase):
+
+  message = {'number': 1, 'name_kana': u'テスト太郎', 'data': 'x' * 2000, 'is_active': True, 'work': None}
+
+  def build(self, serializer='json', compression=None):
+    """Build the codec, skip the test if the optional package is missing."""
+    try:
+      return MessageCodec(serializer, compression=compression)
+    except ImportError as e:
+      raise unittest.SkipTest(str(e))
+
+  def round_trip(self, serializer, compression=None):
+    """Encode one message and an array of messages and check they are decoded as sent."""
+    message_codec = self.build(serializer, compression)
+
+    text, name = message_codec.encode(message_codec.dumps(self.message))
+    self.assertEqual(self.message, decode(text, name))
+
+    array = message_codec.join([message_codec.dumps(dict(self.message, number=i)) for i in range(20)])
+    text, name = message_codec.encode(array)
+    self.assertEqual(list(range(20)), [msg['number'] for msg in decode(text, name)])
+    return text, name
+
+  def test_json(self):
+    """Check that plain json is sent as is, without attributes."""
+    text, name = self.round_trip('json')
+    self.assertEqual('json', name)
+    self.assertEqual({}, codec_attributes(name))
+    # readable by a consumer without codec
+    self.assertEqual(20, len(decode(text)))
+
+  def test_orjson(self):
+    """Check the orjson serializer, sent as json to stay readable by any consumer."""
+    text, name = self.round_trip('orjson')
+    self.assertEqual('json', name)
+    self.assertEqual({}, codec_attributes(name))
+
+  def test_orjson_without_orjson(self):
+    """Check that the messages stamped orjson by the older publishers are read without orjson."""
+    self.addCleanup(setattr, codec, 'orjson', codec.orjson)
+    codec.orjson = None
+    self.assertEqual(self.message, decode(codec.json.dumps(self.message), 'orjson'))
+
+  def test_json_reader(self):
+    """Check that json is read by orjson when it is installed, the json it refuse by the standard json."""
+    if codec.orjson is None:
+      raise unittest.SkipTest('orjson is not installed.')
+    self.assertIsInstance(codec.get_reader('json'), codec.OrjsonSerializer)
+    self.assertEqual(self.message, decode(codec.json.dumps(self.message)))
+    self.assertEqual({'big': 2 ** 70}, decode('{"big": %d}' % 2 ** 70, 'json'))
+    with self.assertRaises(ValueError):
+      decode('{"not": json}')
+
+  def test_msgpack(self):
+    """Check the msgpack serializer, the array is built from the serialized messages."""
+    self.assertEqual('msgpack', self.round_trip('msgpack')[1])
+
+  def test_compression(self):
+    """Check the compressions, only the messages above the threshold are compressed."""
+    for serializer, compression in [('json', 'zlib'), ('msgpack', 'zlib'), ('json', 'zstd'), ('orjson', 'zstd')]:
+      text, name = self.round_trip(serializer, compression)
+      self.assertEqual(serializer.replace('orjson', 'json') + '+' + compression, name)
+      self.assertTrue(len(text) < 2000)
+      self.assertEqual({CODEC_ATTRIBUTE: {'DataType': 'String', 'StringValue': name}}, codec_attributes(name))
+
+    message_codec = self.build('json', 'zlib')
+    self.assertEqual('json', message_codec.encode(message_codec.dumps({'number': 1}))[1])
+
+  def test_decode_body(self):
+    """Check that the sqs body is decoded with or without the sns envelope."""
+    import json
+    message_codec = self.build('json', 'zlib')
+    text, name = message_codec.encode(message_codec.dumps(self.message))
+
+    envelope = json.dumps({
+        'Type': 'Notification', 'TopicArn': 'arn:aws:sns:ap-northeast-1:123456789012:topic', 'Message': text,
+        'MessageAttributes': {CODEC_ATTRIBUTE: {'Type': 'String', 'Value': name}},
+    })
+    self.assertEqual(self.message, decode_body(envelope))
+    # raw message delivery, the codec is in the sqs message attributes
+    self.assertEqual(self.message, decode_body(text, {CODEC_ATTRIBUTE: {'DataType': 'String', 'StringValue': name}}))
+    # raw plain json
+    self.assertEqual([self.message], decode_body(json.dumps([self.message]), None))
+    self.assertEqual({'Type': 'Notification'}, decode_body(json.dumps({'Type': 'Notification'})))
+
+  def test_max_raw_bytes(self):
+    """Check the size of the serialized messages packed for a sns message."""
+    self.assertEqual(1000, self.build('json').max_raw_bytes(1000))
+    self.assertEqual(750, self.build('msgpack').max_raw_bytes(1000))
+    self.assertEqual(3000, MessageCodec('json', compression='zlib', compression_ratio=4).max_raw_bytes(1000))
+
+  def test_unknown(self):
+    """Check that an unknown codec is refused."""
+    with self.assertRaises(ValueError):
+      MessageCodec('xml')
+    with self.assertRaises(ValueError):
+      MessageCodec('json', compression='lzma')
+
+  def test_missing_package(self):
+    """Check that a codec with a missing package fail when used."""
+    msgpack = codec.msgpack
+    codec.msgpack = None
+    codec._serializers.pop('msgpack', None)
+    try:
+      with self.assertRaises(ImportError):
+        MessageCodec('msgpack')
+    finally:
+      codec.msgpack = msgpack
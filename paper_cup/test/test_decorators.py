@@ -117,3 +117,125 @@ class TestDecorators(TestCase):
           return 'success'
 
     fails_once()
+
+  def test_retry_if(self):
+    """Check that the exceptions accepted by retry_if are retried too."""
+    self.counter = 0
+
+    @retry(RetryableError, retry_if=lambda e: str(e) == 'throttled', **self.FAST_MORE_RETRY)
+    def throttled_once():
+        self.counter += 1
+        if self.counter < 2:
+            raise UnexpectedError('throttled')
+        raise UnexpectedError('other')
+
+    with self.assertRaises(UnexpectedError):
+        throttled_once()
+    self.assertEqual(self.counter, 2)
+
+  def test_jitter(self):
+    """Check that the waits are random, up to the backoff and the max delay."""
+    from paper_cup.decorators import RetryCall
+
+    call = RetryCall(RetryableError, tries=10, delay=1, backoff=2, jitter='full', max_delay=3)
+    waits = []
+    for _ in range(9):
+      call.before()
+      waits.append(call.failed(RetryableError()))
+    call.before()
+    self.assertEqual(None, call.failed(RetryableError()))
+    self.assertTrue(all(0 <= wait <= 3 for wait in waits))
+    self.assertGreater(len(set(waits)), 1)
+
+    call = RetryCall(RetryableError, tries=10, delay=1, jitter='decorrelated', max_delay=30)
+    call.before()
+    self.assertTrue(1 <= call.failed(RetryableError()) <= 3)
+
+  def test_deadline(self):
+    """Check that there is no retry ending after the deadline."""
+    self.counter = 0
+
+    @retry(RetryableError, tries=10, delay=0.1, backoff=2, deadline=0.5)
+    def always_fails():
+        self.counter += 1
+        raise RetryableError('failed')
+
+    with self.assertRaises(RetryableError):
+        always_fails()
+    # waits of 0.1, 0.2 then 0.4 would end after 0.5 seconds
+    self.assertEqual(self.counter, 3)
+
+  def test_circuit_breaker(self):
+    """Check that the calls fail right away while the circuit is open, then a trial close it."""
+    import time
+    from paper_cup.decorators import CircuitBreaker, CircuitOpenError, RetryGuard
+
+    guard = RetryGuard(breaker=CircuitBreaker(failure_threshold=3, reset_timeout=0.2))
+    self.counter = 0
+
+    @retry(RetryableError, guard=lambda fail: guard, **self.FAST_MORE_RETRY)
+    def call(fail):
+        self.counter += 1
+        if fail:
+            raise RetryableError('failed')
+        return 'success'
+
+    with self.assertRaises(CircuitOpenError):
+        call(True)
+    self.assertEqual(self.counter, 3)
+    self.assertEqual('open', guard.breaker.state)
+    with self.assertRaises(CircuitOpenError):
+        call(False)
+    self.assertEqual(self.counter, 3)
+
+    time.sleep(0.2)
+    self.assertEqual('half_open', guard.breaker.state)
+    self.assertEqual('success', call(False))
+    self.assertEqual('closed', guard.breaker.state)
+
+  def test_circuit_breaker_trial(self):
+    """Check that the trial of a half open circuit is recorded on a client error, a throttling and a nested call."""
+    import time
+    from paper_cup.decorators import CircuitBreaker, RetryGuard
+
+    guard = RetryGuard(breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.1), throttled_if=lambda e: str(e) == 'throttled')
+
+    @retry(RetryableError, guard=lambda error=None: guard, **self.FAST_RETRY)
+    def call(error=None):
+        if error:
+            raise error
+        return 'success'
+
+    @retry(RetryableError, guard=lambda: guard, **self.FAST_RETRY)
+    def outer():
+        return call()
+
+    for error, result in [(UnexpectedError('client error'), UnexpectedError), (None, 'success'), (RetryableError('throttled'), RetryableError)]:
+        guard.breaker.failure()
+        self.assertEqual('open', guard.breaker.state)
+        time.sleep(0.1)
+        if error is None:
+            self.assertEqual(result, outer())
+        else:
+            with self.assertRaises(result):
+                call(error)
+        self.assertEqual('closed', guard.breaker.state)
+
+  def test_retry_budget(self):
+    """Check that the retries stop once the budget is spent."""
+    from paper_cup.decorators import RetryBudget, RetryGuard
+
+    guard = RetryGuard(budget=RetryBudget(ratio=0, min_retries=2))
+    self.counter = 0
+
+    @retry(RetryableError, guard=lambda: guard, **self.FAST_MORE_RETRY)
+    def always_fails():
+        self.counter += 1
+        raise RetryableError('failed')
+
+    with self.assertRaises(RetryableError):
+        always_fails()
+    with self.assertRaises(RetryableError):
+        always_fails()
+    self.assertEqual(self.counter, 4)
+    self.assertEqual({'calls': 2, 'retries': 2, 'exhausted': 2, 'available': 0}, guard.budget.as_dict())
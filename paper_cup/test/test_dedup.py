@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from paper_cup.dedup import Deduplicator, MemoryDedupStore, SQLiteDedupStore
+
+
+class TestMemoryDedupStore(TestCase):
+
+  def test_lru(self):
+    """Check that the least recently used keys are dropped above the max size."""
+    store = MemoryDedupStore(max_size=2)
+    store.add('a')
+    store.add('b')
+    self.assertTrue(store.contains('a'))
+    store.add('c')
+    self.assertTrue(store.contains('a'))
+    self.assertFalse(store.contains('b'))
+    self.assertEqual(2, len(store))
+
+  def test_ttl(self):
+    """Check that the keys expire."""
+    store = MemoryDedupStore(ttl=0.05)
+    store.add('a')
+    self.assertTrue(store.contains('a'))
+    time.sleep(0.1)
+    self.assertFalse(store.contains('a'))
+
+
+class TestSQLiteDedupStore(TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.directory)
+
+  def test_store(self):
+    """Check that the keys are kept in the file until they expire."""
+    path = os.path.join(self.directory, 'dedup.sqlite3')
+    store = SQLiteDedupStore(path)
+    store.add('a')
+    store.close()
+
+    store = SQLiteDedupStore(path, ttl=0.05)
+    self.assertTrue(store.contains('a'))
+    self.assertFalse(store.contains('b'))
+    store.add('b')
+    time.sleep(0.1)
+    self.assertFalse(store.contains('b'))
+    store.close()
+
+
+class TestDeduplicator(TestCase):
+
+  def test_counters(self):
+    """Check the keys of the items and the hit and miss counters."""
+    deduplicator = Deduplicator(MemoryDedupStore())
+    self.assertEqual('sns-id:1', deduplicator.key({'number': 1}, 1, 'sns-id'))
+    self.assertEqual('order-1', deduplicator.key({'idempotency_key': 'order-1'}, 1, 'sns-id'))
+
+    self.assertTrue(deduplicator.claim('order-1'))
+    # in progress
+    self.assertFalse(deduplicator.claim('order-1'))
+    deduplicator.release('order-1', True)
+    self.assertFalse(deduplicator.claim('order-1'))
+
+    # failed, to consume again
+    self.assertTrue(deduplicator.claim('order-2'))
+    deduplicator.release('order-2', False)
+    self.assertTrue(deduplicator.claim('order-2'))
+    self.assertEqual({'hits': 2, 'misses': 3, 'hit_ratio': 0.4}, deduplicator.as_dict())
@@ -0,0 +1,83 @@
+from unittest import TestCase
+
+from paper_cup.paper_cup import ConsumePC
+
+
+class DispatchRootPC(ConsumePC):
+  """Root consumer without aws client."""
+  PC_ENABLE = False
+  PC_SERVICE_LISTEN = ['service', 'other_service']
+
+
+class ConsumeUserPC(DispatchRootPC):
+  """Consumer action class."""
+
+  result = []
+
+  def index(self, message):
+    """Store the action done."""
+    self.result.append(('index', message['number']))
+
+  def _private(self, message):
+    """Not an action."""
+
+
+class ConsumeAdminUserPC(ConsumeUserPC):
+  """Consumer action class that is not a direct subclass of the root consumer."""
+
+  def delete(self, message):
+    """Store the action done."""
+    self.result.append(('delete', message['number']))
+
+
+class TestDispatcher(TestCase):
+
+  def setUp(self):
+    """Reset the actions done."""
+    ConsumeUserPC.result = []
+    self.consumer = DispatchRootPC()
+    self.dispatcher = self.consumer._get_dispatcher()
+
+  def msg(self, number, action='index', consumer_action_class='ConsumeUserPC', sender='service'):
+    """Build a message."""
+    return {'number': number, 'action': action, 'consumer_action_class': consumer_action_class, 'sender': sender}
+
+  def test_routes(self):
+    """Check that all the subclass tree is routed."""
+    self.assertIn('ConsumeUserPC', self.dispatcher.routes)
+    self.assertIn('ConsumeAdminUserPC', self.dispatcher.routes)
+    self.assertEqual(['index'], sorted(self.dispatcher.routes['ConsumeUserPC']))
+    self.assertEqual(['delete', 'index'], sorted(self.dispatcher.routes['ConsumeAdminUserPC']))
+    self.assertEqual(frozenset(['service', 'other_service']), self.dispatcher.listen)
+
+  def test_dispatch(self):
+    """Check that the messages are handled by the bound action."""
+    self.consumer._consume_msg(self.msg(1))
+    self.consumer._consume_msg(self.msg(2, action='delete', consumer_action_class='ConsumeAdminUserPC', sender='other_service'))
+    self.assertEqual([('index', 1), ('delete', 2)], ConsumeUserPC.result)
+
+  def test_rejected(self):
+    """Check that the messages that can't be routed are counted."""
+    self.assertFalse(self.dispatcher.dispatch(self.msg(1, sender='unknown')))
+    self.assertFalse(self.dispatcher.dispatch(self.msg(2, consumer_action_class='ConsumeUnknownPC')))
+    self.assertFalse(self.dispatcher.dispatch(self.msg(3, action='delete')))
+    # private and base class methods are not actions
+    self.assertFalse(self.dispatcher.dispatch(self.msg(4, action='_private')))
+    self.assertFalse(self.dispatcher.dispatch(self.msg(5, action='consume')))
+
+    self.assertEqual([], ConsumeUserPC.result)
+    self.assertEqual({'sender': 1, 'consumer_action_class': 1, 'action': 3}, self.dispatcher.rejected)
+
+  def test_built_once(self):
+    """Check that the table is built once, and again when a new consumer class is defined."""
+    self.assertIs(self.dispatcher, self.consumer._get_dispatcher())
+
+    class ConsumeLatePC(DispatchRootPC):
+      """Consumer defined after the table."""
+
+      def index(self, message):
+        """Do nothing."""
+
+    dispatcher = self.consumer._get_dispatcher()
+    self.assertIsNot(self.dispatcher, dispatcher)
+    self.assertIn('ConsumeLatePC', dispatcher.routes)
@@ -0,0 +1,57 @@
+from unittest import TestCase
+
+from paper_cup.failures import ConsumeReport, FailureHandler
+
+
+class DummySQSClient(object):
+  """Store the sent messages instead of sending them."""
+
+  def __init__(self, fail=False):
+    self.sent = []
+    self.fail = fail
+
+  def send_message_batch(self, queue_name, entries):
+    if self.fail:
+      raise RuntimeError('sqs down')
+    self.sent.append((queue_name, entries))
+    return {'Successful': [{'Id': entry['Id']} for entry in entries]}
+
+
+class DummyMessage(object):
+  """Received sqs message."""
+  message_id = 'message-id'
+
+
+class TestFailureHandler(TestCase):
+
+  def test_retry_delay(self):
+    """Check that the retry count is in the payload and the delay doubled at each retry."""
+    sqs_client = DummySQSClient()
+    handler = FailureHandler(sqs_client, 'queue', max_retries=5, retry_delay=10)
+    self.assertTrue(handler.handle(DummyMessage(), [({'number': 1}, ValueError()), ({'number': 2, 'pc_retries': 2}, ValueError())]))
+
+    queue_name, entries = sqs_client.sent[0]
+    self.assertEqual('queue', queue_name)
+    self.assertEqual(['{"number": 1, "pc_retries": 1}', '{"number": 2, "pc_retries": 3}'], [entry['MessageBody'] for entry in entries])
+    self.assertEqual([10, 40], [entry['DelaySeconds'] for entry in entries])
+
+  def test_not_requeued(self):
+    """Check that the message is kept when a failed item can't be requeued."""
+    handler = FailureHandler(DummySQSClient(fail=True), 'queue')
+    self.assertFalse(handler.handle(DummyMessage(), [({'number': 1}, ValueError())]))
+    self.assertEqual(['left'], [failed_item.outcome for failed_item in handler.report.failed])
+
+    # a message that can't be decoded has nothing to requeue
+    handler = FailureHandler(DummySQSClient(), 'queue')
+    self.assertFalse(handler.handle(DummyMessage(), [(None, ValueError())]))
+
+  def test_report(self):
+    """Check the summary of the report."""
+    report = ConsumeReport()
+    report.add_received(2)
+    report.add_items(3)
+    handler = FailureHandler(DummySQSClient(), 'queue', max_retries=0, report=report)
+    handler.handle(DummyMessage(), [({'number': 1}, ValueError())])
+
+    self.assertEqual(2, report.succeeded)
+    self.assertEqual({'received': 2, 'succeeded': 2, 'failed': 1, 'retry': 0, 'dead_letter': 0, 'dropped': 1, 'left': 0}, report.as_dict())
@@ -0,0 +1,121 @@
+import hashlib
+import threading
+import time
+from unittest import TestCase
+
+from paper_cup.fifo import GroupBlockedError, chunk_deduplication_id, content_id, field_id, is_fifo, valid_id
+from paper_cup.workers import WorkerPool
+
+
+class DummyMessage(object):
+  """Received sqs message."""
+
+  def __init__(self, message_id):
+    self.message_id = message_id
+
+
+class DummyConsumer(object):
+  """Consumer storing the consumed numbers, slowly."""
+
+  def __init__(self):
+    self.result = []
+    self.lock = threading.Lock()
+
+  def _consume_msg(self, msg):
+    time.sleep(0.01 * (3 - msg['number'] % 3))
+    if msg.get('fail'):
+      raise ValueError(msg['number'])
+    with self.lock:
+      self.result.append((msg['group'], msg['number']))
+
+
+class TestFifoIds(TestCase):
+
+  def test_ids(self):
+    """Check that the ids are the field values when they are valid, else their hash."""
+    self.assertTrue(is_fifo('orders.fifo'))
+    self.assertFalse(is_fifo('orders'))
+    self.assertEqual('user-1', field_id({'kind': 'user', 'id': 1}, ['kind', 'id']))
+    self.assertEqual(64, len(field_id({'name': 'with space'}, ['name'])))
+    self.assertEqual(64, len(valid_id('x' * 129)))
+    self.assertEqual(hashlib.sha256(u'caf\xe9-1'.encode('utf-8')).hexdigest(), field_id({'group': u'caf\xe9', 'id': 1}, ['group', 'id']))
+    self.assertEqual(content_id(b'{"a": 1}'), content_id(b'{"a": 1}'))
+    self.assertEqual('a', chunk_deduplication_id(['a']))
+    self.assertNotEqual(chunk_deduplication_id(['a', 'b']), chunk_deduplication_id(['b', 'a']))
+
+
+class TestWorkerPoolOrdered(TestCase):
+
+  def test_order(self):
+    """Check that the messages of a group are consumed in order while the groups run in parallel."""
+    consumer = DummyConsumer()
+    pool = WorkerPool(consumer, 3)
+    for group in ['a', 'b', 'c']:
+      messages = [(DummyMessage(number), [{'group': group, 'number': number}, {'group': group, 'number': number + 100}]) for number in range(3)]
+      pool.submit_ordered(messages)
+    pool.shutdown()
+
+    for group in ['a', 'b', 'c']:
+      self.assertEqual([0, 100, 1, 101, 2, 102], [number for result_group, number in consumer.result if result_group == group])
+    self.assertEqual([], pool.errors)
+
+  def test_blocked(self):
+    """Check that after a failure the next messages of the group are not consumed."""
+    consumer = DummyConsumer()
+    done = []
+    pool = WorkerPool(consumer, 2, on_done=lambda message, failures: done.append((message.message_id, failures)))
+    pool.submit_ordered([
+        (DummyMessage(0), [{'group': 'a', 'number': 0, 'fail': True}, {'group': 'a', 'number': 1}]),
+        (DummyMessage(1), [{'group': 'a', 'number': 2}]),
+    ])
+    pool.submit_ordered([(DummyMessage(2), [{'group': 'b', 'number': 3}])])
+    pool.shutdown()
+
+    self.assertEqual([('b', 3)], consumer.result)
+    failures = dict(done)
+    self.assertEqual([ValueError, GroupBlockedError], [type(error) for _, error in failures[0]])
+    self.assertEqual([GroupBlockedError], [type(error) for _, error in failures[1]])
+    self.assertEqual([], failures[2])
+
+  def test_concurrent_groups(self):
+    """Check that two callers submitting groups don't hold part of the slots waiting for each other."""
+    consumer = DummyConsumer()
+    pool = WorkerPool(consumer, 4, max_in_flight=4)
+
+    def submit(group):
+      for number in range(0, 60, 3):
+        pool.submit_ordered([(DummyMessage(n), [{'group': group, 'number': n}]) for n in range(number, number + 3)])
+
+    threads = [threading.Thread(target=submit, args=(group,)) for group in ['a', 'b']]
+    for thread in threads:
+      thread.daemon = True
+      thread.start()
+    for thread in threads:
+      thread.join(20)
+    self.assertFalse(any(thread.is_alive() for thread in threads))
+    pool.shutdown()
+    self.assertEqual(120, len(consumer.result))
+
+
+class BrokenFuture(object):
+  """Future done at once, the executor fail after calling it callback."""
+
+  def exception(self):
+    return None
+
+  def add_done_callback(self, fn):
+    fn(self)
+    raise RuntimeError('cannot schedule new futures after shutdown')
+
+
+class TestWorkerPoolSubmit(TestCase):
+
+  def test_submit_error(self):
+    """Check that the slot of a message is freed once when the executor fail after running it action."""
+    done = []
+    pool = WorkerPool(DummyConsumer(), 1, max_in_flight=1, on_done=lambda message, failures: done.append(message.message_id))
+    pool._task = lambda msg: BrokenFuture()
+    with self.assertRaises(RuntimeError):
+      pool.submit(DummyMessage(0), [{'group': 'a', 'number': 0}])
+    self.assertEqual(([0], 0, 1), (done, pool.in_flight, pool.available()))
+    pool.shutdown()
@@ -0,0 +1,59 @@
+import time
+from unittest import TestCase
+
+from paper_cup import PaperCup
+from paper_cup.client import SQSClient
+from paper_cup.heartbeat import Heartbeat
+
+
+class TestHeartbeat(TestCase):
+
+  def setUp(self):
+    """Create a queue with some messages."""
+    self.sqs_client = SQSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test')
+    self.sqs_client.create_queue(PaperCup.PC_SQS_QUEUE)
+    self.sqs_client.queue = self.sqs_client.get_queue_by_name(PaperCup.PC_SQS_QUEUE)
+
+    for i in range(15):
+      self.sqs_client.queue.send_message(MessageBody=str(i))
+
+  def tearDown(self):
+    """Remove the queue."""
+    self.sqs_client.delete_queue(PaperCup.PC_SQS_QUEUE)
+
+  def receive(self, visibility_timeout):
+    """Receive all the visible messages."""
+    received = []
+    messages = self.sqs_client.queue.receive_messages(MaxNumberOfMessages=10, VisibilityTimeout=visibility_timeout)
+    while messages:
+      received.extend(messages)
+      messages = self.sqs_client.queue.receive_messages(MaxNumberOfMessages=10, VisibilityTimeout=visibility_timeout)
+    return received
+
+  def test_extend_visibility(self):
+    """Check that the tracked messages don't come back in the queue, and the others do."""
+    messages = self.receive(1)
+    self.assertEqual(15, len(messages))
+
+    heartbeat = Heartbeat(self.sqs_client, PaperCup.PC_SQS_QUEUE, visibility_timeout=1, interval=0.3)
+    heartbeat.add(messages)
+    heartbeat.remove(messages[0])
+    # wait for more than the visibility timeout
+    time.sleep(2)
+    self.assertEqual([messages[0].body], [message.body for message in self.receive(30)])
+
+    # once closed the messages come back after their visibility timeout
+    heartbeat.close()
+    time.sleep(1.5)
+    self.assertEqual(14, len(self.receive(30)))
+
+  def test_release(self):
+    """Check that the released messages are visible right away."""
+    messages = self.receive(30)
+    heartbeat = Heartbeat(self.sqs_client, PaperCup.PC_SQS_QUEUE, visibility_timeout=30)
+    heartbeat.add(messages)
+    heartbeat.release(messages[:5])
+    heartbeat.close()
+
+    self.assertEqual(sorted(message.body for message in messages[:5]), sorted(message.body for message in self.receive(30)))
+    self.assertEqual(10, len(heartbeat._messages))
@@ -0,0 +1,168 @@
+import json
+import threading
+import time
+from unittest import TestCase
+
+from botocore.exceptions import ClientError
+
+from paper_cup.client import S3Client, SNSClient, SQSClient
+from paper_cup.memory import MemoryBroker, MemoryS3Client, MemorySNSClient, MemorySQSClient, filter_policy_match
+
+
+class TestMemoryQueue(TestCase):
+
+  def setUp(self):
+    """Queue of a broker of it own."""
+    self.sqs = MemorySQSClient('ap-northeast-1', MemoryBroker())
+    self.url = self.sqs.create_queue(QueueName='queue')['QueueUrl']
+
+  def receive(self, **kwargs):
+    return self.sqs.receive_message(QueueUrl=self.url, MaxNumberOfMessages=10, **kwargs).get('Messages', [])
+
+  def test_visibility_timeout(self):
+    """Check that a received message come back after it visibility timeout unless deleted."""
+    self.sqs.send_message_batch(QueueUrl=self.url, Entries=[{'Id': str(i), 'MessageBody': str(i)} for i in range(3)])
+    messages = self.receive(VisibilityTimeout=1)
+    self.assertEqual(['0', '1', '2'], [message['Body'] for message in messages])
+    self.assertEqual([], self.receive())
+
+    response = self.sqs.delete_message_batch(QueueUrl=self.url, Entries=[{'Id': '0', 'ReceiptHandle': messages[0]['ReceiptHandle']}])
+    self.assertEqual(['0'], [entry['Id'] for entry in response['Successful']])
+    self.sqs.change_message_visibility_batch(QueueUrl=self.url, Entries=[{'Id': '1', 'ReceiptHandle': messages[1]['ReceiptHandle'], 'VisibilityTimeout': 0}])
+    self.assertEqual(['1'], [message['Body'] for message in self.receive()])
+
+    time.sleep(1)
+    again = self.receive(AttributeNames=['All'])
+    self.assertEqual(['2'], [message['Body'] for message in again])
+    self.assertEqual('2', again[0]['Attributes']['ApproximateReceiveCount'])
+
+    # the receipt handle of the first receive is not valid anymore
+    response = self.sqs.change_message_visibility_batch(QueueUrl=self.url, Entries=[{'Id': '2', 'ReceiptHandle': messages[2]['ReceiptHandle'], 'VisibilityTimeout': 0}])
+    self.assertEqual(['ReceiptHandleIsInvalid'], [entry['Code'] for entry in response['Failed']])
+
+  def test_long_polling(self):
+    """Check that a waiting receive get the message sent meanwhile, and that the delayed messages wait."""
+    threading.Timer(0.2, self.sqs.send_message, kwargs={'QueueUrl': self.url, 'MessageBody': 'late'}).start()
+    started_at = time.time()
+    self.assertEqual(['late'], [message['Body'] for message in self.receive(WaitTimeSeconds=5)])
+    self.assertLess(time.time() - started_at, 1)
+
+    self.sqs.send_message(QueueUrl=self.url, MessageBody='delayed', DelaySeconds=1)
+    self.assertEqual([], self.receive())
+    self.assertEqual('1', self.sqs.get_queue_attributes(QueueUrl=self.url, AttributeNames=['All'])['Attributes']['ApproximateNumberOfMessagesDelayed'])
+    self.assertEqual(['delayed'], [message['Body'] for message in self.receive(WaitTimeSeconds=2)])
+
+  def test_fifo(self):
+    """Check that the messages of a group are received in order, one batch in flight at a time, and deduplicated."""
+    url = self.sqs.create_queue(QueueName='queue.fifo', Attributes={'FifoQueue': 'true'})['QueueUrl']
+    for body, group in [('a1', 'a'), ('b1', 'b'), ('a2', 'a'), ('a2', 'a')]:
+      self.sqs.send_message(QueueUrl=url, MessageBody=body, MessageGroupId=group, MessageDeduplicationId=body)
+
+    first = self.sqs.receive_message(QueueUrl=url, MaxNumberOfMessages=1)['Messages']
+    self.assertEqual(['a1'], [message['Body'] for message in first])
+    # a2 wait for a1
+    second = self.sqs.receive_message(QueueUrl=url, MaxNumberOfMessages=10)['Messages']
+    self.assertEqual(['b1'], [message['Body'] for message in second])
+    self.sqs.delete_message(QueueUrl=url, ReceiptHandle=first[0]['ReceiptHandle'])
+    self.assertEqual(['a2'], [message['Body'] for message in self.sqs.receive_message(QueueUrl=url, MaxNumberOfMessages=10)['Messages']])
+
+  def test_redrive(self):
+    """Check that a message received too many times is moved to the dead letter queue."""
+    dead_letter_url = self.sqs.create_queue(QueueName='dead_letter')['QueueUrl']
+    dead_letter_arn = self.sqs.get_queue_attributes(QueueUrl=dead_letter_url, AttributeNames=['QueueArn'])['Attributes']['QueueArn']
+    self.sqs.set_queue_attributes(QueueUrl=self.url, Attributes={'RedrivePolicy': json.dumps({'deadLetterTargetArn': dead_letter_arn, 'maxReceiveCount': 1})})
+
+    self.sqs.send_message(QueueUrl=self.url, MessageBody='poison')
+    self.assertEqual(1, len(self.receive(VisibilityTimeout=0)))
+    self.assertEqual([], self.receive())
+    self.assertEqual(['poison'], [message['Body'] for message in self.sqs.receive_message(QueueUrl=dead_letter_url)['Messages']])
+
+  def test_not_found(self):
+    """Check that a deleted queue give the error of sqs."""
+    self.sqs.delete_queue(QueueUrl=self.url)
+    with self.assertRaises(ClientError) as context:
+      self.receive()
+    self.assertEqual('AWS.SimpleQueueService.NonExistentQueue', context.exception.response['Error']['Code'])
+
+
+class TestMemoryTopic(TestCase):
+
+  def test_subscriptions(self):
+    """Check that the published messages go to the matching subscriptions, in an envelope or raw."""
+    broker = MemoryBroker()
+    sns = MemorySNSClient('ap-northeast-1', broker)
+    sqs = MemorySQSClient('ap-northeast-1', broker)
+    topic_arn = sns.create_topic(Name='topic')['TopicArn']
+    urls = {}
+    for name in ('all', 'raw', 'filtered'):
+      urls[name] = sqs.create_queue(QueueName=name)['QueueUrl']
+
+    def arn(name):
+      return sqs.get_queue_attributes(QueueUrl=urls[name], AttributeNames=['QueueArn'])['Attributes']['QueueArn']
+
+    sns.subscribe(TopicArn=topic_arn, Protocol='sqs', Endpoint=arn('all'))
+    sns.subscribe(TopicArn=topic_arn, Protocol='sqs', Endpoint=arn('raw'), Attributes={'RawMessageDelivery': 'true'})
+    sns.subscribe(TopicArn=topic_arn, Protocol='sqs', Endpoint=arn('filtered'), Attributes={'FilterPolicy': json.dumps({'action': ['delete']})})
+
+    attributes = {'action': {'DataType': 'String', 'StringValue': 'index'}}
+    message_id = sns.publish(TopicArn=topic_arn, Message='{"a": 1}', MessageAttributes=attributes)['MessageId']
+
+    envelope = json.loads(sqs.receive_message(QueueUrl=urls['all'])['Messages'][0]['Body'])
+    self.assertEqual(('Notification', message_id, '{"a": 1}'), (envelope['Type'], envelope['MessageId'], envelope['Message']))
+    self.assertEqual({'action': {'Type': 'String', 'Value': 'index'}}, envelope['MessageAttributes'])
+    raw = sqs.receive_message(QueueUrl=urls['raw'], MessageAttributeNames=['All'])['Messages'][0]
+    self.assertEqual(('{"a": 1}', attributes), (raw['Body'], raw['MessageAttributes']))
+    self.assertEqual({}, sqs.receive_message(QueueUrl=urls['filtered']))
+
+  def test_filter_policy(self):
+    """Check the filter policy rules."""
+    attributes = {
+        'sender': {'DataType': 'String', 'StringValue': 'shop'},
+        'action': {'DataType': 'String.Array', 'StringValue': '["index", "delete"]'},
+    }
+    self.assertTrue(filter_policy_match({'sender': ['shop', 'blog'], 'action': ['delete']}, attributes))
+    self.assertTrue(filter_policy_match({'sender': [{'prefix': 'sh'}], 'other': [{'exists': False}]}, attributes))
+    self.assertFalse(filter_policy_match({'sender': [{'anything-but': ['shop']}]}, attributes))
+    self.assertFalse(filter_policy_match({'other': ['x']}, attributes))
+
+
+class TestMemoryTransport(TestCase):
+
+  def test_clients(self):
+    """Check that SNSClient and SQSClient work on the memory transport, without moto."""
+    sns = SNSClient('http://nowhere', region='ap-northeast-1', transport='memory')
+    sqs = SQSClient('http://nowhere', region='ap-northeast-1', transport='memory')
+    self.assertIsInstance(sns._sns_client, MemorySNSClient)
+
+    sns.create_topic('memory_topic')
+    sqs.create_queue('memory_queue')
+    self.addCleanup(sns.delete_topic, 'memory_topic')
+    self.addCleanup(sqs.delete_queue, 'memory_queue')
+    sns.add_sqs_subscription('memory_topic', sqs.get_queue_arn('memory_queue'), raw=True)
+
+    sns.publish('hello', 'memory_topic')
+    queue = sqs.get_queue_by_name('memory_queue')
+    queue.reload()
+    self.assertEqual('1', queue.attributes['ApproximateNumberOfMessages'])
+    messages = queue.receive_messages(MaxNumberOfMessages=10)
+    self.assertEqual(['hello'], [message.body for message in messages])
+    sqs.delete_message_batch('memory_queue', [{'Id': '0', 'ReceiptHandle': messages[0].receipt_handle}])
+    self.assertEqual([], queue.receive_messages(VisibilityTimeout=0))
+
+  def test_s3(self):
+    """Check that S3Client work on the memory transport, the objects of the claim check."""
+    s3 = S3Client('http://nowhere', 'ap-northeast-1', transport='memory')
+    self.assertIsInstance(s3._s3_client, MemoryS3Client)
+    s3.create_bucket('memory_bucket')
+    self.addCleanup(s3._s3_client.broker.buckets.pop, 'memory_bucket')
+
+    s3.put_object('memory_bucket', 'key', b'payload')
+    response = s3.get_object('memory_bucket', 'key')
+    self.assertEqual((b'payload', 7), (response['Body'].read(), response['ContentLength']))
+    s3.delete_object('memory_bucket', 'key')
+    with self.assertRaises(ClientError) as context:
+      s3.get_object('memory_bucket', 'key')
+    self.assertEqual('NoSuchKey', context.exception.response['Error']['Code'])
+    with self.assertRaises(ClientError) as context:
+      s3.put_object('other_bucket', 'key', b'payload')
+    self.assertEqual('NoSuchBucket', context.exception.response['Error']['Code'])
@@ -0,0 +1,137 @@
+import socket
+from unittest import TestCase
+
+from botocore.exceptions import ClientError
+
+from paper_cup.client import SNSClient, SQSClient
+from paper_cup.decorators import RetryCall, RetryGuard
+from paper_cup.metrics import CallbackMetrics, PrometheusMetrics, StatsDMetrics
+from paper_cup.paper_cup import ConsumePC, PublishPC
+
+
+class MetricsRootPC(ConsumePC):
+  PC_SQS_QUEUE = 'metrics_queue'
+  PC_TRANSPORT = 'memory'
+
+
+class ConsumeMetricsPC(MetricsRootPC):
+
+  def index(self, message):
+    if message['fail']:
+      raise ValueError('fail')
+
+
+class PublishMetricsPC(PublishPC):
+  PC_SNS_TOPIC = 'metrics_topic'
+  PC_TRANSPORT = 'memory'
+
+
+class TestMetricsExporters(TestCase):
+
+  def test_prometheus(self):
+    """Check the prometheus text of the counters and histograms."""
+    metrics = PrometheusMetrics()
+    metrics.increment('published_messages', 2, {'topic': 'a'})
+    metrics.increment('published_messages', tags={'topic': 'a'})
+    metrics.observe('action_seconds', 0.02, {'action': 'index'})
+    metrics.observe('action_seconds', 3, {'action': 'index'})
+
+    lines = metrics.render().splitlines()
+    self.assertIn('# TYPE paper_cup_published_messages_total counter', lines)
+    self.assertIn('paper_cup_published_messages_total{topic="a"} 3', lines)
+    self.assertIn('# TYPE paper_cup_action_seconds histogram', lines)
+    self.assertIn('paper_cup_action_seconds_bucket{action="index",le="0.01"} 0', lines)
+    self.assertIn('paper_cup_action_seconds_bucket{action="index",le="0.025"} 1', lines)
+    self.assertIn('paper_cup_action_seconds_bucket{action="index",le="+Inf"} 2', lines)
+    self.assertIn('paper_cup_action_seconds_sum{action="index"} 3.02', lines)
+    self.assertIn('paper_cup_action_seconds_count{action="index"} 2', lines)
+
+  def test_statsd(self):
+    """Check the statsd lines sent over udp."""
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.addCleanup(server.close)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(1)
+    metrics = StatsDMetrics(port=server.getsockname()[1])
+    self.addCleanup(metrics.close)
+
+    metrics.increment('empty_receives', tags={'queue': 'q'})
+    metrics.observe('action_seconds', 0.25)
+    metrics.observe('receive_batch_size', 10)
+    lines = [server.recv(1024).decode('utf-8') for _ in range(3)]
+    self.assertEqual(['paper_cup.empty_receives:1|c|#queue:q', 'paper_cup.action:250|ms', 'paper_cup.receive_batch_size:10|h'], lines)
+
+
+class TestMetricsHooks(TestCase):
+
+  def setUp(self):
+    """Topic subscribed by the queue on the memory transport, the metrics kept in `events`."""
+    self.events = []
+    self.metrics = CallbackMetrics(lambda kind, name, value, tags: self.events.append((name, value, tags)))
+    for cls in (MetricsRootPC, PublishMetricsPC):
+      cls.PC_METRICS = self.metrics
+      self.addCleanup(setattr, cls, 'PC_METRICS', None)
+
+    sns = SNSClient(MetricsRootPC.PC_AWS_LOCAL_ENDPOINT, region=MetricsRootPC.PC_AWS_REGION, transport='memory')
+    sqs = SQSClient(MetricsRootPC.PC_AWS_LOCAL_ENDPOINT, region=MetricsRootPC.PC_AWS_REGION, transport='memory')
+    sns.create_topic(PublishMetricsPC.PC_SNS_TOPIC)
+    sqs.create_queue(MetricsRootPC.PC_SQS_QUEUE)
+    self.addCleanup(sns.delete_topic, PublishMetricsPC.PC_SNS_TOPIC)
+    self.addCleanup(sqs.delete_queue, MetricsRootPC.PC_SQS_QUEUE)
+    sns.add_sqs_subscription(PublishMetricsPC.PC_SNS_TOPIC, sqs.get_queue_arn(MetricsRootPC.PC_SQS_QUEUE), raw=True)
+
+  def values(self, name):
+    return [value for event_name, value, _ in self.events if event_name == name]
+
+  def test_publish_and_consume(self):
+    """Check the metrics of the publishing and consume of messages, one of them failing."""
+    publisher = PublishMetricsPC()
+    publisher.publish({'fail': False}, 'index')
+    publisher.bulk_publish([{'fail': False}, {'fail': True}], ['index'] * 2, mode='batch')
+    self.assertEqual([1, 2], self.values('published_messages'))
+    self.assertEqual(2, len(self.values('publish_seconds')))
+    self.assertEqual(3, len(self.values('serialize_seconds')))
+
+    MetricsRootPC.PC_MAX_RETRIES = 0
+    self.addCleanup(setattr, MetricsRootPC, 'PC_MAX_RETRIES', 3)
+    report = MetricsRootPC().consume()
+    self.assertEqual((2, 1), (report.succeeded, len(report.failed)))
+    self.assertEqual(3, sum(self.values('received_messages')))
+    self.assertEqual([1], self.values('empty_receives'))
+    self.assertEqual(3, len(self.values('action_seconds')))
+    self.assertEqual([1], self.values('action_errors'))
+    lags = self.values('consume_lag_seconds')
+    self.assertEqual(3, len(lags))
+    self.assertTrue(all(0 <= lag < 5 for lag in lags))
+    action_tags = [tags for name, _, tags in self.events if name == 'action_seconds']
+    self.assertEqual({'consumer': 'ConsumeMetricsPC', 'action': 'index'}, action_tags[0])
+
+  def test_disabled(self):
+    """Check that nothing is measured without PC_METRICS, the messages are still stamped."""
+    PublishMetricsPC.PC_METRICS = MetricsRootPC.PC_METRICS = None
+    message = PublishMetricsPC()._add_more_data({}, 'index')
+    self.assertIsInstance(message['pc_published_at'], float)
+    PublishMetricsPC().publish({'fail': False}, 'index')
+    MetricsRootPC().consume()
+    self.assertEqual([], self.events)
+
+  def test_app_published_at(self):
+    """Check that a published_at field of the app is not overwritten by the publishing time."""
+    message = PublishMetricsPC()._add_more_data({'published_at': '2020-01-01'}, 'index')
+    self.assertEqual('2020-01-01', message['published_at'])
+    self.assertIsInstance(message['pc_published_at'], float)
+
+  def test_fifo_deduplication(self):
+    """Check that the publishing time is not part of the content deduplication id."""
+    publisher = PublishMetricsPC(sns_client=object())
+    publisher.PC_SNS_TOPIC = 'metrics_topic.fifo'
+    _, first_ids = publisher._serialize(publisher._add_more_data({'a': 1}, 'index'))
+    _, second_ids = publisher._serialize(dict(publisher._add_more_data({'a': 1}, 'index'), pc_published_at=0))
+    self.assertEqual(first_ids, second_ids)
+
+  def test_retries(self):
+    """Check that the retries are counted with the tags of the guard."""
+    call = RetryCall(ClientError, tries=3, delay=0, guard=RetryGuard(metrics=self.metrics, tags={'service': 'sns'}), name='publish')
+    call.before()
+    self.assertEqual(0, call.failed(ClientError({'Error': {'Code': 'Throttling'}}, 'Publish')))
+    self.assertEqual([('retries', 1, {'service': 'sns', 'call': 'publish'})], self.events)
@@ -0,0 +1,148 @@
+import json
+import threading
+import time
+from unittest import TestCase
+
+from paper_cup.multi_queue import CapacityScheduler, MultiQueueConsumePC
+
+
+class TestCapacityScheduler(TestCase):
+
+  def test_reserved(self):
+    """Check that the slots are reserved by weight, at least one by queue."""
+    scheduler = CapacityScheduler(10, {'high': 3, 'low': 1, 'tiny': 0.01})
+    self.assertEqual({'high': 7, 'low': 2, 'tiny': 1}, scheduler.reserved)
+
+  def test_idle_queue(self):
+    """Check that a queue can use all the slots while the others are idle."""
+    scheduler = CapacityScheduler(10, {'high': 3, 'low': 1})
+    self.assertEqual(10, scheduler.available('low'))
+    scheduler.acquire('low', 10)
+    self.assertEqual(0, scheduler.available('low'))
+    self.assertEqual(0, scheduler.available('high'))
+
+    # the slots freed by the flood go back to the high queue as soon as it is active
+    scheduler.release('low', 3)
+    scheduler.acquire('high', 1)
+    self.assertEqual(2, scheduler.available('high'))
+    self.assertEqual(0, scheduler.available('low'))
+
+  def test_active_queue(self):
+    """Check that the reserve of an active queue is not taken by the others."""
+    scheduler = CapacityScheduler(10, {'high': 3, 'low': 1}, active_for=60)
+    scheduler.acquire('high', 1)
+    scheduler.release('high')
+    self.assertEqual(3, scheduler.available('low'))
+    self.assertEqual(10, scheduler.available('high'))
+
+    scheduler.acquire('low', 3)
+    self.assertEqual(7, scheduler.available('high'))
+    self.assertEqual(0, scheduler.available('low'))
+
+    # the queue is not active anymore
+    scheduler._active_at['high'] = time.time() - 61
+    self.assertEqual(7, scheduler.available('low'))
+
+
+class TestMultiQueueConsumePC(TestCase):
+
+  def setUp(self):
+    """Create the queues."""
+    from paper_cup.client import SQSClient
+    from paper_cup.paper_cup import PaperCup
+
+    self.sqs = SQSClient(endpoint_url=PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test')
+    for queue_name in MultiRootPC.PC_SQS_QUEUES:
+      self.sqs.create_queue(queue_name)
+      self.addCleanup(self.sqs.delete_queue, queue_name)
+    ConsumeMultiPC.result = []
+
+  def send(self, queue_name, priority, count):
+    """Send `count` raw messages to the queue."""
+    for i in range(0, count, 10):
+      entries = [
+          {'Id': str(j), 'MessageBody': json.dumps({
+              'priority': priority, 'number': i + j, 'sender': 'service', 'consumer_action_class': 'ConsumeMultiPC', 'action': 'index',
+          })}
+          for j in range(min(10, count - i))
+      ]
+      self.sqs.send_message_batch(queue_name, entries)
+
+  def test_consume(self):
+    """Check that a flood on the low weight queue doesn't starve the high weight one."""
+    self.send('queue_multi_low', 'low', 40)
+    self.send('queue_multi_high', 'high', 4)
+
+    consumer = MultiRootPC()
+    consumer.PC_POLL_MAX_WAIT_TIME = 1
+    report = consumer.consume(workers=2)
+
+    self.assertEqual(44, report.received)
+    self.assertEqual(44, report.succeeded)
+    priorities = [priority for priority, _ in ConsumeMultiPC.result]
+    self.assertEqual(4, priorities.count('high'))
+    self.assertEqual(40, priorities.count('low'))
+    # the high messages are not consumed after the flood
+    self.assertLess(len(priorities) - priorities[::-1].index('high'), 25)
+
+    for queue_name in MultiRootPC.PC_SQS_QUEUES:
+      self.assertEqual([], consumer.sqs_clients[queue_name].queue.receive_messages())
+
+  def test_consume_error(self):
+    """Check that the failed items are requeued in their queue."""
+    self.send('queue_multi_high', 'fail', 1)
+
+    consumer = MultiRootPC()
+    consumer.PC_MAX_RETRIES = 1
+    consumer.PC_POLL_MAX_WAIT_TIME = 1
+    report = consumer.consume(workers=2)
+    # retried from the high queue then dropped
+    self.assertEqual(['retry', 'dropped'], [failed_item.outcome for failed_item in report.failed])
+
+  def test_run_forever_stopped_before(self):
+    """Check that a consumer stopped before run_forever doesn't receive from any queue."""
+    consumer = MultiRootPC()
+    consumer.stop()
+    reports = []
+    thread = threading.Thread(target=lambda: reports.append(consumer.run_forever(workers=2)))
+    thread.daemon = True
+    thread.start()
+    thread.join(10)
+    self.addCleanup(consumer.stop)
+
+    self.assertFalse(thread.is_alive())
+    self.assertEqual(0, reports[0].received)
+    self.assertEqual([0, 0], [poller.stats.receives for poller in consumer.pollers.values()])
+
+  def test_consume_missing_queue(self):
+    """Check that consume raise the receive error of a deleted queue instead of receiving it forever."""
+    from botocore.exceptions import ClientError
+
+    consumer = MultiRootPC()
+    consumer.PC_POLL_MAX_WAIT_TIME = 1
+    self.sqs.delete_queue('queue_multi_low')
+    try:
+      with self.assertRaises(ClientError):
+        consumer.consume(workers=2)
+    finally:
+      self.sqs.create_queue('queue_multi_low')
+
+
+# ################ Dummy consumer of several queues
+
+class MultiRootPC(MultiQueueConsumePC):
+  """Root consumer of the two queues."""
+  PC_SQS_QUEUES = {'queue_multi_high': 3, 'queue_multi_low': 1}
+
+
+class ConsumeMultiPC(MultiRootPC):
+  """Dummy consumer that store the message priorities."""
+
+  result = []
+
+  def index(self, message):
+    """Store the message priority, slowly."""
+    if message['priority'] == 'fail':
+      raise ValueError(message['number'])
+    time.sleep(0.05)
+    self.result.append((message['priority'], message['number']))
@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+from paper_cup.codec import JsonSerializer
+from paper_cup.packer import MessagePacker, PublishResult
+
+
+class TestMessagePacker(TestCase):
+
+  def pack(self, packer, payloads):
+    """Add all the payloads and return the list of chunks."""
+    chunks = [packer.add(i, payload) for i, payload in enumerate(payloads)]
+    chunks.append(packer.flush())
+    return [chunk for chunk in chunks if chunk]
+
+  def test_json_array_size(self):
+    """Check that the size counted incrementally is the size of the json array."""
+    serializer = JsonSerializer()
+    payloads = [serializer.dumps({'number': i, 'data': 'x' * i}) for i in range(50)]
+    chunks = self.pack(MessagePacker.array(500, serializer), payloads)
+
+    self.assertTrue(len(chunks) > 1)
+    for chunk in chunks:
+      array = serializer.join(chunk.payloads)
+      self.assertEqual(len(array), chunk.size)
+      self.assertTrue(chunk.size <= 500)
+
+    # all the messages are kept, in order
+    self.assertEqual(list(range(50)), [msg['number'] for chunk in chunks for msg in serializer.loads(serializer.join(chunk.payloads))])
+
+  def test_sns_batch_count(self):
+    """Check that a batch has at most 10 entries."""
+    chunks = self.pack(MessagePacker.sns_batch(256000), [b'{}'] * 25)
+    self.assertEqual([10, 10, 5], [len(chunk.items) for chunk in chunks])
+    self.assertEqual([20, 20, 10], [chunk.size for chunk in chunks])
+
+  def test_message_too_large(self):
+    """Check that a message over the limit get a chunk for itself."""
+    chunks = self.pack(MessagePacker.sns_batch(10), [b'12345', b'1' * 20, b'12345'])
+    self.assertEqual([[0], [1], [2]], [[key for key, _ in chunk.items] for chunk in chunks])
+    self.assertEqual(20, chunks[1].size)
+
+  def test_publish_result(self):
+    """Check the success flag of the result."""
+    self.assertTrue(PublishResult(0, 'id', None).success)
+    self.assertFalse(PublishResult(0, None, ValueError()).success)
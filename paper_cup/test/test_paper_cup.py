@@ -1,6 +1,8 @@
 # -*- coding:utf-8 -*-
 from unittest import TestCase
 
+from paper_cup.paper_cup import ConsumePC as _ConsumePC, PublishPC as _PublishPC
+
 
 class TestPaperCup(TestCase):
 
@@ -9,13 +11,13 @@ class TestPaperCup(TestCase):
     from paper_cup.client import SNSClient, SQSClient
     from paper_cup.paper_cup import PaperCup, ConsumePC, PublishPC
 
-    sqs = SQSClient(endpoint_url=PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test')
+    sqs = SQSClient(endpoint_url=PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test', transport=PaperCup.PC_TRANSPORT)
     try:
       sqs.create_queue(PaperCup.PC_SQS_QUEUE)
     except Exception:
       pass # if it fail it's because the queue already exist
 
-    sns = SNSClient(endpoint_url=PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test')
+    sns = SNSClient(endpoint_url=PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test', transport=PaperCup.PC_TRANSPORT)
     sns.create_topic(PaperCup.PC_SNS_TOPIC)
 
     self.consumer = ConsumePC()
@@ -30,12 +32,31 @@ class TestPaperCup(TestCase):
     self.consumer.sqs_client.delete_queue(PaperCup.PC_SQS_QUEUE)
     self.publisher.sns_client.delete_topic(PaperCup.PC_SNS_TOPIC)
 
+  def receive_all(self):
+    """Receive all the messages of the queue."""
+    sqs_msgs = []
+    messages = self.consumer.sqs_client.queue.receive_messages(MaxNumberOfMessages=10)
+    while messages:
+      sqs_msgs.extend(messages)
+      messages = self.consumer.sqs_client.queue.receive_messages(MaxNumberOfMessages=10)
+    return sqs_msgs
+
   def test_consume_instance(self):
     """Check that the Consume instance initialize correctly."""
     # check that we correctly set sqs
     self.assertTrue(self.consumer.sqs_client)
     self.assertTrue(self.consumer.sqs_client.queue)
 
+  def test_consume_shared_client(self):
+    """Check that the consumer action classes use the client of the consumer."""
+    from paper_cup.paper_cup import ConsumePC
+
+    class ConsumeSharedPC(ConsumePC):
+      """Dummy consumer action class."""
+
+    consumers = self.consumer._get_dispatcher().consumers
+    self.assertIs(self.consumer.sqs_client, consumers['ConsumeSharedPC'].sqs_client)
+
   def test_publish_instance(self):
     """Check that the Publish instance initialize correctly."""
     # check that we correctly set sns and sqs sessions
@@ -58,6 +79,67 @@ class TestPaperCup(TestCase):
     # check that Message content is a list of messages
     self.assertTrue(isinstance(msg, list))
 
+  def test_bulk_publish_split(self):
+    """Check that the messages are split in several sns messages under the size limit."""
+    import json
+    from paper_cup.paper_cup import PublishPC
+
+    class PublishSmallPC(PublishPC):
+      """Publisher with a small message limit."""
+      PC_SNS_MAX_MESSAGE_BYTES = 1000
+
+    list_message = [DummyAppMessage(number=i, data='x' * 200) for i in range(10)]
+    results = PublishSmallPC().bulk_publish(list_message, ['index'] * 10)
+
+    self.assertEqual(list(range(10)), [result.index for result in results])
+    self.assertTrue(all(result.success for result in results))
+
+    msgs = []
+    sqs_msgs = self.receive_all()
+    self.assertTrue(len(sqs_msgs) > 1)
+    for sqs_msg in sqs_msgs:
+      self.assertTrue(len(json.loads(sqs_msg.body)['Message']) <= 1000)
+      msgs.extend(json.loads(json.loads(sqs_msg.body)['Message']))
+
+    # each message is sent once, with the data to find it consumer
+    self.assertEqual(list(range(10)), sorted(msg['number'] for msg in msgs))
+    self.assertTrue(all(msg['consumer_action_class'] == 'ConsumeSmallPC' for msg in msgs))
+
+  def test_bulk_publish_too_large(self):
+    """Check that a message over the limit is reported as failed without stopping the others."""
+    results = self.publisher.bulk_publish([DummyAppMessage(), DummyAppMessage(data='x' * 300000)], ['index', 'index'])
+    self.assertTrue(results[0].success)
+    self.assertFalse(results[1].success)
+    self.assertTrue(isinstance(results[1].error, ValueError))
+
+  def test_bulk_publish_batch(self):
+    """Check the sns publish_batch mode, one sns message by message."""
+    import json
+    import unittest
+
+    if not hasattr(self.publisher.sns_client._sns_client, 'publish_batch'):
+      raise unittest.SkipTest('sns publish_batch need boto3 >= 1.20.5')
+
+    list_message = [DummyAppMessage(number=i) for i in range(12)]
+    results = self.publisher.bulk_publish(list_message, ['index'] * 12, mode='batch')
+    self.assertEqual(list(range(12)), [result.index for result in results])
+    self.assertTrue(all(result.message_id for result in results))
+
+    numbers = [json.loads(json.loads(sqs_msg.body)['Message'])['number'] for sqs_msg in self.receive_all()]
+    self.assertEqual(list(range(12)), sorted(numbers))
+
+  def test_buffered_publish(self):
+    """Check that the buffered publisher send the messages by batch."""
+    from paper_cup.paper_cup import PublishPC
+
+    publisher = PublishPC(buffered=True)
+    futures = [publisher.publish(DummyAppMessage(number=i), 'index') for i in range(20)]
+    publisher.close()
+
+    self.assertTrue(all(future.result() for future in futures))
+    # less sns messages than messages
+    self.assertTrue(len(self.receive_all()) < 20)
+
   def test_bulk_consume(self):
     """"Check that we can read bulk data."""
     from paper_cup.paper_cup import ConsumePC, PublishPC
@@ -99,6 +181,611 @@ class TestPaperCup(TestCase):
     self.assertEqual(dummy_consumer.result['index']['Band'], index_message['Band'])
     self.assertEqual(dummy_consumer.result['delete']['qwe'], delete_message['qwe'])
 
+  def test_publish_codec(self):
+    """Check that the messages published with another codec and compressed are consumed."""
+    import json
+    import unittest
+    from paper_cup.paper_cup import ConsumePC, PublishPC
+
+    try:
+      import msgpack  # noqa: F401
+    except ImportError:
+      raise unittest.SkipTest('msgpack codec need the msgpack package')
+
+    class PublishCodecPC(PublishPC):
+      """Publisher with msgpack and zlib compression."""
+      PC_CODEC = 'msgpack'
+      PC_COMPRESSION = 'zlib'
+      PC_SNS_MAX_MESSAGE_BYTES = 2000
+
+    class ConsumeCodecPC(ConsumePC):
+      """Dummy consumer that store the message numbers."""
+
+      result = []
+
+      def index(self, message):
+        """Store the message number."""
+        self.result.append(message['number'])
+
+    publisher = PublishCodecPC()
+    publisher.publish(DummyAppMessage(number=0, data='x' * 3000), 'index')
+    results = publisher.bulk_publish([DummyAppMessage(number=i, data='x' * 500) for i in range(1, 21)], ['index'] * 20)
+    self.assertTrue(all(result.success for result in results))
+
+    sqs_msgs = self.receive_all()
+    for sqs_msg in sqs_msgs:
+      body = json.loads(sqs_msg.body)
+      self.assertEqual('msgpack+zlib', body['MessageAttributes']['pc_codec']['Value'])
+      self.assertTrue(len(body['Message']) <= 2000)
+    # the compressed messages are packed more than the raw size allows
+    self.assertTrue(len(sqs_msgs) < 1 + 20 * 500 // 2000)
+
+    for sqs_msg in sqs_msgs:
+      sqs_msg.change_visibility(VisibilityTimeout=0)
+    ConsumePC().consume()
+    self.assertEqual(list(range(21)), sorted(ConsumeCodecPC.result))
+
+  def test_raw_message_delivery(self):
+    """Check that the messages of a raw subscription are consumed, with the envelope ones of a migration."""
+    import json
+    from paper_cup.client import SNSClient, SQSClient
+    from paper_cup.paper_cup import PaperCup
+
+    sqs = SQSClient(endpoint_url=PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test', transport=PaperCup.PC_TRANSPORT)
+    sns = SNSClient(endpoint_url=PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test', transport=PaperCup.PC_TRANSPORT)
+    sqs.create_queue(RawRootPC.PC_SQS_QUEUE)
+    sns.create_topic(PublishRawPC.PC_SNS_TOPIC)
+    self.addCleanup(sqs.delete_queue, RawRootPC.PC_SQS_QUEUE)
+    self.addCleanup(sns.delete_topic, PublishRawPC.PC_SNS_TOPIC)
+    sns.add_sqs_subscription(PublishRawPC.PC_SNS_TOPIC, sqs.get_queue_arn(RawRootPC.PC_SQS_QUEUE), raw=True)
+    # an envelope message sent before the migration
+    sns.add_sqs_subscription(PaperCup.PC_SNS_TOPIC, sqs.get_queue_arn(RawRootPC.PC_SQS_QUEUE))
+
+    publisher = PublishRawPC()
+    publisher.publish(DummyAppMessage(number=0), 'index')
+    publisher.bulk_publish([DummyAppMessage(number=i) for i in range(1, 4)], ['index'] * 3)
+    compressed_publisher = PublishRawPC()
+    compressed_publisher.PC_COMPRESSION = 'zlib'
+    compressed_publisher.publish(DummyAppMessage(number=4, data='x' * 2000), 'index')
+    envelope_publisher = PublishRawPC()
+    envelope_publisher.PC_SNS_TOPIC = PaperCup.PC_SNS_TOPIC
+    envelope_publisher.publish(DummyAppMessage(number=5), 'index')
+
+    consumer = RawRootPC()
+    bodies = [json.loads(message.body) for message in consumer.sqs_client.queue.receive_messages(MaxNumberOfMessages=10, VisibilityTimeout=0) if message.body.startswith('{')]
+    # the envelope message has it in the sns message
+    for body in bodies:
+      body.pop('pc_published_at', None)
+    self.assertIn(dict(DummyAppMessage(number=0), consumer_action_class='ConsumeRawPC', action='index', sender='service'), bodies)
+    self.assertTrue(any('TopicArn' in body for body in bodies))
+
+    ConsumeRawPC.result = []
+    consumer.consume()
+    self.assertEqual([0, 1, 2, 3, 4, 5], sorted(ConsumeRawPC.result))
+
+  def test_filter_policy(self):
+    """Check that the subscription filter policy only let our messages reach the queue."""
+    import json
+    from paper_cup.client import SQSClient
+    from paper_cup.paper_cup import PaperCup
+
+    sqs = SQSClient(endpoint_url=PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test', transport=PaperCup.PC_TRANSPORT)
+    sqs.create_queue(FilterRootPC.PC_SQS_QUEUE)
+    self.addCleanup(sqs.delete_queue, FilterRootPC.PC_SQS_QUEUE)
+
+    consumer = FilterRootPC()
+    self.assertEqual({'sender': ['service'], 'consumer_action_class': ['ConsumeFilterPC']}, consumer.filter_policy())
+    consumer.subscribe(self.publisher.sns_client, PaperCup.PC_SNS_TOPIC)
+
+    publisher = PublishFilterPC()
+    publisher.publish(DummyAppMessage(number=0), 'index')
+    publisher.bulk_publish([DummyAppMessage(number=1), DummyAppMessage(number=2)], ['index', 'delete'])
+    # not for our consumers
+    self.publisher.publish(DummyAppMessage(number=3), 'index')
+    other_sender = PublishFilterPC()
+    other_sender.PC_SERVICE_SENDER = 'other_service'
+    other_sender.publish(DummyAppMessage(number=4), 'index')
+
+    # the routing attributes are sent with the messages, an array of the actions for a bulk message
+    attributes = [json.loads(message.body)['MessageAttributes'] for message in self.receive_all()]
+    self.assertIn({'Type': 'String.Array', 'Value': '["delete", "index"]'}, [attribute['action'] for attribute in attributes])
+    self.assertIn({'Type': 'String', 'Value': 'other_service'}, [attribute['sender'] for attribute in attributes])
+
+    # only the single and the bulk sns messages for our consumers reached our queue
+    consumer.sqs_client.queue.reload()
+    self.assertEqual('2', consumer.sqs_client.queue.attributes['ApproximateNumberOfMessages'])
+
+    ConsumeFilterPC.result = []
+    consumer.consume()
+    self.assertEqual([0, 1, 2], sorted(ConsumeFilterPC.result))
+
+  def test_consume_error(self):
+    """Check that a failed item is retried alone then sent to the dead letter queue, without stopping the consume."""
+    import json
+    from paper_cup.client import SQSClient
+    from paper_cup.paper_cup import ConsumePC, PaperCup, PublishPC
+
+    class PublishRetryPC(PublishPC):
+      """Dummy Publish class for the failing consumer."""
+
+    class ConsumeRetryPC(ConsumePC):
+      """Dummy consumer that always fail on one message."""
+
+      result = []
+
+      def index(self, message):
+        """Fail on the message 1."""
+        if message['number'] == 1:
+          raise ValueError('failed')
+        self.result.append(message['number'])
+
+    sqs = SQSClient(endpoint_url=PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test', transport=PaperCup.PC_TRANSPORT)
+    sqs.create_queue('queue_dead_letter')
+    self.addCleanup(sqs.delete_queue, 'queue_dead_letter')
+
+    publisher = PublishRetryPC()
+    publisher.publish(DummyAppMessage(number=0), 'index')
+    # the message 2 is not retried with it failed sibling
+    publisher.bulk_publish([DummyAppMessage(number=1), DummyAppMessage(number=2)], ['index', 'index'])
+    publisher.publish(DummyAppMessage(number=3), 'index')
+
+    consumer = ConsumePC()
+    consumer.PC_MAX_RETRIES = 2
+    consumer.PC_DEAD_LETTER_QUEUE = 'queue_dead_letter'
+    report = consumer.consume()
+
+    self.assertEqual([0, 2, 3], sorted(ConsumeRetryPC.result))
+    # the item failed 3 times, retried twice then dead lettered
+    self.assertEqual(3, report.succeeded)
+    self.assertEqual([1, 2, 3], [failed_item.retries for failed_item in report.failed])
+    self.assertEqual(['retry', 'retry', 'dead_letter'], [failed_item.outcome for failed_item in report.failed])
+    self.assertTrue(all(isinstance(error, ValueError) for error in report.errors))
+
+    # all the messages are deleted, the failed item is in the dead letter queue
+    self.assertEqual([], self.receive_all())
+    dead_letters = sqs.get_queue_by_name('queue_dead_letter').receive_messages(MaxNumberOfMessages=10)
+    self.assertEqual([(1, 3)], [(json.loads(message.body)['number'], json.loads(message.body)['pc_retries']) for message in dead_letters])
+
+  def test_consume_long_action(self):
+    """Check that a message is not received again while it long action is running."""
+    from paper_cup.paper_cup import ConsumePC, PublishPC
+
+    class PublishLongPC(PublishPC):
+      """Dummy Publish class for the slow consumer."""
+
+    class ConsumeLongPC(ConsumePC):
+      """Dummy consumer with an action longer than the visibility timeout."""
+
+      result = []
+
+      def index(self, message):
+        """Wait then store the message number."""
+        import time
+        time.sleep(2)
+        self.result.append(message['number'])
+
+    PublishLongPC().publish(DummyAppMessage(number=0), 'index')
+    PublishLongPC().publish(DummyAppMessage(number=1), 'index')
+
+    consumer = ConsumePC()
+    consumer.PC_VISIBILITY_TIMEOUT = 1
+    consumer.PC_HEARTBEAT_INTERVAL = 0.3
+    consumer.consume(workers=2)
+    self.assertEqual([0, 1], sorted(ConsumeLongPC.result))
+    self.assertEqual([], self.receive_all())
+
+  def test_run_forever(self):
+    """Check that the consumer keep receiving when the queue is empty, until stopped."""
+    import threading
+    import time
+    from paper_cup.paper_cup import ConsumePC, PublishPC
+
+    class PublishForeverPC(PublishPC):
+      """Dummy Publish class for the long running consumer."""
+
+    class ConsumeForeverPC(ConsumePC):
+      """Dummy consumer that store the message numbers."""
+
+      result = []
+
+      def index(self, message):
+        """Store the message number."""
+        self.result.append(message['number'])
+
+    consumer = ConsumePC()
+    consumer.PC_POLL_MAX_WAIT_TIME = 1
+    reports = []
+    thread = threading.Thread(target=lambda: reports.append(consumer.run_forever(workers=2)))
+    thread.start()
+
+    publisher = PublishForeverPC()
+    for i in range(3):
+      time.sleep(0.5)
+      publisher.publish(DummyAppMessage(number=i), 'index')
+
+    deadline = time.time() + 10
+    while len(ConsumeForeverPC.result) < 3 and time.time() < deadline:
+      time.sleep(0.1)
+    consumer.stop()
+    thread.join()
+
+    self.assertEqual([0, 1, 2], sorted(ConsumeForeverPC.result))
+    self.assertEqual(3, reports[0].succeeded)
+    stats = consumer.poller.stats
+    self.assertEqual(3, stats.messages)
+    self.assertTrue(0 <= stats.empty_receive_ratio < 1)
+
+  def test_run_forever_stopped_before(self):
+    """Check that a consumer stopped before run_forever (a SIGTERM while starting) doesn't receive."""
+    import threading
+    from paper_cup.paper_cup import ConsumePC
+
+    consumer = ConsumePC()
+    consumer.stop()
+    reports = []
+    thread = threading.Thread(target=lambda: reports.append(consumer.run_forever(workers=2)))
+    thread.daemon = True
+    thread.start()
+    thread.join(10)
+    # don't leave it receiving if it was not stopped
+    self.addCleanup(consumer.stop)
+
+    self.assertFalse(thread.is_alive())
+    self.assertEqual(0, reports[0].received)
+    self.assertEqual(0, consumer.poller.stats.receives)
+
+  def test_run_forever_acknowledge(self):
+    """Check that with workers a batch of less than 10 messages is deleted once done, not consumed again."""
+    import threading
+    import time
+    from paper_cup.paper_cup import ConsumePC, PublishPC
+
+    class PublishAckPC(PublishPC):
+      """Dummy Publish class for the long running consumer."""
+
+    class ConsumeAckPC(ConsumePC):
+      """Dummy consumer that store the message numbers."""
+
+      result = []
+
+      def index(self, message):
+        """Store the message number."""
+        self.result.append(message['number'])
+
+    consumer = ConsumePC()
+    consumer.PC_POLL_MAX_WAIT_TIME = 1
+    consumer.PC_VISIBILITY_TIMEOUT = 1
+    thread = threading.Thread(target=consumer.run_forever, kwargs={'workers': 2})
+    thread.start()
+
+    publisher = PublishAckPC()
+    for i in range(3):
+      publisher.publish(DummyAppMessage(number=i), 'index')
+    deadline = time.time() + 10
+    while len(ConsumeAckPC.result) < 3 and time.time() < deadline:
+      time.sleep(0.1)
+    # the messages not deleted would come back after the visibility timeout
+    time.sleep(2.5)
+    consumer.stop()
+    thread.join()
+
+    self.assertEqual([0, 1, 2], sorted(ConsumeAckPC.result))
+    self.assertEqual([], self.receive_all())
+
+  def test_fifo(self):
+    """Check that the messages of a fifo topic are consumed in order by group and deduplicated."""
+    import unittest
+    from paper_cup.client import SNSClient, SQSClient
+    from paper_cup.paper_cup import PaperCup
+
+    sqs = SQSClient(endpoint_url=PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test', transport=PaperCup.PC_TRANSPORT)
+    sns = SNSClient(endpoint_url=PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test', transport=PaperCup.PC_TRANSPORT)
+    sqs.create_queue(FifoRootPC.PC_SQS_QUEUE)
+    if not sns.supports_fifo:
+      raise unittest.SkipTest('sns fifo topics need boto3 >= 1.16')
+    sns.create_topic(PublishFifoPC.PC_SNS_TOPIC)
+    self.addCleanup(sqs.delete_queue, FifoRootPC.PC_SQS_QUEUE)
+    self.addCleanup(sns.delete_topic, PublishFifoPC.PC_SNS_TOPIC)
+    sns.add_sqs_subscription(PublishFifoPC.PC_SNS_TOPIC, sqs.get_queue_arn(FifoRootPC.PC_SQS_QUEUE))
+
+    publisher = PublishFifoPC()
+    for number in range(6):
+      publisher.publish(DummyAppMessage(entity=number % 3, number=number), 'index')
+    # already published, deduplicated
+    publisher.publish(DummyAppMessage(entity=0, number=0), 'index')
+    messages = [DummyAppMessage(entity=number % 3, number=number) for number in range(6, 12)]
+    results = publisher.bulk_publish(messages, ['index'] * len(messages))
+    self.assertTrue(all(result.success for result in results))
+
+    ConsumeFifoPC.result = []
+    report = FifoRootPC().consume(workers=4)
+    self.assertEqual(12, report.succeeded)
+    for entity in range(3):
+      self.assertEqual(list(range(entity, 12, 3)), [number for result_entity, number in ConsumeFifoPC.result if result_entity == entity])
+
+    # a failure block the next messages of the group only
+    for number in range(6):
+      publisher.publish(DummyAppMessage(entity=number % 2, number=number, fail=number == 0), 'index')
+    ConsumeFifoPC.result = []
+    consumer = FifoRootPC()
+    consumer.PC_VISIBILITY_TIMEOUT = 1
+    report = consumer.consume(workers=4)
+    self.assertEqual([(1, 1), (1, 3), (1, 5)], ConsumeFifoPC.result)
+    self.assertEqual(['left', 'left', 'left'], [failed_item.outcome for failed_item in report.failed])
+
+  def test_consume_dedup(self):
+    """Check that the items already consumed are skipped, by sns message id or idempotency key."""
+    from paper_cup.paper_cup import ConsumePC, PublishPC
+
+    class PublishDedupPC(PublishPC):
+      """Dummy Publish class for the deduplicated consumer."""
+
+    class ConsumeDedupPC(ConsumePC):
+      """Dummy consumer that store the message numbers."""
+
+      result = []
+
+      def index(self, message):
+        """Store the message number."""
+        self.result.append(message['number'])
+
+    publisher = PublishDedupPC()
+    publisher.publish(DummyAppMessage(number=0), 'index')
+    # the sns message delivered twice
+    body = self.receive_all()[0].body
+    entries = [{'Id': str(i), 'MessageBody': body} for i in range(2)]
+    self.consumer.sqs_client.send_message_batch(self.consumer.PC_SQS_QUEUE, entries)
+    # published twice with the same idempotency key
+    for number in [1, 2]:
+      publisher.publish(DummyAppMessage(number=number, idempotency_key='key-1'), 'index')
+
+    consumer = ConsumePC()
+    consumer.PC_DEDUP_STORE = 'memory'
+    report = consumer.consume(workers=2)
+
+    self.assertEqual(1, ConsumeDedupPC.result.count(0))
+    self.assertEqual(1, ConsumeDedupPC.result.count(1) + ConsumeDedupPC.result.count(2))
+    self.assertEqual(2, report.succeeded)
+    self.assertEqual({'hits': 2, 'misses': 2, 'hit_ratio': 0.5}, consumer.deduplicator.as_dict())
+    self.assertEqual([], self.receive_all())
+
+  def test_consume_workers(self):
+    """Check that the actions are run by the thread pool and the messages deleted after."""
+    from paper_cup.paper_cup import ConsumePC, PublishPC
+
+    class PublishWorkerPC(PublishPC):
+      """Dummy Publish class for the worker consumer."""
+
+    class ConsumeWorkerPC(ConsumePC):
+      """Dummy consumer that store the threads that run the action."""
+
+      result = {}
+
+      def index(self, message):
+        """Store the message by it number and the thread that handled it."""
+        import threading
+        self.result[message['number']] = threading.current_thread().name
+
+    list_message = [DummyAppMessage(number=i) for i in range(30)]
+    publisher = PublishWorkerPC()
+    for i in range(0, 30, 5):
+      publisher.bulk_publish(list_message[i:i + 5], ['index'] * 5)
+
+    ConsumePC().consume(workers=4)
+
+    self.assertEqual(set(range(30)), set(ConsumeWorkerPC.result))
+    # the main thread don't run any action
+    self.assertNotIn('MainThread', ConsumeWorkerPC.result.values())
+    # all the messages are deleted
+    self.assertEqual([], self.consumer.sqs_client.queue.receive_messages(VisibilityTimeout=0))
+
+  def test_consume_prefetch(self):
+    """Check that all the messages are consumed when receiving in background."""
+    from paper_cup.paper_cup import ConsumePC, PublishPC
+
+    class PublishPrefetchPC(PublishPC):
+      """Dummy Publish class for the prefetch consumer."""
+
+    class ConsumePrefetchPC(ConsumePC):
+      """Dummy consumer that store the message numbers."""
+
+      result = []
+
+      def index(self, message):
+        """Store the message number."""
+        self.result.append(message['number'])
+
+    publisher = PublishPrefetchPC()
+    for i in range(25):
+      publisher.publish(DummyAppMessage(number=i), 'index')
+
+    ConsumePC().consume(prefetch=2)
+    self.assertEqual(list(range(25)), sorted(ConsumePrefetchPC.result))
+
+    # also with the workers
+    ConsumePrefetchPC.result = []
+    for i in range(25):
+      publisher.publish(DummyAppMessage(number=i), 'index')
+
+    ConsumePC().consume(prefetch=2, workers=4)
+    self.assertEqual(list(range(25)), sorted(ConsumePrefetchPC.result))
+
+  def test_consume_workers_error(self):
+    """Check that a failed item is requeued and reported while the other messages are consumed."""
+    from paper_cup.paper_cup import ConsumePC, PublishPC
+
+    class PublishFailPC(PublishPC):
+      """Dummy Publish class for the failing consumer."""
+
+    class ConsumeFailPC(ConsumePC):
+      """Dummy consumer that fail on one message."""
+
+      def index(self, message):
+        """Fail on the last message."""
+        if message['number'] == 2:
+          raise ValueError('failed')
+
+    publisher = PublishFailPC()
+    for i in range(3):
+      publisher.publish(DummyAppMessage(number=i), 'index')
+
+    consumer = ConsumePC()
+    consumer.PC_MAX_RETRIES = 1
+    report = consumer.consume(workers=2)
+
+    # retried once then dropped
+    self.assertEqual(4, report.received)
+    self.assertEqual(2, report.succeeded)
+    self.assertEqual(['retry', 'dropped'], [failed_item.outcome for failed_item in report.failed])
+    self.assertEqual([], self.receive_all())
+
+  def test_consume_prefetch_error(self):
+    """Check that with prefetch the requeued items are consumed like without it, with and without the workers."""
+    from paper_cup.paper_cup import ConsumePC, PublishPC
+
+    class PublishPrefetchFailPC(PublishPC):
+      """Dummy Publish class for the failing prefetch consumer."""
+
+    class ConsumePrefetchFailPC(ConsumePC):
+      """Dummy consumer that fail on one message."""
+
+      def index(self, message):
+        """Fail on the last message."""
+        if message['number'] == 2:
+          raise ValueError('failed')
+
+    publisher = PublishPrefetchFailPC()
+    for workers in [None, 2]:
+      for i in range(3):
+        publisher.publish(DummyAppMessage(number=i), 'index')
+
+      consumer = ConsumePC()
+      consumer.PC_MAX_RETRIES = 1
+      report = consumer.consume(workers=workers, prefetch=2)
+
+      self.assertEqual((4, 2), (report.received, report.succeeded))
+      self.assertEqual(['retry', 'dropped'], [failed_item.outcome for failed_item in report.failed])
+      self.assertEqual([], self.receive_all())
+
+  def test_consume_process_workers(self):
+    """Check that the actions can be run by a process pool."""
+    import os
+    import tempfile
+
+    result_dir = tempfile.mkdtemp()
+    os.environ['PC_TEST_RESULT_DIR'] = result_dir
+
+    publisher = PublishProcessPC()
+    for i in range(4):
+      publisher.publish(DummyAppMessage(number=i), 'index')
+
+    ProcessRootPC().consume(workers=2, executor='process')
+
+    self.assertEqual(['0', '1', '2', '3'], sorted(os.listdir(result_dir)))
+    # the actions are not run by this process
+    for number in range(4):
+      with open(os.path.join(result_dir, str(number))) as f:
+        self.assertNotEqual(str(os.getpid()), f.read())
+
+
+class TestPaperCupMemory(TestPaperCup):
+  """Same tests with the topics and queues in memory, without moto."""
+
+  def setUp(self):
+    """Use the memory transport."""
+    from paper_cup.paper_cup import PaperCup
+    PaperCup.PC_TRANSPORT = 'memory'
+    self.addCleanup(setattr, PaperCup, 'PC_TRANSPORT', 'aws')
+    super(TestPaperCupMemory, self).setUp()
+
+
+# ################ Dummy consumer for the process pool (must be importable)
+
+class PublishProcessPC(_PublishPC):
+  """Dummy Publish class for the process consumer."""
+
+
+class ProcessRootPC(_ConsumePC):
+  """Root consumer, its subclasses are the consumer action classes."""
+
+
+class ConsumeProcessPC(ProcessRootPC):
+  """Dummy consumer that write the pid of the process that handled the message."""
+
+  def index(self, message):
+    """Write one file by message."""
+    import os
+    with open(os.path.join(os.environ['PC_TEST_RESULT_DIR'], str(message['number'])), 'w') as f:
+      f.write(str(os.getpid()))
+
+
+class PublishRawPC(_PublishPC):
+  """Publisher to a topic with a raw message delivery subscription."""
+  PC_SNS_TOPIC = 'topic_raw'
+
+
+class RawRootPC(_ConsumePC):
+  """Root consumer of the raw queue."""
+  PC_SQS_QUEUE = 'queue_raw'
+
+
+class ConsumeRawPC(RawRootPC):
+  """Dummy consumer that store the message numbers."""
+
+  result = []
+
+  def index(self, message):
+    """Store the message number."""
+    self.result.append(message['number'])
+
+
+class PublishFilterPC(_PublishPC):
+  """Publisher to the consumer with a filter policy."""
+
+
+class FilterRootPC(_ConsumePC):
+  """Root consumer of the queue with a filter policy."""
+  PC_SQS_QUEUE = 'queue_filter'
+
+
+class ConsumeFilterPC(FilterRootPC):
+  """Dummy consumer that store the message numbers."""
+
+  result = []
+
+  def index(self, message):
+    """Store the message number."""
+    self.result.append(message['number'])
+
+  def delete(self, message):
+    """Store the message number."""
+    self.result.append(message['number'])
+
+
+class PublishFifoPC(_PublishPC):
+  """Publisher to a fifo topic, one message group by entity."""
+  PC_SNS_TOPIC = 'topic.fifo'
+  PC_MESSAGE_GROUP_FIELDS = ['entity']
+
+
+class FifoRootPC(_ConsumePC):
+  """Root consumer of the fifo queue."""
+  PC_SQS_QUEUE = 'queue.fifo'
+
+
+class ConsumeFifoPC(FifoRootPC):
+  """Dummy consumer that store the entity and number of the messages, the first ones slower."""
+
+  result = []
+
+  def index(self, message):
+    """Store the message entity and number."""
+    import time
+    if message.get('fail'):
+      raise ValueError('failed')
+    time.sleep(0.05 / (1 + message['number']))
+    self.result.append((message['entity'], message['number']))
+
 # ################ Dummy Data class
 
 
@@ -0,0 +1,98 @@
+from unittest import TestCase
+
+from paper_cup.polling import AdaptivePoller, PollStats
+
+
+class DummyQueue(object):
+  """Queue returning the prepared receives and storing the calls."""
+
+  def __init__(self, receives, depth=0):
+    self.receives = list(receives)
+    self.calls = []
+    self.attributes = {'ApproximateNumberOfMessages': str(depth)}
+
+  def reload(self):
+    pass
+
+  def receive_messages(self, **kwargs):
+    self.calls.append(kwargs)
+    receive = self.receives.pop(0) if self.receives else []
+    if isinstance(receive, Exception):
+      raise receive
+    return receive
+
+
+class DummySQSClient(object):
+  """Sqs client with the dummy queue."""
+
+  def __init__(self, queue):
+    self.queue = queue
+
+  def receive_messages(self, queue, **kwargs):
+    return queue.receive_messages(**kwargs)
+
+
+class TestAdaptivePoller(TestCase):
+
+  def poll(self, poller, count, capacity=None):
+    """Get the next `count` receives, empty or not."""
+    batches = []
+    for messages in poller.batches(capacity=capacity):
+      batches.append(messages)
+      if poller.stats.receives >= count:
+        poller.stop()
+    return batches
+
+  def test_wait_time(self):
+    """Check that the wait time grow after the empty receives and is reset by messages."""
+    queue = DummyQueue([['m1'], [], [], [], [], [], [], ['m2']])
+    poller = AdaptivePoller(DummySQSClient(queue), {'VisibilityTimeout': 30}, min_wait_time=1, max_wait_time=20, depth_interval=None)
+    self.poll(poller, 8)
+
+    self.assertEqual([20, 1, 2, 4, 8, 16, 20, 20], [call['WaitTimeSeconds'] for call in queue.calls])
+    self.assertTrue(all(call['VisibilityTimeout'] == 30 for call in queue.calls))
+
+  def test_backlog(self):
+    """Check that the receives don't wait when the queue has a backlog."""
+    queue = DummyQueue([['m'] * 10] * 3, depth=100)
+    poller = AdaptivePoller(DummySQSClient(queue), min_wait_time=1, depth_interval=60)
+    self.poll(poller, 3)
+    self.assertEqual([20, 0, 0], [call['WaitTimeSeconds'] for call in queue.calls])
+    self.assertEqual(100, poller.stats.queue_depth)
+
+  def test_capacity(self):
+    """Check that the batch size is limited by the capacity of the consumer."""
+    queue = DummyQueue([['m'] * 3] * 3)
+    poller = AdaptivePoller(DummySQSClient(queue), depth_interval=None)
+    capacities = [3, 0, 25, 7]
+    self.poll(poller, 3, capacity=lambda: capacities.pop(0))
+    self.assertEqual([3, 10, 7], [call['MaxNumberOfMessages'] for call in queue.calls])
+
+  def test_receive_error(self):
+    """Check that a receive error is raised when consuming until empty, logged and received again otherwise."""
+    queue = DummyQueue([ValueError('AccessDenied'), ['m']])
+    poller = AdaptivePoller(DummySQSClient(queue), min_wait_time=0.01, depth_interval=None, until_empty=True)
+    with self.assertRaises(ValueError):
+      list(poller.batches())
+
+    queue = DummyQueue([ValueError('AccessDenied'), ['m']])
+    poller = AdaptivePoller(DummySQSClient(queue), min_wait_time=0.01, depth_interval=None)
+    self.assertEqual([['m']], self.poll(poller, 1))
+    self.assertEqual(2, len(queue.calls))
+
+  def test_until_empty_drain(self):
+    """Check that until empty the queue is received once more after waiting for the actions in flight."""
+    queue = DummyQueue([['m'], [], ['requeued'], []])
+    drains = []
+    poller = AdaptivePoller(DummySQSClient(queue), min_wait_time=0, depth_interval=None, until_empty=True, drain=lambda: drains.append(len(queue.calls)))
+    self.assertEqual([['m'], ['requeued']], list(poller.batches()))
+    self.assertEqual(([2, 4], 5), (drains, len(queue.calls)))
+
+  def test_stats(self):
+    """Check the empty receive ratio on the last receives."""
+    stats = PollStats(window=4)
+    self.assertEqual(0, stats.empty_receive_ratio)
+    for count in [0, 0, 0, 5, 0, 5]:
+      stats.add(count)
+    self.assertEqual(0.5, stats.empty_receive_ratio)
+    self.assertEqual({'receives': 6, 'empty_receives': 4, 'messages': 10, 'queue_depth': None, 'empty_receive_ratio': 0.5}, stats.as_dict())
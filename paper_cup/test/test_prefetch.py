@@ -0,0 +1,67 @@
+import time
+from unittest import TestCase
+
+from paper_cup import PaperCup
+from paper_cup.client import SQSClient
+from paper_cup.prefetch import Prefetcher
+
+
+class TestPrefetcher(TestCase):
+
+  def setUp(self):
+    """Create a queue with some messages."""
+    self.sqs_client = SQSClient(PaperCup.PC_AWS_LOCAL_ENDPOINT, region=PaperCup.PC_AWS_REGION, aws_access_key_id='test', aws_secret_access_key='test')
+    self.sqs_client.create_queue(PaperCup.PC_SQS_QUEUE)
+    self.sqs_client.queue = self.sqs_client.get_queue_by_name(PaperCup.PC_SQS_QUEUE)
+
+    for i in range(25):
+      self.sqs_client.queue.send_message(MessageBody=str(i))
+
+  def tearDown(self):
+    """Remove the queue."""
+    self.sqs_client.delete_queue(PaperCup.PC_SQS_QUEUE)
+
+  def test_receive_all(self):
+    """Check that all the messages are received, batch by batch."""
+    prefetcher = Prefetcher(self.sqs_client, PaperCup.PC_SQS_QUEUE, depth=2)
+    bodies = []
+    for messages in prefetcher:
+      self.assertTrue(len(messages) <= 10)
+      bodies.extend(message.body for message in messages)
+    prefetcher.close()
+
+    self.assertEqual(sorted(str(i) for i in range(25)), sorted(bodies))
+
+  def test_prefetch_in_background(self):
+    """Check that the next batches are received while the current one is consumed."""
+    prefetcher = Prefetcher(self.sqs_client, PaperCup.PC_SQS_QUEUE, depth=2)
+    batches = iter(prefetcher)
+    next(batches)
+    time.sleep(0.5)
+    # the buffer is full
+    self.assertEqual(2, prefetcher._batches.qsize())
+    prefetcher.close()
+
+  def test_extend_visibility(self):
+    """Check that the buffered messages don't come back in the queue before being consumed."""
+    prefetcher = Prefetcher(self.sqs_client, PaperCup.PC_SQS_QUEUE, depth=1, visibility_timeout=2, extend_after=0.5)
+    batches = iter(prefetcher)
+    next(batches)
+    # wait for more than the visibility timeout
+    time.sleep(3)
+    buffered = set(message.body for batch in prefetcher._buffered for message in batch.messages)
+    self.assertTrue(buffered)
+    self.assertFalse(buffered & self.receive_visible())
+
+    # once closed the buffered messages are visible again
+    prefetcher.close()
+    self.assertEqual(buffered, self.receive_visible())
+
+  def receive_visible(self):
+    """Receive all the visible messages and return their bodies."""
+    bodies = set()
+    messages = self.sqs_client.queue.receive_messages(MaxNumberOfMessages=10, VisibilityTimeout=30)
+    while messages:
+      bodies.update(message.body for message in messages)
+      messages = self.sqs_client.queue.receive_messages(MaxNumberOfMessages=10, VisibilityTimeout=30)
+    return bodies
@@ -0,0 +1,152 @@
+import threading
+import time
+from unittest import TestCase
+
+from botocore.exceptions import ClientError
+
+from paper_cup.client import SNSClient
+from paper_cup.paper_cup import PublishPC
+from paper_cup.ratelimit import RateLimiter
+
+
+class DummySNSClient(object):
+  """Sns client storing the published messages, throttling the first ones."""
+
+  def __init__(self, throttles=0):
+    self.messages = []
+    self.throttles = throttles
+
+  def publish(self, message, topic_name, attributes=None, group_id=None, deduplication_id=None):
+    if self.throttles:
+      self.throttles -= 1
+      raise ClientError({'Error': {'Code': 'Throttling'}, 'ResponseMetadata': {'HTTPStatusCode': 400}}, 'Publish')
+    self.messages.append(message)
+    return {'MessageId': str(len(self.messages))}
+
+
+class ThrottlingSNS(object):
+  """Boto3 sns client throttling the first publish calls."""
+
+  def __init__(self, throttles):
+    self.throttles = throttles
+    self.calls = 0
+
+  def publish(self, **kwargs):
+    self.calls += 1
+    if self.calls <= self.throttles:
+      raise ClientError({'Error': {'Code': 'Throttling'}, 'ResponseMetadata': {'HTTPStatusCode': 400}}, 'Publish')
+    return {'MessageId': str(self.calls)}
+
+
+def throttling_sns_client(topic_name, throttles):
+  """SNSClient of the memory transport on a boto3 client throttling the first calls, the retries of it are the ones of SNSClient."""
+  sns_client = SNSClient(PublishPC.PC_AWS_LOCAL_ENDPOINT, region=PublishPC.PC_AWS_REGION, transport='memory')
+  sns_client._sns_client = ThrottlingSNS(throttles)
+  sns_client._topic_arns.set(topic_name, 'arn:aws:sns:%s:123456789012:%s' % (PublishPC.PC_AWS_REGION, topic_name))
+  return sns_client
+
+
+class TestRateLimiter(TestCase):
+
+  def test_try_acquire(self):
+    """Check that the tokens of both limits are taken together or not at all."""
+    limiter = RateLimiter(messages_per_second=10, bytes_per_second=100)
+    self.assertTrue(limiter.try_acquire(5, 90))
+    self.assertFalse(limiter.try_acquire(1, 20))
+    # the message tokens were not taken
+    self.assertTrue(limiter.try_acquire(5, 10))
+    self.assertFalse(limiter.try_acquire(1, 0))
+    self.assertGreater(limiter.wait_time(1, 0), 0)
+
+  def test_oversized(self):
+    """Check that a message bigger than the bytes per second is sent once the bucket is full."""
+    limiter = RateLimiter(bytes_per_second=100)
+    self.assertTrue(limiter.try_acquire(1, 250))
+    self.assertFalse(limiter.try_acquire(1, 1))
+
+  def test_acquire_threads(self):
+    """Check that the threads sharing the limiter don't go over the rate."""
+    limiter = RateLimiter(messages_per_second=50)
+
+    def publish():
+      for _ in range(25):
+        limiter.acquire()
+
+    started_at = time.time()
+    threads = [threading.Thread(target=publish) for _ in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    # 100 messages, the first 50 right away then 50 per second
+    self.assertGreaterEqual(time.time() - started_at, 0.9)
+    self.assertFalse(limiter.acquire(timeout=0))
+
+  def test_aimd(self):
+    """Check that the rate is halved on throttling and raised back without."""
+    limiter = RateLimiter(messages_per_second=100)
+    limiter.throttled()
+    limiter.throttled()
+    # lowered once for the calls throttled together
+    self.assertEqual(50, limiter.as_dict()['messages_per_second'])
+
+    limiter._adjusted_at -= 1
+    limiter.throttled()
+    self.assertEqual(25, limiter.as_dict()['messages_per_second'])
+    self.assertEqual(3, limiter.throttles)
+
+    limiter._adjusted_at -= 2
+    limiter.succeeded()
+    self.assertAlmostEqual(45, limiter.as_dict()['messages_per_second'], delta=1)
+
+    for _ in range(10):
+      limiter._adjusted_at -= 10
+      limiter.succeeded()
+    self.assertEqual(100, limiter.as_dict()['messages_per_second'])
+
+
+class TestPublishRateLimit(TestCase):
+
+  def test_shared(self):
+    """Check that the publishers of a topic share the limiter and the ones of a class scope their own."""
+    first = RateLimitedPublishPC(sns_client=DummySNSClient())
+    self.assertIs(first.rate_limiter, RateLimitedPublishPC(sns_client=DummySNSClient()).rate_limiter)
+    self.assertIsNot(first.rate_limiter, ClassRateLimitedPublishPC(sns_client=DummySNSClient()).rate_limiter)
+    self.assertIsNone(PublishPC(sns_client=DummySNSClient()).rate_limiter)
+
+  def test_throttled(self):
+    """Check that the throttling errors lower the rate of the publisher."""
+    sns_client = DummySNSClient(throttles=1)
+    publisher = ClassRateLimitedPublishPC(sns_client=sns_client)
+
+    with self.assertRaises(ClientError):
+      publisher.publish({'number': 1}, 'index')
+    self.assertEqual(500, publisher.rate_limiter.as_dict()['messages_per_second'])
+
+    results = publisher.bulk_publish([{'number': i} for i in range(3)], ['index'] * 3)
+    self.assertEqual([None] * 3, [result.error for result in results])
+
+  def test_throttled_retries(self):
+    """Check that each throttled attempt is told to the rate limiter, also when a retry of the sns client succeed."""
+    sns_client = throttling_sns_client(RetryRateLimitedPublishPC.PC_SNS_TOPIC, throttles=2)
+    publisher = RetryRateLimitedPublishPC(sns_client=sns_client)
+
+    self.assertEqual({'MessageId': '3'}, publisher.publish({'number': 1}, 'index'))
+    self.assertEqual(2, publisher.rate_limiter.throttles)
+    self.assertEqual(500, publisher.rate_limiter.as_dict()['messages_per_second'])
+
+
+class RateLimitedPublishPC(PublishPC):
+  """Publisher limited by topic."""
+  PC_SNS_TOPIC = 'topic_rate_limited'
+  PC_PUBLISH_RATE_LIMIT = 1000
+
+
+class ClassRateLimitedPublishPC(RateLimitedPublishPC):
+  """Publisher limited by class."""
+  PC_PUBLISH_RATE_LIMIT_SCOPE = 'class'
+
+
+class RetryRateLimitedPublishPC(RateLimitedPublishPC):
+  """Publisher limited by class, on the sns client with retries."""
+  PC_PUBLISH_RATE_LIMIT_SCOPE = 'class'
@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from paper_cup.client import SQSClient
+from paper_cup.paper_cup import ConsumePC
+from paper_cup.supervisor import Supervisor, desired_processes, load_consumer
+
+
+class SupervisedRootPC(ConsumePC):
+  PC_SQS_QUEUE = 'supervised_queue'
+  PC_POLL_MIN_WAIT_TIME = 0
+  PC_POLL_MAX_WAIT_TIME = 1
+
+
+class ConsumeSupervisedPC(SupervisedRootPC):
+
+  def work(self, message):
+    """Slow action leaving a file once done."""
+    open(message['path'] + '.started', 'w').close()
+    time.sleep(1)
+    open(message['path'] + '.done', 'w').close()
+
+
+def exit_worker(*args):
+  """Worker process crashing at once."""
+  sys.exit(3)
+
+
+def idle_worker(*args):
+  """Worker process waiting to be terminated."""
+  time.sleep(60)
+
+
+class ScaledSupervisor(Supervisor):
+  """Supervisor of idle workers with a given queue depth."""
+
+  depth = 0
+
+  def queue_depth(self):
+    return self.depth
+
+
+def wait_for(condition, timeout=20):
+  """Wait until the condition is true, False after the timeout."""
+  deadline = time.time() + timeout
+  while not condition():
+    if time.time() > deadline:
+      return False
+    time.sleep(0.05)
+  return True
+
+
+class TestSupervisor(TestCase):
+
+  def run_supervisor(self, supervisor):
+    """Run the supervisor in a thread, stopped at the end of the test."""
+    thread = threading.Thread(target=supervisor.run)
+    thread.start()
+    self.addCleanup(thread.join)
+    self.addCleanup(supervisor.stop)
+    return thread
+
+  def test_load_consumer(self):
+    """Check the dotted paths of the consumer class."""
+    self.assertIs(SupervisedRootPC, load_consumer('paper_cup.test.test_supervisor.SupervisedRootPC'))
+    self.assertIs(SupervisedRootPC, load_consumer('paper_cup.test.test_supervisor:SupervisedRootPC'))
+    with self.assertRaises(ValueError):
+      load_consumer('SupervisedRootPC')
+
+  def test_desired_processes(self):
+    """Check the number of processes for the queue depth, within the limits."""
+    self.assertEqual(1, desired_processes(0, 100, 1, 4))
+    self.assertEqual(2, desired_processes(101, 100, 1, 4))
+    self.assertEqual(4, desired_processes(10000, 100, 1, 4))
+    self.assertIsNone(desired_processes(None, 100, 1, 4))
+
+  def test_restart(self):
+    """Check that the crashed processes are restarted."""
+    supervisor = Supervisor(SupervisedRootPC, restart_delay=0, target=exit_worker)
+    self.run_supervisor(supervisor)
+    self.assertTrue(wait_for(lambda: supervisor.restarts >= 2))
+
+  def test_scale(self):
+    """Check that the processes follow the queue depth, stopped one at a time."""
+    supervisor = ScaledSupervisor(SupervisedRootPC, processes=1, max_processes=3, messages_per_process=10, scale_interval=0, drain_timeout=5, target=idle_worker)
+    supervisor.depth = 25
+    self.run_supervisor(supervisor)
+    self.assertTrue(wait_for(lambda: len(supervisor.processes) == 3))
+
+    supervisor.depth = 0
+    self.assertTrue(wait_for(lambda: supervisor.wanted == 1 and len(supervisor.processes) == 1))
+    self.assertEqual(0, supervisor.restarts)
+
+  def test_drain(self):
+    """Check that on stop the action in progress is finished and it message deleted."""
+    sqs_client = SQSClient(SupervisedRootPC.PC_AWS_LOCAL_ENDPOINT, region=SupervisedRootPC.PC_AWS_REGION)
+    sqs_client.create_queue(SupervisedRootPC.PC_SQS_QUEUE)
+    self.addCleanup(sqs_client.delete_queue, SupervisedRootPC.PC_SQS_QUEUE)
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    path = os.path.join(directory, 'message')
+    body = {'path': path, 'consumer_action_class': 'ConsumeSupervisedPC', 'action': 'work', 'sender': 'service'}
+    sqs_client.send_message_batch(SupervisedRootPC.PC_SQS_QUEUE, [{'Id': '0', 'MessageBody': json.dumps(body)}])
+
+    supervisor = Supervisor(SupervisedRootPC, drain_timeout=20)
+    thread = self.run_supervisor(supervisor)
+    self.assertTrue(wait_for(lambda: os.path.exists(path + '.started')))
+    supervisor.stop()
+    thread.join()
+
+    self.assertTrue(os.path.exists(path + '.done'))
+    self.assertEqual([0], [process.exitcode for process in supervisor.processes])
+    queue = sqs_client.get_queue_by_name(SupervisedRootPC.PC_SQS_QUEUE)
+    self.assertEqual([], queue.receive_messages(VisibilityTimeout=0))
@@ -0,0 +1,192 @@
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from .fifo import GroupBlockedError
+
+logger = logging.getLogger(__name__)
+
+# consumers built in the worker processes, by consumer class
+_process_consumers = {}
+
+
+def _process_consumer(consumer_class):
+  """Get the consumer of the process, built once per process."""
+  consumer = _process_consumers.get(consumer_class)
+  if consumer is None:
+    consumer = _process_consumers[consumer_class] = consumer_class()
+  return consumer
+
+
+def _consume_in_process(consumer_class, msg):
+  """Entry point of the process pool."""
+  _process_consumer(consumer_class)._consume_msg(msg)
+
+
+def _consume_ordered(consume, msgs_list):
+  """Consume the msgs of each message one after the other, stop at the first failure.
+
+    Return the list of (msg, error) of each message, the msgs after the failure get a GroupBlockedError.
+  """
+  results = []
+  failed = False
+  for msgs in msgs_list:
+    failures = []
+    for msg in msgs:
+      if failed:
+        failures.append((msg, GroupBlockedError('Not consumed after the failure of a previous item of the group.')))
+        continue
+      try:
+        consume(msg)
+      except Exception as e:
+        failures.append((msg, e))
+        failed = True
+    results.append(failures)
+  return results
+
+
+def _consume_ordered_in_process(consumer_class, msgs_list):
+  """Entry point of the process pool for the messages of a group."""
+  return _consume_ordered(_process_consumer(consumer_class)._consume_msg, msgs_list)
+
+
+class WorkerPool(object):
+  """Run the consumer actions concurrently on a pool of threads or processes.
+
+    Each sqs message takes one of the `max_in_flight` slots until all its actions are done,
+    `submit` blocks when there is no free slot so the consumer stop receiving new messages.
+    `on_done` is called with the sqs message and the list of (msg, error) of it failed actions
+    once all its actions are done.
+    The messages of a group of a fifo queue are run in order by `submit_ordered`.
+  """
+
+  EXECUTORS = ('thread', 'process')
+
+  def __init__(self, consumer, workers, executor='thread', max_in_flight=None, on_done=None):
+    """Start the pool."""
+    assert(executor in self.EXECUTORS)
+    self.consumer = consumer
+    self.on_done = on_done
+    self.errors = []
+    self.in_flight = 0
+
+    # keep at least one receive batch in flight
+    self.max_in_flight = max_in_flight or max(workers * 2, 10)
+    self._slots = threading.BoundedSemaphore(self.max_in_flight)
+    self._lock = threading.Lock()
+    self._idle = threading.Condition(self._lock)
+    # the slots of a group are taken by one caller at a time, two callers holding part of the slots
+    # they need would wait for each other forever
+    self._reserve_lock = threading.Lock()
+
+    if executor == 'process':
+      # the consumer class is sent to the processes, it must be importable (defined at module level)
+      self._executor = ProcessPoolExecutor(max_workers=workers)
+      self._task = lambda msg: self._executor.submit(_consume_in_process, consumer.__class__, msg)
+      self._ordered_task = lambda msgs_list: self._executor.submit(_consume_ordered_in_process, consumer.__class__, msgs_list)
+    else:
+      self._executor = ThreadPoolExecutor(max_workers=workers)
+      self._task = lambda msg: self._executor.submit(consumer._consume_msg, msg)
+      self._ordered_task = lambda msgs_list: self._executor.submit(_consume_ordered, consumer._consume_msg, msgs_list)
+
+  def submit(self, message, msgs, on_done=None):
+    """Run the actions of one sqs message, wait for a free slot first, `on_done` replace the one of the pool."""
+    self._slots.acquire()
+    with self._lock:
+      self.in_flight += 1
+    if not msgs:
+      self._done(message, [], on_done)
+      return
+
+    remaining = [len(msgs)]
+    failures = []
+    released = [False] # the slot is freed once, by the last action done or by a failed submit
+
+    def task_done(msg, future):
+      error = future.exception()
+      with self._lock:
+        if error is not None:
+          failures.append((msg, error))
+        remaining[0] -= 1
+        finished = not remaining[0] and not released[0]
+        released[0] = released[0] or finished
+      if finished:
+        self._done(message, failures, on_done)
+
+    try:
+      for msg in msgs:
+        self._task(msg).add_done_callback(partial(task_done, msg))
+    except Exception:
+      # the executor is broken or shut down, the actions submitted will never be acknowledged
+      with self._lock:
+        release = not released[0]
+        released[0] = True
+      if release:
+        self._release()
+      raise
+
+  def submit_ordered(self, messages, on_done=None):
+    """Run the actions of the (sqs message, msgs) of one group one after the other, as one task.
+
+      After a failure the next actions are not run. Each message takes a slot, they are all taken
+      before the task is run, `on_done` is called for each of them once the task is done.
+    """
+    assert(len(messages) <= self.max_in_flight)
+    with self._reserve_lock:
+      for _ in messages:
+        self._slots.acquire()
+        with self._lock:
+          self.in_flight += 1
+
+    try:
+      future = self._ordered_task([msgs for _, msgs in messages])
+    except Exception:
+      for _ in messages:
+        self._release()
+      raise
+
+    def task_done(future):
+      error = future.exception()
+      results = future.result() if error is None else [[(msg, error) for msg in msgs] for _, msgs in messages]
+      for (message, _), failures in zip(messages, results):
+        self._done(message, failures, on_done)
+
+    future.add_done_callback(task_done)
+
+  def available(self):
+    """Number of sqs messages that can be submitted without waiting."""
+    with self._lock:
+      return self.max_in_flight - self.in_flight
+
+  def join(self):
+    """Wait until no message is in flight, the `on_done` of all of them called."""
+    with self._lock:
+      while self.in_flight:
+        self._idle.wait()
+
+  def shutdown(self):
+    """Wait for the actions in flight then stop the workers."""
+    self._executor.shutdown(wait=True)
+
+  def _done(self, message, failures, on_done=None):
+    """All the actions of the sqs message are done."""
+    on_done = on_done or self.on_done
+    try:
+      if failures:
+        with self._lock:
+          self.errors.extend(error for _, error in failures)
+      if on_done:
+        on_done(message, failures)
+    except Exception:
+      logger.exception('Failed to acknowledge message %s.', message.message_id)
+    finally:
+      self._release()
+
+  def _release(self):
+    """Free the slot of a sqs message."""
+    with self._lock:
+      self.in_flight -= 1
+      if not self.in_flight:
+        self._idle.notify_all()
+    self._slots.release()
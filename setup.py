@@ -12,10 +12,22 @@ setup(
     url='https://github.com/LUXEYS/paper_cup',
     author_email='bryan@luxeys.com',
     description='Microservices communication system powered with paper cup engine!',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     install_requires=[
-        'boto3==1.9.170',
+        # sns publish_batch and the fifo topics need a newer boto3, it doesn't support python 2 and 3.5
+        'boto3>=1.9.170; python_version < "3.6"',
+        'boto3>=1.20.5; python_version >= "3.6"',
+        'futures; python_version < "3"',
     ],
+    extras_require={
+        # optional codecs, see PC_CODEC and PC_COMPRESSION
+        'orjson': ['orjson'],
+        'msgpack': ['msgpack'],
+        'zstd': ['zstandard'],
+    },
+    entry_points={
+        'console_scripts': ['paper-cup = paper_cup.cli:main'],
+    },
     long_description_content_type="text/markdown",
     long_description=long_description,
     classifiers=[